@@ -0,0 +1,257 @@
+import gc
+import hashlib
+import lzma
+import os
+import pickle
+import shutil
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# bump when the shape of the cached bank data changes
+CACHE_VERSION = 1
+CACHE_MAGIC = b"BNKC"
+KEY_SIZE = 16
+
+COMPRESSIONS = ["none", "zlib", "lzma"]
+
+
+def compress(data, compression):
+    if compression == "zlib":
+        return zlib.compress(data, 1)
+    if compression == "lzma":
+        return lzma.compress(data, preset=1)
+    return data
+
+
+def decompress(data, compression):
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "lzma":
+        return lzma.decompress(data)
+    return data
+
+
+def hashFile(digest, path):
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+
+
+def getBankCacheKey(xml_path, bank_root, extra="", extra_files=()):
+    # content hash of the wwiser dump (None when the banks are parsed directly), of every .bnk
+    # it was made from and of `extra_files` that exist (name lists)
+    digest = hashlib.blake2b(digest_size=KEY_SIZE)
+    digest.update(f"{CACHE_VERSION}:{extra}".encode())
+    if xml_path is not None:
+        hashFile(digest, xml_path)
+    for path in extra_files:
+        if os.path.exists(path):
+            digest.update(path.encode())
+            hashFile(digest, path)
+    for root, dirs, files in os.walk(bank_root):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".bnk"):
+                path = os.path.join(root, file)
+                digest.update(os.path.relpath(path, bank_root).replace("\\", "/").encode())
+                hashFile(digest, path)
+    return digest.digest()
+
+
+def loadBankCache(path, key=None):
+    # None when missing, stale or unreadable; key=None accepts any key
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        header = f.read(len(CACHE_MAGIC) + 2 + KEY_SIZE)
+        if len(header) != len(CACHE_MAGIC) + 2 + KEY_SIZE or header[:4] != CACHE_MAGIC:
+            return None
+        version, compression = header[4], header[5]
+        if version != CACHE_VERSION or compression >= len(COMPRESSIONS):
+            return None
+        if key is not None and header[6:] != key:
+            return None
+        data = f.read()
+    # millions of small dicts, the cyclic GC would otherwise rescan them over and over while loading
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(decompress(data, COMPRESSIONS[compression]))
+    except (pickle.UnpicklingError, zlib.error, lzma.LZMAError, EOFError):
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def saveBankCache(path, key, data, compression="zlib"):
+    # returns the uncompressed size
+    raw = pickle.dumps(data, protocol=5)
+    payload = compress(raw, compression)
+    with open(path + ".tmp", 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(bytes([CACHE_VERSION, COMPRESSIONS.index(compression)]))
+        f.write(key)
+        f.write(payload)
+    os.replace(path + ".tmp", path)
+    return len(raw)
+
+
+# default LRU budget, counted in pickled bytes of the resident banks
+DEFAULT_MAX_BYTES = 256 << 20
+
+
+def getBankAliases(filename, bank):
+    # every name a Play action may use in its bankID for this bank
+    aliases = {filename[:-4] if filename.endswith(".bnk") else filename}
+    header = bank.get("BankHeader", {}).get("AkBankHeader", {}).get("dwSoundBankID", {})
+    for attr in ["@value", "@hashname", "@guidname"]:
+        if header.get(attr):
+            aliases.add(header[attr])
+    return sorted(aliases)
+
+
+def getLoadedItems(bank):
+    # HIRC item id -> item
+    hirc = bank.get("HircChunk", {})
+    loaded_items = hirc.get("listLoadedItem", [])
+    loaded_items_map = {}
+    for item in loaded_items:
+        loaded_items_map[item.get("ulID", item.get("ulStateID", ""))["@value"]] = item
+    return loaded_items_map
+
+
+class BankStoreWriter:
+    # writes one shard per bank as they stream in, then the index
+    def __init__(self, root, key, compression="zlib"):
+        self.root = root
+        self.key = key
+        self.compression = compression
+        self.index = {}
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        os.makedirs(root)
+
+    def add(self, lang, filename, bank):
+        shard = f"{lang}/{filename}.bin"
+        os.makedirs(os.path.join(self.root, lang), exist_ok=True)
+        size = saveBankCache(os.path.join(self.root, shard), self.key, bank, self.compression)
+        self.index.setdefault(lang, {})[filename] = {
+            "shard": shard,
+            "size": size,
+            "aliases": getBankAliases(filename, bank),
+        }
+
+    def close(self):
+        saveBankCache(os.path.join(self.root, "index.bin"), self.key, self.index, "none")
+        return BankStore(self.root, self.key, self.index)
+
+
+class BankStore:
+    # bank_dict replacement: store[lang][filename] loads that bank's shard on demand and keeps
+    # the most recently used banks in memory, up to `max_bytes`
+    def __init__(self, root, key, index, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.key = key
+        self.index = index
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.derived = {}
+        self.resolved = {}
+        self.aliases = {}
+        for lang, banks in index.items():
+            self.aliases[lang] = {}
+            for filename, entry in banks.items():
+                for alias in entry["aliases"]:
+                    self.aliases[lang].setdefault(alias, filename)
+
+    @classmethod
+    def open(cls, root, key=None, max_bytes=DEFAULT_MAX_BYTES):
+        # None when the store is missing or was built from other inputs
+        index = loadBankCache(os.path.join(root, "index.bin"), key)
+        if index is None:
+            return None
+        if key is None:
+            with open(os.path.join(root, "index.bin"), 'rb') as f:
+                key = f.read(len(CACHE_MAGIC) + 2 + KEY_SIZE)[-KEY_SIZE:]
+        return cls(root, key, index, max_bytes)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, lang):
+        return lang in self.index
+
+    def __getitem__(self, lang):
+        if lang not in self.index:
+            raise KeyError(lang)
+        return BankShelf(self, lang)
+
+    def load(self, lang, filename):
+        entry = self.index[lang][filename]
+        cache_key = (lang, filename)
+        if cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            return self.cache[cache_key]
+        bank = loadBankCache(os.path.join(self.root, entry["shard"]), self.key)
+        if bank is None:
+            raise KeyError(f"bank shard {entry['shard']} is missing or outdated")
+        self.cache[cache_key] = bank
+        self.cached_bytes += entry["size"]
+        while self.cached_bytes > self.max_bytes and len(self.cache) > 1:
+            evicted, _ = self.cache.popitem(last=False)
+            self.derived.pop(evicted, None)
+            self.cached_bytes -= self.index[evicted[0]][evicted[1]]["size"]
+        return bank
+
+    def getDerived(self, lang, filename):
+        # scratch dict for data computed from a bank, dropped together with the bank on eviction
+        self.load(lang, filename)
+        return self.derived.setdefault((lang, filename), {})
+
+    def loadedItems(self, lang, filename):
+        # the HIRC index of a bank, built once per load
+        derived = self.getDerived(lang, filename)
+        if "loaded_items" not in derived:
+            derived["loaded_items"] = getLoadedItems(self.load(lang, filename))
+        return derived["loaded_items"]
+
+    def findBank(self, lang, bank_id):
+        # filename of the bank a wwiser `bankID` field points to, by id, hashname or guidname
+        cache_key = (lang, bank_id.get("@value", ""), bank_id.get("@hashname", ""), bank_id.get("@guidname", ""))
+        if cache_key in self.resolved:
+            return self.resolved[cache_key]
+        aliases = self.aliases.get(lang, {})
+        filename = None
+        for name in cache_key[1:]:
+            if name and name in aliases:
+                filename = aliases[name]
+                break
+        self.resolved[cache_key] = filename
+        return filename
+
+
+class BankShelf(Mapping):
+    # one language of a BankStore, iterating it only reads the index
+    def __init__(self, store, lang):
+        self.store = store
+        self.lang = lang
+
+    def __iter__(self):
+        return iter(self.store.index[self.lang])
+
+    def __len__(self):
+        return len(self.store.index[self.lang])
+
+    def __contains__(self, filename):
+        return filename in self.store.index[self.lang]
+
+    def __getitem__(self, filename):
+        if filename not in self.store.index[self.lang]:
+            raise KeyError(filename)
+        return self.store.load(self.lang, filename)
@@ -0,0 +1,231 @@
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+import bank_cache
+import convert_ogg
+import fnv_index
+
+
+def timeIt(func, *args, rounds=5):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmarkChecksum(size=1 << 20, page_size=4096, rounds=5):
+    # Ogg pages are small, so checksum many page-sized buffers rather than one big blob
+    data = os.urandom(size)
+    pages = [bytearray(data[i:i + page_size]) for i in range(0, size, page_size)]
+    reference = [convert_ogg.get_oggs_checksum_python(page) for page in pages]
+
+    print(f"[Bench] Ogg CRC over {size / (1 << 20):.2f} MB in {len(pages)} pages of {page_size} bytes")
+    for name, func in convert_ogg.CHECKSUM_BACKENDS.items():
+        if [func(page) for page in pages] != reference:
+            print(f"[Bench] {name}: MISMATCH against python backend!")
+            continue
+        elapsed = timeIt(lambda: [func(page) for page in pages], rounds=rounds)
+        print(f"[Bench] {name}: {size / (1 << 20) / elapsed:.2f} MB/s")
+
+
+def benchmarkFnv(count=100000, bits=32, rounds=3):
+    # batch name hashing, names shaped like the wwnames lists
+    names = [f"vo_{i % 97}_amb_emitter_{i}" for i in range(count)]
+    reference = [fnv_index.fnv(name, bits) for name in names]
+    print(f"[Bench] FNV-{bits} over {count} names")
+    for name in fnv_index.HASH_BACKENDS:
+        fnv_index.setHashBackend(name)
+        if fnv_index.hashNames(names, bits) != reference:
+            print(f"[Bench] {name}: MISMATCH against the single-name hash!")
+            continue
+        elapsed = timeIt(fnv_index.hashNames, names, bits, rounds=rounds)
+        print(f"[Bench] {name}: {count / elapsed / 1e6:.2f} M names/s")
+
+
+def benchmarkBankCache(store_path="output/unpack/bank_shards", rounds=3):
+    # cold-start reload of the parsed bank data: the old indented JSON file vs. the binary cache
+    store = bank_cache.BankStore.open(store_path)
+    if store is None:
+        print(f"[Bench] {store_path} is missing or unreadable, run loadBankXml first.")
+        return
+    data = {lang: {name: store[lang][name] for name in store[lang]} for lang in store}
+    key = store.key
+    with tempfile.TemporaryDirectory() as temp:
+        json_path = os.path.join(temp, "banks_temp.json")
+        start = time.perf_counter()
+        with open(json_path, 'w') as f:
+            json.dump(data, f, indent=4)
+        save = time.perf_counter() - start
+
+        def loadJson():
+            with open(json_path, 'r') as f:
+                json.load(f)
+        load = timeIt(loadJson, rounds=rounds)
+        print(f"[Bench] json (indent=4): {os.path.getsize(json_path) / (1 << 20):.1f} MB, "
+              f"save {save:.2f}s, load {load:.2f}s")
+
+        def loadStore():
+            fresh = bank_cache.BankStore.open(store_path, key)
+            for lang in fresh:
+                for name in fresh[lang]:
+                    fresh[lang][name]
+        load = timeIt(loadStore, rounds=rounds)
+        print(f"[Bench] shards (every bank): save n/a, load {load:.2f}s")
+        load = timeIt(bank_cache.BankStore.open, store_path, key, rounds=rounds)
+        print(f"[Bench] shards (index only): load {load:.4f}s")
+
+        for compression in bank_cache.COMPRESSIONS:
+            path = os.path.join(temp, f"banks_temp.{compression}")
+            start = time.perf_counter()
+            bank_cache.saveBankCache(path, key, data, compression)
+            save = time.perf_counter() - start
+            load = timeIt(bank_cache.loadBankCache, path, key, rounds=rounds)
+            print(f"[Bench] pickle 5 + {compression}: {os.path.getsize(path) / (1 << 20):.1f} MB, "
+                  f"save {save:.2f}s, load {load:.2f}s")
+
+
+def makeEventBanks(count):
+    # one event bank with `count` events, each playing its own sound from one shared sound bank
+    events, sounds = [], []
+    for i in range(count):
+        event_id, action_id, sound_id, source_id = (str(1000000 + i * 4 + j) for j in range(4))
+        events.append({"@name": "CAkEvent", "ulID": {"@value": event_id, "@hashname": f"Play_{i}"},
+                       "EventInitialValues": {"actions": [{"ulActionID": {"@value": action_id}}]}})
+        events.append({"@name": "CAkActionPlay", "ulID": {"@value": action_id},
+                       "ActionInitialValues": {"idExt": {"@value": sound_id},
+                                               "PlayActionParams": {"bankID": {"@value": "2", "@hashname": "Sounds"}}}})
+        sounds.append({"@name": "CAkSound", "@index": str(i), "ulID": {"@value": sound_id},
+                       "SoundInitialValues": {"AkBankSourceData": {"AkMediaInformation": {
+                           "sourceID": {"@value": source_id},
+                           "uSourceBits": {"bIsLanguageSpecific": {"@value": "0"}}}}}})
+
+    def bank(filename, bank_id, items):
+        return {"@filename": filename, "@path": "./output/unpack/sfx",
+                "BankHeader": {"AkBankHeader": {"dwSoundBankID": {"@value": bank_id}}},
+                "HircChunk": {"listLoadedItem": items}}
+    return bank("Events.bnk", "1", events), bank("Sounds.bnk", "2", sounds)
+
+
+def benchmarkEventRenames(counts=(1000, 2000, 4000, 8000), rounds=3):
+    # the event pass should cost the same per event however large the banks get
+    import main
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp:
+        os.chdir(temp)
+        try:
+            for count in counts:
+                events, sounds = makeEventBanks(count)
+                writer = bank_cache.BankStoreWriter(os.path.join(temp, f"store_{count}"), b"\0" * bank_cache.KEY_SIZE, "none")
+                writer.add("SFX", "Events.bnk", events)
+                writer.add("SFX", "Sounds.bnk", sounds)
+                main.bank_dict = writer.close()
+                renames, _ = main.collectEventRenames("SFX", "Events.bnk")
+                if len(renames) != count:
+                    print(f"[Bench] {count} events: expected {count} renames, got {len(renames)}!")
+                    continue
+                elapsed = timeIt(main.collectEventRenames, "SFX", "Events.bnk", rounds=rounds)
+                print(f"[Bench] {count} events: {elapsed:.3f}s, {elapsed / count * 1e6:.1f} us/event")
+        finally:
+            os.chdir(cwd)
+
+
+def findDifference(a, b, path=""):
+    # first path where two bank dicts differ, None when equal
+    if type(a) != type(b):
+        return path or "/"
+    if isinstance(a, dict):
+        for key in a.keys() | b.keys():
+            if key not in a or key not in b:
+                return f"{path}/{key}"
+            found = findDifference(a[key], b[key], f"{path}/{key}")
+            if found is not None:
+                return found
+        return None
+    if isinstance(a, list):
+        if len(a) != len(b):
+            return f"{path}[{len(a)} != {len(b)}]"
+        for i, (x, y) in enumerate(zip(a, b)):
+            found = findDifference(x, y, f"{path}[{i}]")
+            if found is not None:
+                return found
+        return None
+    return None if a == b else f"{path} ({a!r} != {b!r})"
+
+
+def benchmarkBankParse(xml_path=None, bank_glob=None, all_types=False):
+    # parity and speed of the in-process bank parse against the wwiser dumps generateBankData wrote
+    # (or a single `xml_path` dump)
+    import main
+
+    hirc_types = None if all_types else main.RENAME_HIRC_TYPES
+    if xml_path is not None:
+        xml_paths = [xml_path]
+    else:
+        xml_paths = [main.getBankDumpPath(key) for key in sorted(main.loadManifest(main.BANK_DUMP_MANIFEST, "Bench"))]
+    start = time.perf_counter()
+    dumped = {bank["@filename"]: bank for path in xml_paths for bank in main.iterBankXml(path, hirc_types)}
+    xml_time = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = {bank["@filename"]: bank for bank in main.iterBankNodes(glob.glob(bank_glob or main.BANK_GLOB), hirc_types)}
+    native_time = time.perf_counter() - start
+    mismatches = 0
+    for name in dumped.keys() | parsed.keys():
+        if name not in parsed or name not in dumped:
+            print(f"[Bench] {name}: only in {'the dump' if name in dumped else 'the parse'}!")
+            mismatches += 1
+            continue
+        found = findDifference(dumped[name], parsed[name])
+        if found is not None:
+            print(f"[Bench] {name}: MISMATCH at {found}")
+            mismatches += 1
+    print(f"[Bench] {len(dumped)} banks, {mismatches} mismatches")
+    print(f"[Bench] dump load {xml_time:.2f}s (not counting the dump), in-process parse {native_time:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the extractor hot paths.")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    crc = sub.add_parser("crc", help="Ogg page checksum backends")
+    crc.add_argument("--size", type=float, default=1, help="data size in MB")
+    crc.add_argument("--page-size", type=int, default=4096)
+    crc.add_argument("--rounds", type=int, default=5)
+
+    fnv = sub.add_parser("fnv", help="batch FNV name hashing backends")
+    fnv.add_argument("--count", type=int, default=100000)
+    fnv.add_argument("--bits", type=int, choices=[32, 64], default=32)
+    fnv.add_argument("--rounds", type=int, default=3)
+
+    cache = sub.add_parser("bank-cache", help="bank data cache reload, JSON vs. binary")
+    cache.add_argument("--store", default="output/unpack/bank_shards")
+    cache.add_argument("--rounds", type=int, default=3)
+
+    events = sub.add_parser("events", help="event rename pass on synthetic banks")
+    events.add_argument("--counts", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    events.add_argument("--rounds", type=int, default=3)
+
+    parse = sub.add_parser("bank-parse", help="in-process bank parse vs. the wwiser XML dump, parity and speed")
+    parse.add_argument("--xml", default=None, help="a single dump, the per-bank dumps by default")
+    parse.add_argument("--banks", default=None, help="bank glob, the one generateBankData uses by default")
+    parse.add_argument("--all-types", action="store_true", help="compare every HIRC object, not only the renamed ones")
+
+    args = parser.parse_args()
+    if args.bench == "crc":
+        benchmarkChecksum(int(args.size * (1 << 20)), args.page_size, args.rounds)
+    elif args.bench == "fnv":
+        benchmarkFnv(args.count, args.bits, args.rounds)
+    elif args.bench == "bank-cache":
+        benchmarkBankCache(args.store, args.rounds)
+    elif args.bench == "events":
+        benchmarkEventRenames(args.counts, args.rounds)
+    elif args.bench == "bank-parse":
+        benchmarkBankParse(args.xml, args.banks, args.all_types)
@@ -0,0 +1,134 @@
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BnkReader:
+    # chunk table of a soundbank plus its embedded wems (DIDX index into the DATA chunk),
+    # read from a buffer; wems are memoryview slices of it
+    def __init__(self, data, name="<buffer>"):
+        self.data = memoryview(data)
+        self.name = name
+        self.endian = "<"
+        self.chunks = {}
+        self.parse()
+
+    def parse(self):
+        if bytes(self.data[:4]) != b"BKHD":
+            raise ValueError(f"{self.name} is not a soundbank")
+        # the bank version right after BKHD is small, a huge value means the sizes are big-endian
+        if len(self.data) >= 12 and struct.unpack_from("<I", self.data, 8)[0] > 0xFFFF:
+            self.endian = ">"
+        pos = 0
+        while pos + 8 <= len(self.data):
+            tag = bytes(self.data[pos:pos + 4])
+            size = struct.unpack_from(self.endian + "I", self.data, pos + 4)[0]
+            if pos + 8 + size > len(self.data):
+                raise ValueError(f"{tag.decode(errors='replace')} chunk runs past the end of {self.name}")
+            self.chunks.setdefault(tag, (pos + 8, size))
+            pos += 8 + size
+
+    def entries(self):
+        # (wem id, offset, size), offsets already made absolute
+        if b"DIDX" not in self.chunks or b"DATA" not in self.chunks:
+            return []
+        didx_offset, didx_size = self.chunks[b"DIDX"]
+        data_offset, data_size = self.chunks[b"DATA"]
+        entries = []
+        for i in range(didx_size // 12):
+            wem_id, offset, size = struct.unpack_from(self.endian + "3I", self.data, didx_offset + i * 12)
+            if offset + size > data_size:
+                raise ValueError(f"wem {wem_id} runs past the DATA chunk of {self.name}")
+            entries.append((wem_id, data_offset + offset, size))
+        return entries
+
+    def wems(self):
+        for wem_id, offset, size in self.entries():
+            yield wem_id, self.data[offset:offset + size]
+
+    def release(self):
+        self.data.release()
+
+
+def mapFile(path):
+    # (mmap or None, memoryview) of a whole file
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None, memoryview(b'')
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, memoryview(mapped)
+
+
+def writeWem(path, data):
+    # replaced rather than truncated, like pck.writeEntry: the old file may be hardlinked elsewhere
+    with open(path + ".tmp", 'wb') as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def extractBank(data, output_dir, name="<buffer>", claim=None):
+    # writes every embedded wem as <output_dir>/<id>.wem, replacing what an older extraction left there;
+    # claim(path) tells whether this bank is the one to write it, None writes them all.
+    # Returns (files, bytes) written
+    if isinstance(data, str):
+        mapped, view = mapFile(data)
+        try:
+            return extractBank(view, output_dir, data, claim)
+        finally:
+            view.release()
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # a wem slice is still alive, the mapping goes with it
+                    pass
+    reader = BnkReader(data, name)
+    count = 0
+    written = 0
+    try:
+        for wem_id, wem in reader.wems():
+            try:
+                path = os.path.join(output_dir, f"{wem_id}.wem")
+                if claim is None or claim(path):
+                    writeWem(path, wem)
+                    count += 1
+                    written += len(wem)
+            finally:
+                wem.release()
+    finally:
+        reader.release()
+    return count, written
+
+
+def extractBanks(banks, workers=None, keep=()):
+    # banks: (path or buffer, output dir, name) tuples, extracted in parallel; a broken bank is
+    # reported and skipped. The first bank to write an id wins, like quickbms -k, and the paths in
+    # `keep` (the loose wems of the packages) are not written at all. Returns (files, bytes) written
+    for directory in {bank[1] for bank in banks}:
+        os.makedirs(directory, exist_ok=True)
+    claimed = {os.path.normpath(path) for path in keep}
+    lock = threading.Lock()
+
+    def claim(path):
+        path = os.path.normpath(path)
+        with lock:
+            if path in claimed:
+                return False
+            claimed.add(path)
+            return True
+
+    count = 0
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) * 2)) as executor:
+        futures = [executor.submit(extractBank, *bank, claim) for bank in banks]
+        for future in futures:
+            try:
+                files, size = future.result()
+            except ValueError as e:
+                print(f"[Bnk] ERR: {e}")
+                continue
+            count += files
+            written += size
+    return count, written
@@ -2,9 +2,20 @@ import struct
 import sys
 import os
 import argparse
+import array
+import mmap
+try:
+    import zlib
+except ImportError:
+    zlib = None
+# bump when the produced .ogg files change, so the decode manifest re-converts them
+CONVERTER_VERSION = 2
+
 # CRC32 implementation for Ogg
 # Poly: 0x04c11db7
 CRC_TABLE = []
+# CRC_TABLES[k][b] is the CRC of byte b followed by k zero bytes (slicing-by-8)
+CRC_TABLES = []
 
 def init_crc_table():
     global CRC_TABLE
@@ -21,7 +32,21 @@ def init_crc_table():
 
 init_crc_table()
 
-def get_oggs_checksum(data):
+def init_crc_tables():
+    CRC_TABLES.append(CRC_TABLE)
+    for k in range(1, 8):
+        prev = CRC_TABLES[k - 1]
+        CRC_TABLES.append([((r << 8) & 0xFFFFFFFF) ^ CRC_TABLE[r >> 24] for r in prev])
+
+init_crc_tables()
+
+# Ogg uses the non-reflected CRC with init 0 and no final xor, zlib the reflected one.
+# Feeding zlib bit-reversed bytes and bit-reversing its result gives the Ogg CRC.
+REVERSED_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def get_oggs_checksum_python(data):
+    # Reference implementation, one table lookup per byte
     crc = 0
     for byte in data:
         crc = (crc << 8) ^ CRC_TABLE[((crc >> 24) & 0xFF) ^ byte]
@@ -29,43 +54,221 @@ def get_oggs_checksum(data):
     return crc
 
 
-class WwiseOpusConverter:
+def get_oggs_checksum_slice8(data):
+    t0, t1, t2, t3, t4, t5, t6, t7 = CRC_TABLES
+    crc = 0
+    size = len(data) & ~7
+    for hi, lo in struct.iter_unpack('>II', memoryview(data)[:size]):
+        crc ^= hi
+        crc = (t7[crc >> 24] ^ t6[(crc >> 16) & 0xFF] ^ t5[(crc >> 8) & 0xFF] ^ t4[crc & 0xFF] ^
+               t3[lo >> 24] ^ t2[(lo >> 16) & 0xFF] ^ t1[(lo >> 8) & 0xFF] ^ t0[lo & 0xFF])
+    for byte in data[size:]:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ t0[(crc >> 24) ^ byte]
+    return crc
+
+
+def get_oggs_checksum_zlib(data):
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    crc = zlib.crc32(data.translate(REVERSED_BITS), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int.from_bytes(crc.to_bytes(4, 'little').translate(REVERSED_BITS), 'big')
+
+
+CHECKSUM_BACKENDS = {
+    "python": get_oggs_checksum_python,
+    "slice8": get_oggs_checksum_slice8,
+}
+if zlib is not None:
+    CHECKSUM_BACKENDS["zlib"] = get_oggs_checksum_zlib
+
+checksum_backend = "zlib" if "zlib" in CHECKSUM_BACKENDS else "slice8"
+
+
+def set_checksum_backend(name):
+    global checksum_backend
+    if name not in CHECKSUM_BACKENDS:
+        raise ValueError(f"Unknown checksum backend {name}, available: {', '.join(CHECKSUM_BACKENDS)}")
+    checksum_backend = name
+
+
+def get_oggs_checksum(data):
+    return CHECKSUM_BACKENDS[checksum_backend](data)
+
+
+OGG_FLAG_CONTINUED = 0x01
+OGG_FLAG_BOS = 0x02
+OGG_FLAG_EOS = 0x04
+# granule position of a page on which no packet ends
+OGG_NO_GRANULE = 0xFFFFFFFFFFFFFFFF
+
+# default page packing targets, about what libogg/libopusenc produce
+OGG_PAGE_BYTES = 4096
+OGG_PAGE_SAMPLES = 48000
+
+
+def build_ogg_page(flags, granule, stream_serial, sequence, segment_table, payload):
+    # Header (0x1B bytes) + Lacing values + Data
+    page = bytearray(b'OggS')
+    page.append(0) # Version
+    page.append(flags)
+    page.extend(struct.pack('<QII', granule, stream_serial, sequence))
+    page.extend(b'\x00\x00\x00\x00') # Checksum placeholder
+    page.append(len(segment_table))
+    page += segment_table
+    page += payload
+    # Write CRC at offset 22
+    struct.pack_into('<I', page, 22, get_oggs_checksum(page))
+    return page
+
+
+class OggPageWriter:
+    # Packs packets into pages of up to `max_page_bytes` payload / `max_page_samples` of granule,
+    # a page always carries the granule of the last packet that ends on it.
+    # The last page is held back until close() so it can be flagged EOS.
+    def __init__(self, outfile, stream_serial, max_page_bytes=OGG_PAGE_BYTES, max_page_samples=OGG_PAGE_SAMPLES):
+        self.outfile = outfile
+        self.stream_serial = stream_serial
+        self.max_page_bytes = max_page_bytes
+        self.max_page_samples = max_page_samples
+        self.sequence = 0
+        self.pages = 0
+        self.segments = bytearray()
+        self.payload = bytearray()
+        self.granule = OGG_NO_GRANULE
+        self.page_start_granule = 0
+        self.continued = False
+        self.full = False
+
+    def write_page(self, eos=False):
+        flags = 0
+        if self.sequence == 0: flags |= OGG_FLAG_BOS
+        if self.continued: flags |= OGG_FLAG_CONTINUED
+        if eos: flags |= OGG_FLAG_EOS
+        self.outfile.write(build_ogg_page(flags, self.granule, self.stream_serial, self.sequence,
+                                          self.segments, self.payload))
+        self.sequence += 1
+        self.pages += 1
+        if self.granule != OGG_NO_GRANULE:
+            self.page_start_granule = self.granule
+        self.segments = bytearray()
+        self.payload = bytearray()
+        self.granule = OGG_NO_GRANULE
+        self.continued = False
+        self.full = False
+
+    def add_packet(self, packet, granule):
+        size = len(packet)
+        lacing = size // 255 + 1
+        if self.segments and (self.full or len(self.segments) + lacing > 255
+                              or len(self.payload) + size > self.max_page_bytes):
+            self.write_page()
+
+        # a packet longer than the page's 255 lacing values continues on the next page
+        offset = 0
+        while lacing > 255 - len(self.segments):
+            count = 255 - len(self.segments)
+            self.segments.extend(b'\xff' * count)
+            self.payload += packet[offset:offset + count * 255]
+            offset += count * 255
+            lacing -= count
+            self.write_page()
+            self.continued = True
+
+        self.segments.extend(b'\xff' * (lacing - 1))
+        self.segments.append((size - offset) % 255)
+        self.payload += packet[offset:]
+        self.granule = granule
+        if (len(self.payload) >= self.max_page_bytes
+                or granule - self.page_start_granule >= self.max_page_samples):
+            self.full = True
+
+    def flush(self):
+        # end the current page now, headers need their own pages
+        if self.segments:
+            self.write_page()
+
+    def close(self):
+        if self.segments:
+            self.write_page(eos=True)
+
+
+class WemReader:
     def __init__(self, input_path):
         self.input_path = input_path
-        self.file_size = os.path.getsize(input_path)
-        self.data = open(input_path, 'rb')
+        self.file = None
+        self.mmap = None
+        if isinstance(input_path, (bytes, bytearray, memoryview)):
+            # already in memory (e.g. a slice of a mapped .pck), read it in place
+            self.input_path = "<buffer>"
+            self.data = memoryview(input_path)
+            self.file_size = len(self.data)
+            self.pos = 0
+            self.big_endian = False
+            return
+        # The whole file is mapped read-only, fields are decoded straight from the mapping
+        # and packet payloads are memoryview slices of it, so nothing is copied until the page is built.
+        self.file = open(input_path, 'rb')
+        self.file_size = os.fstat(self.file.fileno()).st_size
+        if self.file_size > 0:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self.mmap)
+        else:
+            self.data = memoryview(b'')
+        self.pos = 0
         self.big_endian = False
-        
-        # Header info
-        self.channels = 0
-        self.sample_rate = 0
-        self.total_samples = 0
-        self.seek_offset = 0
-        self.seek_size = 0
-        self.data_offset = 0
-        self.data_size = 0
-        
-        # State
-        self.packet_sizes = []
-        
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # a payload slice is still alive (e.g. held by a traceback), the mapping goes with it
+                pass
+            self.mmap = None
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+
+    def seek(self, offset):
+        self.pos = offset
+
+    def read(self, size):
+        # memoryview slice, shorter than `size` at EOF
+        b = self.data[self.pos:self.pos + size]
+        self.pos += len(b)
+        return b
+
     def read_u32(self):
-        b = self.data.read(4)
-        if len(b) < 4: return 0
+        if self.pos + 4 > self.file_size: return 0
         fmt = '>I' if self.big_endian else '<I'
-        return struct.unpack(fmt, b)[0]
+        value = struct.unpack_from(fmt, self.data, self.pos)[0]
+        self.pos += 4
+        return value
     def read_u16(self):
-        b = self.data.read(2)
-        if len(b) < 2: return 0
+        if self.pos + 2 > self.file_size: return 0
         fmt = '>H' if self.big_endian else '<H'
-        return struct.unpack(fmt, b)[0]
+        value = struct.unpack_from(fmt, self.data, self.pos)[0]
+        self.pos += 2
+        return value
     
     def read_u8(self):
-        b = self.data.read(1)
-        if len(b) < 1: return 0
-        return b[0]
-    def parse_riff(self):
-        self.data.seek(0)
-        magic = self.data.read(4)
+        if self.pos + 1 > self.file_size: return 0
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def parse_chunks(self):
+        # {chunk_id: (data offset, size)}
+        self.seek(0)
+        magic = bytes(self.read(4))
         if magic == b'RIFX':
             self.big_endian = True
         elif magic == b'RIFF':
@@ -75,35 +278,62 @@ class WwiseOpusConverter:
             
         self.read_u32() # File size (often ignored/wrong in Wwise)
         
-        wave = self.data.read(4)
+        wave = bytes(self.read(4))
         if wave != b'WAVE':
             raise ValueError("Not a WAVE file")
             
-        # Parse chunks
+        chunks = {}
         offset = 12
         while offset < self.file_size:
-            self.data.seek(offset)
-            chunk_id = self.data.read(4)
+            self.seek(offset)
+            chunk_id = bytes(self.read(4))
             if len(chunk_id) < 4: break
             
             chunk_size = self.read_u32()
-            
-            # Helper to peek/read chunk data
-            next_chunk = offset + 8 + chunk_size
             # Padding for RIFF alignment? Wwise usually 2-byte aligned but chunks sizes seem precise
             # Actually standard RIFF chunks are word-aligned, but let's trust the read loop
-            
-            if chunk_id == b'fmt ':
-                self.parse_fmt(chunk_size)
-            elif chunk_id == b'data':
-                self.data_offset = offset + 8
-                self.data_size = chunk_size
-            elif chunk_id == b'seek':
-                self.seek_offset = offset + 8
-                self.seek_size = chunk_size
-                
-            offset = next_chunk
+            if chunk_id not in chunks:
+                chunks[chunk_id] = (offset + 8, chunk_size)
+            offset += 8 + chunk_size
+        return chunks
+
+    def read_codec(self):
+        chunks = self.parse_chunks()
+        if b'fmt ' not in chunks:
+            raise ValueError("Missing fmt chunk")
+        self.seek(chunks[b'fmt '][0])
+        return self.read_u16()
+
+
+class WwiseOpusConverter(WemReader):
+    def __init__(self, input_path):
+        super().__init__(input_path)
+        
+        # Header info
+        self.channels = 0
+        self.sample_rate = 0
+        self.total_samples = 0
+        self.pre_skip = 0
+        self.seek_offset = 0
+        self.seek_size = 0
+        self.data_offset = 0
+        self.data_size = 0
+        
+        # State
+        self.packet_sizes = []
+
+    def parse_riff(self):
+        chunks = self.parse_chunks()
+        if b'fmt ' in chunks:
+            offset, size = chunks[b'fmt ']
+            self.seek(offset)
+            self.parse_fmt(size)
+        if b'data' in chunks:
+            self.data_offset, self.data_size = chunks[b'data']
+        if b'seek' in chunks:
+            self.seek_offset, self.seek_size = chunks[b'seek']
     def parse_fmt(self, size):
+        fmt_offset = self.pos
         # Basic WAVEFORMATEX
         fmt_code = self.read_u16() # 0x00
         self.channels = self.read_u16() # 0x02
@@ -142,80 +372,25 @@ class WwiseOpusConverter:
 
             # In Wwise Opus 0x3041:
             # The C code says: vgmstream->num_samples = read_s32(ww.fmt_offset + 0x18, sf);
-            # Let's adjust for relative reading logic
-            # self.data.read(4) # Channel mask (skip)
-
-            # Let's just trust we grabbed the essential info: channels, rate.
-            # We can grab num_samples if we absolutely need it for accurate duration,
-            # but Ogg granule pos handles that mostly.
-            pass
+            self.seek(fmt_offset + 0x18)
+            self.total_samples = self.read_u32()
+            if fmt_code == 0x3041 and extra_size >= 0x10:
+                # 0x1c: seek table count
+                # 0x20: skip (encoder delay), what OpusHead calls pre-skip
+                self.seek(fmt_offset + 0x20)
+                self.pre_skip = self.read_u16()
     def parse_seek(self):
         if self.seek_offset == 0 or self.seek_size == 0:
             return
             
-        self.data.seek(self.seek_offset)
-        count = self.seek_size // 2 # uint16 array
-        for _ in range(count):
-            self.packet_sizes.append(self.read_u16())
+        # uint16 array, decoded in one pass
+        count = self.seek_size // 2
+        table = array.array('H')
+        table.frombytes(self.data[self.seek_offset:self.seek_offset + count * 2])
+        if self.big_endian != (sys.byteorder == 'big'):
+            table.byteswap()
+        self.packet_sizes = table
             
-    def make_ogg_page(self, packets, sequence, granule, stream_serial, check_last=False):
-        # Header (0x1B bytes) + Lacing values + Data
-        # Capture "OggS"
-        page = bytearray(b'OggS')
-        page.append(0) # Version
-        
-        flags = 0
-        if sequence == 0: flags |= 0x02 # BOS
-        if check_last:
-            # Technically we should check if this is the absolute last page
-            pass
-            
-        page.append(flags) 
-        
-        # Granule (8 bytes LE)
-        page.extend(struct.pack('<Q', granule))
-        
-        # Serial (4 bytes LE)
-        page.extend(struct.pack('<I', stream_serial))
-        
-        # Sequence (4 bytes LE)
-        page.extend(struct.pack('<I', sequence))
-        
-        # Checksum (4 bytes placeholder)
-        page.extend(b'\x00\x00\x00\x00')
-        
-        # Segments
-        # Packets might need lacing if > 255 bytes
-        # Standard Ogg: each packet is a segment, unless > 255, then it spans.
-        # But each segment in the table describes the length of the segment.
-        # Length 255 means "continue to next segment".
-        # Length < 255 means "end of packet".
-        
-        # However, `packets` input here is list of (payload_bytes).
-        segment_table = bytearray()
-        payload_data = bytearray()
-        
-        for p in packets:
-            size = len(p)
-            while size >= 255:
-                segment_table.append(255)
-                size -= 255
-            segment_table.append(size)
-            payload_data.extend(p)
-            
-        page.append(len(segment_table))
-        page.extend(segment_table)
-        page.extend(payload_data)
-        
-        # Calculate CRC
-        crc = get_oggs_checksum(page)
-        # Write CRC at offset 22
-        page[22] = crc & 0xFF
-        page[23] = (crc >> 8) & 0xFF
-        page[24] = (crc >> 16) & 0xFF
-        page[25] = (crc >> 24) & 0xFF
-        
-        return page
     def create_opus_head(self, pre_skip=0):
         # Magic "OpusHead"
         # Version 1 (1 byte)
@@ -290,7 +465,8 @@ class WwiseOpusConverter:
              frame_count = packet[1] & 0x3F
              
         return frame_size * frame_count
-    def convert(self, output_path):
+    def convert(self, output_path, max_page_bytes=OGG_PAGE_BYTES, max_page_samples=OGG_PAGE_SAMPLES):
+        # max_page_bytes=0 writes one page per packet
         self.parse_riff()
         self.parse_seek()
         
@@ -301,66 +477,586 @@ class WwiseOpusConverter:
             # Or constant bitrate? Wwise Opus is rarely CBR.
             return
         with open(output_path, 'wb') as outfile:
-            stream_serial = 0x12345678
-            sequence = 0
-            granule = 0
+            writer = OggPageWriter(outfile, 0x12345678, max_page_bytes, max_page_samples)
             
-            # 1. BOS Page: OpusHead
-            head = self.create_opus_head()
-            page = self.make_ogg_page([head], sequence, 0, stream_serial)
-            outfile.write(page)
-            sequence += 1
+            # 1. BOS Page: OpusHead, alone on its page
+            writer.add_packet(self.create_opus_head(self.pre_skip), 0)
+            writer.flush()
             
-            # 2. OpusTags
-            tags = self.create_opus_tags()
-            page = self.make_ogg_page([tags], sequence, 0, stream_serial)
-            outfile.write(page)
-            sequence += 1
+            # 2. OpusTags, audio starts on a fresh page
+            writer.add_packet(self.create_opus_tags(), 0)
+            writer.flush()
             
             # 3. Audio Data
             # Wwise packet_sizes table tells us how many bytes to read for each packet
-            self.data.seek(self.data_offset)
-            
-            # Optimization: Group packets into pages (approx 1 page per 1000ms or 64KB?)
-            # Ogg recommendation: ~4KB-8KB pages usually.
-            # Let's just do 1 packet per page for simplicity as per the C code?
-            # "Uses an intermediate buffer to make full Ogg pages... static size_t make_oggs_page"
-            # The C code seems to pack roughly, but Wwise packets can be large.
-            # Let's try to bundle a few packets per page if they are small, or 1 per page.
-            # Ideally < 65KB.
-            
-            current_page_packets = []
-            current_page_size = 0
+            self.seek(self.data_offset)
+            # Granule counts decoded samples including pre-skip, the last page's granule
+            # trims the padding at the end when the header knows the real length.
+            end_granule = self.pre_skip + self.total_samples if self.total_samples > 0 else 0
+            granule = 0
             
             for i, p_size in enumerate(self.packet_sizes):
-                payload = self.data.read(p_size)
+                payload = self.read(p_size)
                 if len(payload) != p_size:
                     print(f"Unexpected EOF reading packet {i}")
                     break
                     
                 samples = self.opus_packet_get_samples(payload)
                 granule += samples
+                packet_granule = granule
+                if i == len(self.packet_sizes) - 1 and granule - samples <= end_granule < granule:
+                    packet_granule = end_granule
                 
-                # Check bounds for safety (page size < 65KB)
-                # But actually, writing one packet per page is safest for strict seeking and granule correctness
-                # unless we track granule carefully.
-                # The C code: "make_oggs_page(..., data->samples_done)" implies 1 packet per page 
-                # OR it accumulates.
-                # In `opus_io_read`:
-                #   data_size = get_table_frame_size(...)
-                #   read_streamfile(...)
-                #   make_oggs_page(...)
-                # It looks like it makes ONE Ogg page per Wwise packet.
-                # Wwise packets are usually ~120ms or something? No, they seem to be typical Opus frames.
-                
-                # Let's stick to 1 Packet = 1 Ogg Page for maximum robustness with the C impl reference,
-                # although inefficient overhead.
-                
-                page = self.make_ogg_page([payload], sequence, granule, stream_serial)
-                outfile.write(page)
-                sequence += 1
-                
-            # Set EOS?
-            # The last page should have flag 0x04.
-            # Since we write immediately, we don't know which is last easily unless we check index.
-            # It's fine for most players.
\ No newline at end of file
+                writer.add_packet(payload, packet_granule)
+            writer.close()
+
+
+# Wwise Vorbis
+# Rebuilds a standard Ogg Vorbis stream the way ww2ogg does (headers regenerated from the
+# stripped Wwise setup packet and the packed codebook library, audio packets given back their
+# window bits) and computes granules from the block sizes the way revorb does, in one pass.
+PACKED_CODEBOOKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "packed_codebooks_aoTuV_603.bin")
+VORBIS_VENDOR = b"converted from Audiokinetic Wwise by convert_ogg"
+
+
+def ilog(v):
+    return v.bit_length() if v > 0 else 0
+
+
+class BitReader:
+    # Vorbis bit order: least significant bit of each byte first
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data) * 8
+        self.pos = 0
+
+    def read(self, bits):
+        if self.pos + bits > self.size:
+            raise ValueError("Read past the end of the packet")
+        start = self.pos >> 3
+        end = (self.pos + bits + 7) >> 3
+        value = (int.from_bytes(self.data[start:end], 'little') >> (self.pos & 7)) & ((1 << bits) - 1)
+        self.pos += bits
+        return value
+
+
+class BitWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.acc = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        self.acc |= (value & ((1 << bits) - 1)) << self.bits
+        self.bits += bits
+        if self.bits >= 8:
+            count = self.bits >> 3
+            self.buffer += (self.acc & ((1 << (count * 8)) - 1)).to_bytes(count, 'little')
+            self.acc >>= count * 8
+            self.bits &= 7
+
+    def write_bytes(self, data):
+        for byte in data:
+            self.write(byte, 8)
+
+    def getvalue(self):
+        if self.bits:
+            return bytes(self.buffer) + bytes([self.acc])
+        return bytes(self.buffer)
+
+
+def book_maptype1_quantvals(entries, dimensions):
+    # get us a starting hint, we'll polish it below
+    bits = ilog(entries)
+    vals = entries >> ((bits - 1) * (dimensions - 1) // dimensions)
+    while True:
+        acc = vals ** dimensions
+        acc1 = (vals + 1) ** dimensions
+        if acc <= entries < acc1:
+            return vals
+        if acc > entries:
+            vals -= 1
+        else:
+            vals += 1
+
+
+class CodebookLibrary:
+    # packed_codebooks*.bin: codebook data followed by a u32 LE offset table, whose own offset is the last u32
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        offset_offset = struct.unpack_from('<I', self.data, len(self.data) - 4)[0]
+        count = (len(self.data) - offset_offset) // 4
+        self.offsets = struct.unpack_from(f'<{count}I', self.data, offset_offset)
+        # rebuilt codebooks as (value, bit count), they only depend on the id
+        self.rebuilt = {}
+
+    def rebuild(self, i, writer):
+        if i not in self.rebuilt:
+            if i >= len(self.offsets) - 1:
+                raise ValueError(f"Invalid codebook id {i}, try another codebook library")
+            start, end = self.offsets[i], self.offsets[i + 1]
+            book = BitWriter()
+            self.rebuild_codebook(BitReader(self.data[start:end]), end - start, book)
+            self.rebuilt[i] = (int.from_bytes(book.buffer, 'little') | (book.acc << (len(book.buffer) * 8)),
+                               len(book.buffer) * 8 + book.bits)
+        value, bits = self.rebuilt[i]
+        writer.write(value, bits)
+
+    @staticmethod
+    def rebuild_codebook(reader, cb_size, writer):
+        # IN: 4 bit dimensions, 14 bit entry count
+        dimensions = reader.read(4)
+        entries = reader.read(14)
+        # OUT: 24 bit identifier, 16 bit dimensions, 24 bit entry count
+        writer.write(0x564342, 24)
+        writer.write(dimensions, 16)
+        writer.write(entries, 24)
+
+        # IN/OUT: 1 bit ordered flag
+        ordered = reader.read(1)
+        writer.write(ordered, 1)
+        if ordered:
+            # IN/OUT: 5 bit initial length
+            writer.write(reader.read(5), 5)
+            current_entry = 0
+            while current_entry < entries:
+                # IN/OUT: ilog(entries-current_entry) bit count w/ given length
+                bits = ilog(entries - current_entry)
+                number = reader.read(bits)
+                writer.write(number, bits)
+                current_entry += number
+            if current_entry > entries:
+                raise ValueError("Codebook current_entry out of range")
+        else:
+            # IN: 3 bit codeword length length, 1 bit sparse flag
+            codeword_length_length = reader.read(3)
+            sparse = reader.read(1)
+            if codeword_length_length == 0 or codeword_length_length > 5:
+                raise ValueError("Nonsense codeword length")
+            # OUT: 1 bit sparse flag
+            writer.write(sparse, 1)
+            for _ in range(entries):
+                present = 1
+                if sparse:
+                    # IN/OUT 1 bit sparse presence flag
+                    present = reader.read(1)
+                    writer.write(present, 1)
+                if present:
+                    # IN: n bit codeword length-1, OUT: 5 bit codeword length-1
+                    writer.write(reader.read(codeword_length_length), 5)
+
+        # IN: 1 bit lookup type, OUT: 4 bit lookup type
+        lookup_type = reader.read(1)
+        writer.write(lookup_type, 4)
+        if lookup_type == 1:
+            # IN/OUT: 32 bit minimum length, 32 bit maximum length, 4 bit value length-1, 1 bit sequence flag
+            writer.write(reader.read(32), 32)
+            writer.write(reader.read(32), 32)
+            value_length = reader.read(4)
+            writer.write(value_length, 4)
+            writer.write(reader.read(1), 1)
+            if dimensions == 0:
+                raise ValueError("Codebook with lookup table has no dimensions")
+            for _ in range(book_maptype1_quantvals(entries, dimensions)):
+                # IN/OUT: n bit value
+                writer.write(reader.read(value_length + 1), value_length + 1)
+
+        # check that we used exactly all bytes
+        # note: if all bits are used in the last byte there will be one extra 0 byte
+        if cb_size != 0 and reader.pos // 8 + 1 != cb_size:
+            raise ValueError(f"Codebook size mismatch, expected {cb_size}, read {reader.pos // 8 + 1}")
+
+
+codebook_libraries = {}
+
+
+def get_codebook_library(path=PACKED_CODEBOOKS):
+    # loaded once per process, pool workers keep theirs for every file they convert
+    if path not in codebook_libraries:
+        codebook_libraries[path] = CodebookLibrary(path)
+    return codebook_libraries[path]
+
+
+class WwiseVorbisConverter(WemReader):
+    def __init__(self, input_path, codebooks_path=PACKED_CODEBOOKS):
+        super().__init__(input_path)
+        self.codebooks_path = codebooks_path
+
+        # Header info
+        self.channels = 0
+        self.sample_rate = 0
+        self.avg_bytes_per_second = 0
+        self.sample_count = 0
+        self.loop_start = None
+        self.loop_end = None
+        self.data_offset = 0
+        self.data_size = 0
+        self.setup_packet_offset = 0
+        self.first_audio_packet_offset = 0
+        self.blocksize_0_pow = 0
+        self.blocksize_1_pow = 0
+        self.no_granule = False
+        self.mod_packets = False
+
+        # From the setup packet
+        self.mode_blockflag = []
+        self.mode_bits = 0
+
+    def parse_riff(self):
+        chunks = self.parse_chunks()
+        if b'fmt ' not in chunks or b'data' not in chunks:
+            raise ValueError("Missing fmt or data chunk")
+        fmt_offset, fmt_size = chunks[b'fmt ']
+        self.data_offset, self.data_size = chunks[b'data']
+
+        self.seek(fmt_offset)
+        if self.read_u16() != 0xFFFF:
+            raise ValueError("Not a Wwise Vorbis file")
+        self.channels = self.read_u16()
+        self.sample_rate = self.read_u32()
+        self.avg_bytes_per_second = self.read_u32()
+        if self.read_u16() != 0:
+            raise ValueError("Bad block align")
+        if self.read_u16() != 0:
+            raise ValueError("Expected 0 bits per sample")
+        if self.read_u16() != fmt_size - 0x12:
+            raise ValueError("Bad extra fmt length")
+
+        if b'vorb' in chunks:
+            vorb_offset, vorb_size = chunks[b'vorb']
+        elif fmt_size == 0x42:
+            # vorb is the tail of fmt
+            vorb_offset, vorb_size = fmt_offset + 0x18, -1
+        else:
+            raise ValueError("Missing vorb chunk")
+        if vorb_size not in (-1, 0x2A, 0x32, 0x34):
+            # 0x28/0x2C carry the old header triad and 8 byte packet headers, left to ww2ogg
+            raise ValueError(f"Unsupported vorb size 0x{vorb_size:x}, please try ww2ogg.")
+
+        if b'smpl' in chunks:
+            smpl_offset = chunks[b'smpl'][0]
+            self.seek(smpl_offset + 0x1C)
+            if self.read_u32() == 1:
+                self.seek(smpl_offset + 0x2C)
+                self.loop_start = self.read_u32()
+                self.loop_end = self.read_u32()
+
+        self.seek(vorb_offset)
+        self.sample_count = self.read_u32()
+        if self.loop_end is not None:
+            self.loop_end = self.sample_count if self.loop_end == 0 else self.loop_end + 1
+
+        if vorb_size in (-1, 0x2A):
+            self.no_granule = True
+            self.seek(vorb_offset + 0x4)
+            mod_signal = self.read_u32()
+            if mod_signal not in (0x4A, 0x4B, 0x69, 0x70):
+                self.mod_packets = True
+            self.seek(vorb_offset + 0x10)
+        else:
+            self.seek(vorb_offset + 0x18)
+        self.setup_packet_offset = self.read_u32()
+        self.first_audio_packet_offset = self.read_u32()
+
+        if vorb_size in (-1, 0x2A):
+            self.seek(vorb_offset + 0x24)
+        else:
+            self.seek(vorb_offset + 0x2C)
+        self.read_u32() # uid
+        self.blocksize_0_pow = self.read_u8()
+        self.blocksize_1_pow = self.read_u8()
+
+    def read_packet_header(self, offset):
+        # (payload offset, payload size, next packet offset)
+        self.seek(offset)
+        size = self.read_u16()
+        header_size = 2
+        if not self.no_granule:
+            self.read_u32() # granule, recomputed from the block sizes instead
+            header_size = 6
+        return offset + header_size, size, offset + header_size + size
+
+    def create_identification_packet(self):
+        writer = BitWriter()
+        writer.write(1, 8)
+        writer.write_bytes(b'vorbis')
+        writer.write(0, 32) # version
+        writer.write(self.channels, 8)
+        writer.write(self.sample_rate, 32)
+        writer.write(0, 32) # bitrate max
+        writer.write(self.avg_bytes_per_second * 8, 32) # bitrate nominal
+        writer.write(0, 32) # bitrate min
+        writer.write(self.blocksize_0_pow, 4)
+        writer.write(self.blocksize_1_pow, 4)
+        writer.write(1, 1) # framing
+        return writer.getvalue()
+
+    def create_comment_packet(self):
+        comments = []
+        if self.loop_start is not None:
+            comments = [f"LoopStart={self.loop_start}".encode(), f"LoopEnd={self.loop_end}".encode()]
+        packet = bytearray(b'\x03vorbis')
+        packet.extend(struct.pack('<I', len(VORBIS_VENDOR)))
+        packet.extend(VORBIS_VENDOR)
+        packet.extend(struct.pack('<I', len(comments)))
+        for comment in comments:
+            packet.extend(struct.pack('<I', len(comment)))
+            packet.extend(comment)
+        packet.append(1) # framing
+        return bytes(packet)
+
+    def create_setup_packet(self):
+        offset, size, next_offset = self.read_packet_header(self.data_offset + self.setup_packet_offset)
+        reader = BitReader(self.data[offset:offset + size])
+        writer = BitWriter()
+        writer.write(5, 8)
+        writer.write_bytes(b'vorbis')
+
+        # IN/OUT: 8 bit count-1
+        codebook_count_less1 = reader.read(8)
+        codebook_count = codebook_count_less1 + 1
+        writer.write(codebook_count_less1, 8)
+        codebooks = get_codebook_library(self.codebooks_path)
+        for _ in range(codebook_count):
+            codebooks.rebuild(reader.read(10), writer)
+
+        # Time Domain transforms (placeholder)
+        writer.write(0, 6)
+        writer.write(0, 16)
+
+        # floor count
+        floor_count_less1 = reader.read(6)
+        floor_count = floor_count_less1 + 1
+        writer.write(floor_count_less1, 6)
+        for _ in range(floor_count):
+            # Always floor type 1
+            writer.write(1, 16)
+            floor1_partitions = reader.read(5)
+            writer.write(floor1_partitions, 5)
+            floor1_partition_class_list = []
+            for _ in range(floor1_partitions):
+                floor1_partition_class = reader.read(4)
+                writer.write(floor1_partition_class, 4)
+                floor1_partition_class_list.append(floor1_partition_class)
+            maximum_class = max(floor1_partition_class_list, default=0)
+            floor1_class_dimensions_list = []
+            for _ in range(maximum_class + 1):
+                class_dimensions_less1 = reader.read(3)
+                writer.write(class_dimensions_less1, 3)
+                floor1_class_dimensions_list.append(class_dimensions_less1 + 1)
+                class_subclasses = reader.read(2)
+                writer.write(class_subclasses, 2)
+                if class_subclasses != 0:
+                    masterbook = reader.read(8)
+                    writer.write(masterbook, 8)
+                    if masterbook >= codebook_count:
+                        raise ValueError("Invalid floor1 masterbook")
+                for _ in range(1 << class_subclasses):
+                    subclass_book_plus1 = reader.read(8)
+                    writer.write(subclass_book_plus1, 8)
+                    if subclass_book_plus1 - 1 >= codebook_count:
+                        raise ValueError("Invalid floor1 subclass book")
+            writer.write(reader.read(2), 2) # floor1 multiplier-1
+            rangebits = reader.read(4)
+            writer.write(rangebits, 4)
+            for current_class_number in floor1_partition_class_list:
+                for _ in range(floor1_class_dimensions_list[current_class_number]):
+                    writer.write(reader.read(rangebits), rangebits)
+
+        # residue count
+        residue_count_less1 = reader.read(6)
+        residue_count = residue_count_less1 + 1
+        writer.write(residue_count_less1, 6)
+        for _ in range(residue_count):
+            residue_type = reader.read(2)
+            writer.write(residue_type, 16)
+            if residue_type > 2:
+                raise ValueError("Invalid residue type")
+            writer.write(reader.read(24), 24) # begin
+            writer.write(reader.read(24), 24) # end
+            writer.write(reader.read(24), 24) # partition size-1
+            residue_classifications = reader.read(6) + 1
+            writer.write(residue_classifications - 1, 6)
+            residue_classbook = reader.read(8)
+            writer.write(residue_classbook, 8)
+            if residue_classbook >= codebook_count:
+                raise ValueError("Invalid residue classbook")
+            residue_cascade = []
+            for _ in range(residue_classifications):
+                high_bits = 0
+                low_bits = reader.read(3)
+                writer.write(low_bits, 3)
+                bitflag = reader.read(1)
+                writer.write(bitflag, 1)
+                if bitflag:
+                    high_bits = reader.read(5)
+                    writer.write(high_bits, 5)
+                residue_cascade.append(high_bits * 8 + low_bits)
+            for cascade in residue_cascade:
+                for k in range(8):
+                    if cascade & (1 << k):
+                        residue_book = reader.read(8)
+                        writer.write(residue_book, 8)
+                        if residue_book >= codebook_count:
+                            raise ValueError("Invalid residue book")
+
+        # mapping count
+        mapping_count_less1 = reader.read(6)
+        mapping_count = mapping_count_less1 + 1
+        writer.write(mapping_count_less1, 6)
+        for _ in range(mapping_count):
+            # always mapping type 0, the only one
+            writer.write(0, 16)
+            submaps = 1
+            submaps_flag = reader.read(1)
+            writer.write(submaps_flag, 1)
+            if submaps_flag:
+                submaps_less1 = reader.read(4)
+                writer.write(submaps_less1, 4)
+                submaps = submaps_less1 + 1
+            square_polar_flag = reader.read(1)
+            writer.write(square_polar_flag, 1)
+            if square_polar_flag:
+                coupling_steps_less1 = reader.read(8)
+                writer.write(coupling_steps_less1, 8)
+                bits = ilog(self.channels - 1)
+                for _ in range(coupling_steps_less1 + 1):
+                    magnitude = reader.read(bits)
+                    angle = reader.read(bits)
+                    writer.write(magnitude, bits)
+                    writer.write(angle, bits)
+                    if angle == magnitude or magnitude >= self.channels or angle >= self.channels:
+                        raise ValueError("Invalid coupling")
+            # a rare reserved field not removed by Ak!
+            mapping_reserved = reader.read(2)
+            writer.write(mapping_reserved, 2)
+            if mapping_reserved != 0:
+                raise ValueError("Mapping reserved field nonzero")
+            if submaps > 1:
+                for _ in range(self.channels):
+                    mapping_mux = reader.read(4)
+                    writer.write(mapping_mux, 4)
+                    if mapping_mux >= submaps:
+                        raise ValueError("mapping_mux >= submaps")
+            for _ in range(submaps):
+                # Another! Unused time domain transform configuration placeholder!
+                writer.write(reader.read(8), 8)
+                floor_number = reader.read(8)
+                writer.write(floor_number, 8)
+                if floor_number >= floor_count:
+                    raise ValueError("Invalid floor mapping")
+                residue_number = reader.read(8)
+                writer.write(residue_number, 8)
+                if residue_number >= residue_count:
+                    raise ValueError("Invalid residue mapping")
+
+        # mode count
+        mode_count_less1 = reader.read(6)
+        mode_count = mode_count_less1 + 1
+        writer.write(mode_count_less1, 6)
+        self.mode_blockflag = []
+        self.mode_bits = ilog(mode_count - 1)
+        for _ in range(mode_count):
+            block_flag = reader.read(1)
+            writer.write(block_flag, 1)
+            self.mode_blockflag.append(block_flag != 0)
+            # only 0 valid for windowtype and transformtype
+            writer.write(0, 16)
+            writer.write(0, 16)
+            mapping = reader.read(8)
+            writer.write(mapping, 8)
+            if mapping >= mapping_count:
+                raise ValueError("Invalid mode mapping")
+        writer.write(1, 1) # framing
+
+        if (reader.pos + 7) // 8 != size:
+            raise ValueError("Didn't read exactly the setup packet")
+        if next_offset != self.data_offset + self.first_audio_packet_offset:
+            raise ValueError("First audio packet doesn't follow the setup packet")
+        return writer.getvalue()
+
+    def iter_audio_packets(self):
+        # (packet, mode number)
+        mode_mask = (1 << self.mode_bits) - 1
+        end = self.data_offset + self.data_size
+        offset = self.data_offset + self.first_audio_packet_offset
+        header_size = 2 if self.no_granule else 6
+        prev_blockflag = False
+        while offset < end:
+            if offset + header_size > end:
+                raise ValueError("Page header truncated")
+            payload_offset, size, next_offset = self.read_packet_header(offset)
+            if next_offset > end:
+                raise ValueError("Page truncated")
+            payload = self.data[payload_offset:next_offset]
+
+            if not self.mod_packets:
+                yield payload, (payload[0] >> 1) & mode_mask if size else -1
+            else:
+                if size == 0:
+                    raise ValueError("Empty audio packet")
+                # need to rebuild packet type and window info:
+                # 1 bit packet type (0 == audio), N bit mode number, [previous and next window type],
+                # then the remaining bits of the first byte and the rest of the packet
+                mode_number = payload[0] & mode_mask
+                bits = mode_number << 1
+                bit_count = 1 + self.mode_bits
+                if self.mode_blockflag[mode_number]:
+                    # long window, peek at next frame
+                    next_blockflag = False
+                    if next_offset + header_size <= end:
+                        next_payload_offset, next_size, _ = self.read_packet_header(next_offset)
+                        if next_size > 0:
+                            next_blockflag = self.mode_blockflag[self.data[next_payload_offset] & mode_mask]
+                    bits |= (prev_blockflag | (next_blockflag << 1)) << bit_count
+                    bit_count += 2
+                prev_blockflag = self.mode_blockflag[mode_number]
+                bits |= (payload[0] >> self.mode_bits) << bit_count
+                bit_count += 8 - self.mode_bits
+                bits |= int.from_bytes(payload[1:], 'little') << bit_count
+                bit_count += (size - 1) * 8
+                yield bits.to_bytes((bit_count + 7) // 8, 'little'), mode_number
+            offset = next_offset
+
+    def convert(self, output_path, max_page_bytes=OGG_PAGE_BYTES, max_page_samples=OGG_PAGE_SAMPLES):
+        self.parse_riff()
+        identification = self.create_identification_packet()
+        comment = self.create_comment_packet()
+        setup = self.create_setup_packet()
+        blocksizes = (1 << self.blocksize_0_pow, 1 << self.blocksize_1_pow)
+
+        with open(output_path, 'wb') as outfile:
+            writer = OggPageWriter(outfile, 1, max_page_bytes, max_page_samples)
+            # identification packet on its own page, audio starts on a fresh page
+            writer.add_packet(identification, 0)
+            writer.flush()
+            writer.add_packet(comment, 0)
+            writer.add_packet(setup, 0)
+            writer.flush()
+
+            # revorb: a packet ends (previous block + current block) / 4 samples after the previous one
+            granule = 0
+            last_blocksize = 0
+            for packet, mode_number in self.iter_audio_packets():
+                if 0 <= mode_number < len(self.mode_blockflag):
+                    blocksize = blocksizes[self.mode_blockflag[mode_number]]
+                    if last_blocksize:
+                        granule += (last_blocksize + blocksize) // 4
+                    last_blocksize = blocksize
+                writer.add_packet(packet, granule)
+            writer.close()
+
+
+def convert_wem(input_path, output_path, **kwargs):
+    # picks the converter from the fmt codec, returns which one was used;
+    # input_path may also be the wem itself as bytes or a buffer
+    with WemReader(input_path) as reader:
+        codec = reader.read_codec()
+    if codec == 0xFFFF:
+        with WwiseVorbisConverter(input_path) as converter:
+            converter.convert(output_path, **kwargs)
+        return "vorbis"
+    with WwiseOpusConverter(input_path) as converter:
+        converter.convert(output_path, **kwargs)
+    return "opus"
@@ -0,0 +1,213 @@
+import os
+import pickle
+import re
+import sqlite3
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Wwise's FNV-1 over the lower-cased name: multiply, then xor
+FNV_PARAMS = {
+    32: (2166136261, 16777619, 0xFFFFFFFF),
+    64: (14695981039346656037, 1099511628211, 0xFFFFFFFFFFFFFFFF),
+}
+
+# bump when the persisted tables change
+INDEX_VERSION = 1
+
+# same rules wwiser uses for name lists: a "name = id" line, or a line split on characters a hashname can't have
+LIST_ID_LINE = re.compile(r"^[\t]*([a-zA-Z_0-9][a-zA-Z0-9_()\- ]*)( = )([0-9]+)[ ]*$")
+LIST_SPLIT = re.compile(r'[\t\n\r .<>,;.:{}\[\]()\'"$&/=!\\/#@+\^`´¨?|~]')
+HASHABLE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def fnv(name, bits=32):
+    hash_num, prime, mask = FNV_PARAMS[bits]
+    for i in name.lower().encode():
+        hash_num = ((hash_num * prime) & mask) ^ i
+    return hash_num
+
+
+def fnv32(name):
+    return fnv(name, 32)
+
+
+def fnv64(name):
+    return fnv(name, 64)
+
+
+def hashBytesPython(names, bits=32):
+    hash_start, prime, mask = FNV_PARAMS[bits]
+    hashes = []
+    for name in names:
+        hash_num = hash_start
+        for i in name:
+            hash_num = ((hash_num * prime) & mask) ^ i
+        hashes.append(hash_num)
+    return hashes
+
+
+def hashBytesNumpy(names, bits=32):
+    # names of the same length form one (names, length) byte matrix, hashed a column at a time;
+    # the unsigned arrays wrap around like the mask does
+    hash_start, prime, _ = FNV_PARAMS[bits]
+    dtype = numpy.uint32 if bits == 32 else numpy.uint64
+    hashes = [hash_start] * len(names)
+    by_length = {}
+    for i, name in enumerate(names):
+        by_length.setdefault(len(name), []).append(i)
+    for length, indexes in by_length.items():
+        if length == 0:
+            continue
+        matrix = numpy.frombuffer(b"".join(names[i] for i in indexes), dtype=numpy.uint8).reshape(len(indexes), length)
+        column_hashes = numpy.full(len(indexes), hash_start, dtype=dtype)
+        for column in range(length):
+            column_hashes *= dtype(prime)
+            column_hashes ^= matrix[:, column]
+        for i, hash_num in zip(indexes, column_hashes.tolist()):
+            hashes[i] = hash_num
+    return hashes
+
+
+HASH_BACKENDS = {
+    "python": hashBytesPython,
+}
+if numpy is not None:
+    HASH_BACKENDS["numpy"] = hashBytesNumpy
+
+hash_backend = "numpy" if "numpy" in HASH_BACKENDS else "python"
+
+
+def setHashBackend(name):
+    global hash_backend
+    if name not in HASH_BACKENDS:
+        raise ValueError(f"Unknown hash backend {name}, available: {', '.join(HASH_BACKENDS)}")
+    hash_backend = name
+
+
+def hashNames(names, bits=32):
+    # FNV of every name in one batch, in order
+    return HASH_BACKENDS[hash_backend]([name.lower().encode() for name in names], bits)
+
+
+def iterListNames(path):
+    # (id or None, name) of a wwnames-style list
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line or line[0] == "#":
+                continue
+            match = LIST_ID_LINE.match(line)
+            if match:
+                name, _, name_id = match.groups()
+                # 0 means "hash it anyway", for names with characters hashnames don't have
+                yield (int(name_id) or None), name
+                continue
+            for elem in LIST_SPLIT.split(line):
+                if not elem or elem[0].isdigit() or len(elem) > 100:
+                    continue
+                elem = elem.replace("-", "_")
+                if HASHABLE.match(elem.lower()):
+                    yield None, elem
+
+
+def buildListTable(path):
+    table = {}
+    names = []
+    for name_id, name in iterListNames(path):
+        if name_id is not None:
+            table.setdefault(name_id, name)
+        else:
+            names.append(name)
+    for name_id, name in zip(hashNames(names), names):
+        table.setdefault(name_id, name)
+    return table
+
+
+def buildDbTable(path):
+    # wwiser's names database already stores the ids
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return {name_id & 0xFFFFFFFF: name for name_id, name in connection.execute("SELECT id, name FROM names")}
+    finally:
+        connection.close()
+
+
+def getFingerprint(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class NameIndex:
+    # id -> name over several name lists (.txt lists, wwnames.db3); each table is persisted with the
+    # fingerprint of its source, so a run only hashes the lists that changed. The first source
+    # listing an id wins
+    def __init__(self, path=None):
+        self.path = path
+        self.tables = {}
+        self.sources = []
+        self.names = {}
+        if path is not None:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                version, tables = pickle.load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return
+        if version == INDEX_VERSION:
+            self.tables = tables
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", 'wb') as f:
+            pickle.dump((INDEX_VERSION, self.tables), f, protocol=5)
+        os.replace(self.path + ".tmp", self.path)
+
+    def addSource(self, path):
+        # returns True when the table changed; lookups see it after merge()
+        if path not in self.sources:
+            self.sources.append(path)
+        if not os.path.exists(path):
+            return self.tables.pop(path, None) is not None
+        fingerprint = getFingerprint(path)
+        if path in self.tables and self.tables[path][0] == fingerprint:
+            return False
+        table = buildDbTable(path) if path.endswith(".db3") else buildListTable(path)
+        self.tables[path] = (fingerprint, table)
+        return True
+
+    def merge(self):
+        self.names = {}
+        for path in reversed(self.sources):
+            if path in self.tables:
+                self.names.update(self.tables[path][1])
+
+    def get(self, name_id, default=None):
+        return self.names.get(int(name_id), default)
+
+    def __contains__(self, name_id):
+        return int(name_id) in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, path, sources):
+        index = cls(path)
+        changed = [source for source in sources if index.addSource(source)]
+        for source in list(index.tables):
+            if source not in sources:
+                del index.tables[source]
+                changed.append(source)
+        if changed:
+            index.save()
+        index.merge()
+        return index
@@ -0,0 +1,186 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPORT_DIR = "output/reports"
+
+# open stages of each thread, innermost last; countWork() adds to all of the calling thread's
+local = threading.local()
+# outermost stages running right now, in any thread
+running = []
+lock = threading.Lock()
+records = []
+options = {"profile": False, "trace_memory": False}
+run_name = time.strftime("%Y%m%d-%H%M%S")
+run_started = time.time()
+
+
+def configureStages(profile=False, trace_memory=False):
+    # profile: cProfile of every outermost stage's own thread to <REPORT_DIR>/<run>/<stage>.prof
+    # trace_memory: tracemalloc peak and top allocation sites per stage, slows everything down a lot
+    options["profile"] = profile
+    options["trace_memory"] = trace_memory
+
+
+def resetPeakRss():
+    # linux can restart the high-water mark, the peak is then per stage
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def getPeakRss():
+    # peak resident set of this process in bytes, or None
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # bytes on macOS, kB elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in [
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage"]]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+def getChildrenPeakRss():
+    # largest peak of any child process waited for so far (pool workers, wwiser, vgmstream...), not per stage
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def getStack():
+    if not hasattr(local, "stack"):
+        local.stack = []
+    return local.stack
+
+
+def countWork(files, size=0):
+    for record in getStack():
+        record["files"] += files
+        record["bytes"] += size
+
+
+@contextmanager
+def stage(name):
+    stack = getStack()
+    record = {"name": name, "parent": stack[-1]["name"] if stack else None, "files": 0, "bytes": 0}
+    # the high-water mark, the cpu times and the profiler are per process: a nested stage shares its
+    # parent's, and stages running next to each other in other threads share theirs
+    profiler = None
+    with lock:
+        if stack:
+            record["peak_rss_scope"] = "enclosing stage" if stack[-1]["peak_rss_scope"] == "stage" else "process"
+        else:
+            record["concurrent_with"] = [other["name"] for other in running]
+            if not running:
+                record["peak_rss_scope"] = "stage" if resetPeakRss() else "process"
+            else:
+                # one high-water mark for all of them, since the first one started
+                shared = all(other["peak_rss_scope"] != "process" for other in running)
+                record["peak_rss_scope"] = "concurrent stages" if shared else "process"
+                for other in running:
+                    other["concurrent_with"].append(name)
+                    if other["peak_rss_scope"] == "stage":
+                        other["peak_rss_scope"] = "concurrent stages"
+            # one profiler at a time
+            if options["profile"] and not any(other.get("profiling") for other in running):
+                profiler = cProfile.Profile()
+                record["profiling"] = True
+            running.append(record)
+    if profiler is not None:
+        profiler.enable()
+    stack.append(record)
+    tracing = options["trace_memory"] and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    times = os.times()
+    children_peak = getChildrenPeakRss()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_s"] = round(time.perf_counter() - start, 4)
+        end_times = os.times()
+        record["cpu_s"] = round(end_times.user + end_times.system - times.user - times.system, 4)
+        # only children that exited are counted, and windows reports none
+        if sys.platform != "win32":
+            record["subprocess_cpu_s"] = round(end_times.children_user + end_times.children_system
+                                               - times.children_user - times.children_system, 4)
+        record["peak_rss_bytes"] = getPeakRss()
+        # the children's peak is over the whole process lifetime: it only belongs to this stage when
+        # one of its children raised it, otherwise nothing is known (null)
+        end_children_peak = getChildrenPeakRss()
+        record["subprocess_peak_rss_bytes"] = (end_children_peak if end_children_peak is not None
+                                               and end_children_peak != children_peak else None)
+        if tracing:
+            snapshot = tracemalloc.take_snapshot()
+            record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            record["traced_top"] = [{"where": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                                    for stat in snapshot.statistics("lineno")[:10]]
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.disable()
+            directory = os.path.join(REPORT_DIR, run_name)
+            os.makedirs(directory, exist_ok=True)
+            record["profile"] = os.path.join(directory, f"{name}.prof")
+            profiler.dump_stats(record["profile"])
+        stack.pop()
+        with lock:
+            record.pop("profiling", None)
+            if not stack:
+                running.remove(record)
+            records.append(record)
+        print(f"[Stage] {name}: {record['wall_s']:.2f}s wall, {record['cpu_s']:.2f}s cpu"
+              + (f", {record['peak_rss_bytes'] / (1 << 20):.0f} MB peak" if record["peak_rss_bytes"] else ""))
+
+
+def saveStageReport(path=None):
+    # <REPORT_DIR>/<run>.json unless told otherwise, one file per run to compare them between game patches
+    path = path or os.path.join(REPORT_DIR, f"{run_name}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    report = {
+        "run": run_name,
+        "started": run_started,
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpu_count": os.cpu_count(),
+        "wall_s": round(time.time() - run_started, 4),
+        "stages": records,
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return path
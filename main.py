@@ -1,39 +1,102 @@
+import argparse
 import json
-import xmltodict
+import re
+import sys
+import glob
+import xml.etree.ElementTree as ET
 import subprocess
-import shutil
+import time
+import hashlib
+import heapq
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 from wfp.FilePackager import *
+from bank_cache import getBankCacheKey, BankStore, BankStoreWriter, DEFAULT_MAX_BYTES
+from registry import CompletionRegistry
+from materialize import Materializer, STRATEGIES
+from bnk import BnkReader, extractBanks
+from fnv_index import NameIndex, hashNames
+from name_guess import loadTokens, guessNames
+from instrument import countWork, configureStages, saveStageReport
+from pipeline import Pipeline, PIPELINE_STATE
+from pck import PckArchive, PckFile, extractPckEntries, KIND_BANK, KIND_SOUND, DEFAULT_INFLIGHT_BYTES
 
 bank_dict = {}
 
+# process pools start their workers fresh, like on Windows: the pipeline runs stages on threads,
+# and forking a multi-threaded process can deadlock
+POOL_CONTEXT = multiprocessing.get_context("spawn")
 
-# redefine because of there is a print statement in the original function
-def fnv_hash_64(data: str):
-    hash_num = 14695981039346656037
-    data = data.lower().encode()
-    for i in data:
-        hash_num = ((hash_num * 1099511628211) & 0xffffffffffffffff) ^ i
-    return hash_num
+NAME_INDEX = "output/unpack/name_index.bin"
+GUESSED_NAMES = "output/unpack/guessed_names.txt"
+# guesses too likely to be FNV collisions to be used as they are, for someone to go through
+GUESS_REVIEW = "output/unpack/guessed_names_review.txt"
+# first one listing an id wins
+NAME_SOURCES = ["manual_names.txt", "asset_names.txt", "wwnames.db3", GUESSED_NAMES]
 
 
-def addJsonString(json_data, results=[]):
+def loadNameIndex():
+    # id -> name of every name list, only the lists that changed since the last run are hashed again
+    return NameIndex.build(NAME_INDEX, NAME_SOURCES)
+
+
+def addJsonString(json_data, results=None):
+    # every key and string value of a json document in order of appearance, `results` is a dict
+    # used as an insertion-ordered set
+    if results is None:
+        results = {}
     if isinstance(json_data, dict):
         for key in json_data:
-            if key not in results:
-                results.append(key)
+            results[key] = None
             if isinstance(json_data[key], dict) or isinstance(json_data[key], list):
                 addJsonString(json_data[key], results)
             elif isinstance(json_data[key], str):
-                if json_data[key] not in results:
-                    results.append(json_data[key])
+                results[json_data[key]] = None
     elif isinstance(json_data, list):
         for item in json_data:
             if isinstance(item, dict) or isinstance(item, list):
                 addJsonString(item, results)
             elif isinstance(item, str):
-                if item not in results:
-                    results.append(item)
+                results[item] = None
+    return results
+
+
+def harvestJsonFile(path):
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            return list(addJsonString(json.load(f)))
+    except (ValueError, RecursionError) as e:
+        print(f"[Names] ERR: {path} is not valid json, skipped: {e}")
+        return []
+
+
+def harvestJsonNames(path="data", output="asset_names.txt", workers=None):
+    # candidate wwnames from every json table under `path`, the tables parsed in parallel and merged
+    # in file order, so the list is the same from run to run
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        dirs.sort()
+        for file in sorted(filenames):
+            if file.endswith(".json"):
+                files.append(os.path.join(root, file))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as executor:
+        for names in executor.map(harvestJsonFile, files, chunksize=max(1, len(files) // ((workers or os.cpu_count() or 1) * 8))):
+            for name in names:
+                # one name per line, wwiser splits lines on whitespace anyway
+                name = " ".join(name.split())
+                if name:
+                    results[name] = None
+    with open(output + ".tmp", "w", encoding="utf-8") as f:
+        for name in results:
+            f.write(name + "\n")
+    os.replace(output + ".tmp", output)
+    countWork(len(files), sum(os.path.getsize(file) for file in files))
+    print(f"[Names] {len(results)} names from {len(files)} tables written to {output}.")
+
 
 def outputWwnames(fuzzy=True, guess=True):
     result = ""
@@ -49,181 +112,598 @@ def outputWwnames(fuzzy=True, guess=True):
     with open("manual_names.txt", "r", encoding="utf-8") as f:
         result += f.read()
 
+    if guess and os.path.exists(GUESSED_NAMES):
+        if not result.endswith("\n"):
+            result += "\n"
+        with open(GUESSED_NAMES, "r", encoding="utf-8") as f:
+            result += f.read()
+
     with open("output/unpack/wwnames.txt", "w", encoding="utf-8") as f:
         f.write(result)
 
 
-def elegantWrite(f, file_data):
-    f.write(file_data[0][0])
-    if len(file_data) > 1:
-        print("[Mian] file name hash collides! Keep the first one.")
+# fields the renamed paths are built from: event names, decision tree keys, switch names
+GUESS_FIELDS = {"key", "ulSwitchID"}
+# hashes per guessing run at most: two tokens per name over the ~2k of manual_names.txt are ~4 * 10 ** 6
+# (a few seconds with numpy), the budget only cuts deeper searches short, three tokens are ~8 * 10 ** 9
+GUESS_BUDGET = 2 * 10 ** 9
+# guesses go straight to wwiser only when at most this share of them is expected by chance. Two tokens
+# against ~3k unresolved ids expect about 3 chance matches, so from about 60 matches on they are applied,
+# with fewer they end up in GUESS_REVIEW
+GUESS_MAX_CHANCE_SHARE = 0.05
+
+
+def collectUnresolvedIds(node, ids):
+    if isinstance(node, list):
+        for item in node:
+            collectUnresolvedIds(item, ids)
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            if (key in GUESS_FIELDS and isinstance(value, dict) and "@hashname" not in value
+                    and value.get("@value", "0") != "0"):
+                ids.add(int(value["@value"]))
+            elif isinstance(value, (dict, list)):
+                collectUnresolvedIds(value, ids)
+    return ids
+
+
+def getUnresolvedIds():
+    # ids of the bank data the output tree would name but that no name list resolves
+    ids = set()
+    for lang in bank_dict:
+        for bank_name in bank_dict[lang]:
+            for item in bank_dict.loadedItems(lang, bank_name).values():
+                if item["@name"] == "CAkEvent" and "@hashname" not in item["ulID"]:
+                    ids.add(int(item["ulID"]["@value"]))
+                collectUnresolvedIds(item, ids)
+    return ids
+
+
+def guessWwnames(max_depth=2, budget=GUESS_BUDGET, workers=None):
+    # names for unresolved ids, made of "_"-joined tokens of manual_names.txt. When few enough of them
+    # are expected to be chance matches, they are added to GUESSED_NAMES, which
+    # outputWwnames(guess=True) hands to wwiser; otherwise they are only written to GUESS_REVIEW, the
+    # real ones can be moved to manual_names.txt by hand. Returns how many GUESSED_NAMES did not have yet
+    index = loadNameIndex()
+    # a listed name wwiser still didn't apply would not help either
+    targets = {i for i in getUnresolvedIds() if i not in index}
+    tokens = loadTokens(["manual_names.txt"])
+    print(f"[Guess] {len(targets)} unresolved ids, {len(tokens)} tokens, up to {max_depth} per name")
+    matches, chance_matches = guessNames(targets, tokens, max_depth, budget, workers)
+    if not matches:
+        return 0
+    os.makedirs(os.path.dirname(GUESSED_NAMES), exist_ok=True)
+    if chance_matches > GUESS_MAX_CHANCE_SHARE * len(matches):
+        with open(GUESS_REVIEW, "w", encoding="utf-8") as f:
+            f.write(f"# {len(matches)} matches, about {chance_matches:.3g} of them expected by chance\n")
+            for hash_num, name in sorted(matches.items()):
+                f.write(f"{name} = {hash_num}\n")
+        print(f"[Guess] too many chance matches expected, {len(matches)} names left to review in {GUESS_REVIEW}")
+        return 0
+    names = set()
+    if os.path.exists(GUESSED_NAMES):
+        with open(GUESSED_NAMES, "r", encoding="utf-8") as f:
+            names = set(f.read().splitlines())
+    added = set(matches.values()) - names
+    if added:
+        with open(GUESSED_NAMES + ".tmp", "w", encoding="utf-8") as f:
+            for name in sorted(names | added):
+                f.write(f"{name}\n")
+        os.replace(GUESSED_NAMES + ".tmp", GUESSED_NAMES)
+    return len(added)
+
 
 def addAllPckFiles(package, directory):
     for root, dirs, files in os.walk(directory):
-        for file in files:
+        for file in sorted(files):
             if file.endswith('.pck'):
                 file_path = os.path.join(root, file)
-                package.addfile(open(file_path, 'rb'))
+                package.addFile(file_path)
                 # print(f"[Main] added {file} to the package!")
 
 
-def unpackWwiseBanks(path = "input"):
-    package = Package()
+UNPACK_LANGUAGES = ["SFX", "Chinese", "English", "Japanese", "Korean"]
+
+
+def getUnpackLanguages(package):
+    # upper-cased language name -> output folder; the ids behind the names differ between packages
+    lang_folders = {}
+    for i in UNPACK_LANGUAGES:
+        if i.upper() in package.languages:
+            lang_folders[i.upper()] = i
+    return lang_folders
+
 
+def getUnpackTarget(entry, lang_folders):
+    # the entry's language id only means something in its own package
+    i = lang_folders.get(entry.pck.languages.get(entry.lang_id, "").upper())
+    if i is None:
+        return None
+    if entry.kind == KIND_BANK:
+        return f"output/unpack/{i}/{entry.file_id}.bnk"
+    if entry.kind == KIND_SOUND:
+        return f"output/unpack/{i}/{entry.file_id}.wem"
+    return f"output/unpack/{i}/externals/{entry.file_id}.wem"
+
+
+def getLooseWems(package, lang_folders):
+    # unpack paths of the wems the packages hold on their own, an embedded copy never replaces them
+    loose = set()
+    for entry in package.entries():
+        if entry.kind != KIND_BANK:
+            target = getUnpackTarget(entry, lang_folders)
+            if target is not None:
+                loose.add(target)
+    return loose
+
+
+def unpackWwiseBanks(path = "input", workers=None, max_inflight_bytes=DEFAULT_INFLIGHT_BYTES, kinds=None, bank_wems=False):
+    # kinds=[KIND_BANK] only unpacks the banks, which is all the streaming mode needs on disk;
+    # bank_wems also pulls the wems embedded in the banks out of the mapped packages, like extractBankWem
     if not os.path.exists("output/unpack"):
         os.makedirs("output/unpack")
     if not os.path.exists(path):
         print("[Main] missing `input` folder!")
-
-    addAllPckFiles(package, path)
-    print('支持语言：' + str(package.LANGUAGE_DEF))
-
+    forgetCompletedFiles()
+
+    with PckArchive() as package:
+        addAllPckFiles(package, path)
+        print('支持语言：' + str(package.languages))
+
+        for i in UNPACK_LANGUAGES:
+            if not os.path.exists(f"output/unpack/{i}"):
+                os.makedirs(f"output/unpack/{i}")
+        lang_folders = getUnpackLanguages(package)
+
+        def getTarget(entry):
+            if kinds is not None and entry.kind not in kinds:
+                return None
+            return getUnpackTarget(entry, lang_folders)
+
+        count, size = extractPckEntries(package, getTarget, workers, max_inflight_bytes)
+        countWork(count, size)
+        print(f"[Main] unpacked {count} files, {size / (1 << 20):.1f} MB.")
+        if bank_wems:
+            banks = []
+            for entry in package.entries():
+                target = getTarget(entry)
+                if entry.kind == KIND_BANK and target is not None:
+                    banks.append((entry.pck.read(entry), os.path.dirname(target), target))
+            count, size = extractBanks(banks, workers, getLooseWems(package, lang_folders))
+            countWork(count, size)
+            del banks
+            print(f"[Main] extracted {count} bank wems, {size / (1 << 20):.1f} MB.")
+
+
+def extractBankWem(path="input", workers=None):
+    # every embedded wem of output/unpack/<lang>/**/*.bnk goes to output/unpack/<lang>/<id>.wem, but for
+    # the ones the packages in `path` also hold on their own
+    with PckArchive() as package:
+        addAllPckFiles(package, path)
+        loose = getLooseWems(package, getUnpackLanguages(package))
+    banks = []
     for i in ["SFX", "Chinese", "English", "Japanese", "Korean"]:
-        if not os.path.exists(f"output/unpack/{i}"):
-            os.makedirs(f"output/unpack/{i}")
-        if i.upper() in package.LANGUAGE_DEF:
-            langcode = package.LANGUAGE_DEF[i.upper()]
-        else:
+        for root, dirs, files in os.walk(f"output/unpack/{i}"):
+            for file in files:
+                if file.endswith(".bnk"):
+                    path = os.path.join(root, file)
+                    banks.append((path, f"output/unpack/{i}", path))
+    count, size = extractBanks(banks, workers, loose)
+    countWork(count, size)
+    print(f"[Main] extracted {count} bank wems, {size / (1 << 20):.1f} MB.")
+
+
+WWISER_PYZ = "wwiser.pyz"
+# what generateBankData hands to wwiser, which globs it without recursion
+BANK_GLOB = "./output/unpack/**/*.bnk"
+
+
+BANK_DUMPS = "output/unpack/bank_dumps"
+BANK_DUMP_MANIFEST = "output/unpack/bank_dumps/manifest.json"
+# banks per wwiser process at most, keeps the command line short
+MAX_BANKS_PER_DUMP = 100
+
+
+def getBankDumpKey(bank):
+    return os.path.relpath(bank, "output/unpack").replace("\\", "/")
+
+
+def getBankDumpPath(key):
+    return os.path.join(BANK_DUMPS, key + ".xml")
+
+
+def getBankDumpVersion():
+    # what a dump depends on besides its bank: wwiser and the name lists
+    names = ["output/unpack/wwnames.txt"] + sorted(glob.glob("output/unpack/*/wwnames.txt"))
+    return "/".join([toolFingerprint(WWISER_PYZ), toolFingerprint("wwnames.db3")]
+                    + [fileDigest(i) for i in names if os.path.exists(i)])
+
+
+def isBankDumpUpToDate(manifest, bank, version):
+    entry = manifest.get(getBankDumpKey(bank))
+    if entry is None or entry["version"] != version or not os.path.exists(getBankDumpPath(getBankDumpKey(bank))):
+        return False
+    stat = os.stat(bank)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime_ns == entry["mtime"]:
+        return True
+    # unpacking writes every bank again
+    if fileDigest(bank) == entry["hash"]:
+        entry["mtime"] = stat.st_mtime_ns
+        return True
+    return False
+
+
+def recordBankDump(manifest, bank, version):
+    stat = os.stat(bank)
+    manifest[getBankDumpKey(bank)] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "hash": fileDigest(bank),
+        "version": version,
+    }
+
+
+def dumpBanks(banks):
+    # one wwiser process dumping each bank of the group on its own (-m) next to it, the dumps are then
+    # moved to BANK_DUMPS; returns (bank, dumped) pairs
+    for bank in banks:
+        if os.path.exists(bank + ".xml"):
+            os.remove(bank + ".xml")
+    result = subprocess.run([sys.executable, WWISER_PYZ, '-m', '-d', 'xml'] + banks, capture_output=True, text=True)
+    done = []
+    for bank in banks:
+        if not os.path.exists(bank + ".xml"):
+            done.append((bank, False))
             continue
-        if len(package.map[0]) > 0 and langcode in package.map[0]:
-            for j in package.map[0][langcode]:
-                file_data = package.get_file_data_by_hash(j, langcode, 0)
-                with open(f'output/unpack/{i}/{j}.bnk', 'wb') as f:
-                    elegantWrite(f, file_data)
-        if len(package.map[1]) > 0 and langcode in package.map[1]:
-            for j in package.map[1][langcode]:
-                file_data = package.get_file_data_by_hash(j, langcode, 1)
-                with open(f'output/unpack/{i}/{j}.wem', 'wb') as f:
-                    elegantWrite(f, file_data)
-        if len(package.map[2]) > 0 and langcode in package.map[2]:
-            for j in package.map[2][langcode]:
-                file_data = package.get_file_data_by_hash(j, langcode, 2)
-                if not os.path.exists(f"output/unpack/{i}/externals"):
-                    os.makedirs(f"output/unpack/{i}/externals")
-                with open(f'output/unpack/{i}/externals/{j}.wem', 'wb') as f:
-                    elegantWrite(f, file_data)
-
-
-def extractBankWem():
-    for i in ["SFX", "Chinese", "English", "Japanese", "Korean"]:
-        result = subprocess.run(['./quickbms', '-F', '*.bnk', '-k', './wwiser_utils/scripts/wwise_bnk_extractor.bms', f'./output/unpack/{i}', f'./output/unpack/{i}'],
-                            capture_output=True, text=True)
+        dump = getBankDumpPath(getBankDumpKey(bank))
+        os.makedirs(os.path.dirname(dump), exist_ok=True)
+        os.replace(bank + ".xml", dump)
+        done.append((bank, True))
+    if result.returncode != 0:
         print(result.stdout)
-
-def generateBankData():
-    result = subprocess.run(['python', 'wwiser.pyz', '-d', 'xml', '-dn', './output/unpack/banks', './output/unpack/**/*.bnk'],
-                            capture_output=True, text=True)
-    print(result.stdout)
-
-
-def loadBankXml(use_old=True):
+    return done
+
+
+def generateBankData(workers=None):
+    # one wwiser dump per bank in BANK_DUMPS, made by `workers` wwiser processes at a time; dumps
+    # whose bank, wwiser and name lists did not change are kept
+    banks = glob.glob(BANK_GLOB)
+    manifest = loadManifest(BANK_DUMP_MANIFEST, "Main")
+    version = getBankDumpVersion()
+    current = {getBankDumpKey(bank) for bank in banks}
+    for key in list(manifest):
+        if key not in current:
+            if os.path.exists(getBankDumpPath(key)):
+                os.remove(getBankDumpPath(key))
+            del manifest[key]
+    pending = [bank for bank in banks if not isBankDumpUpToDate(manifest, bank, version)]
+    print(f"[Main] {len(banks) - len(pending)} bank dumps up to date, dumping {len(pending)} banks.")
+    if not pending:
+        saveManifest(BANK_DUMP_MANIFEST, manifest)
+        return
+
+    # biggest banks first, each to the lightest group
+    workers = workers or os.cpu_count() or 1
+    group_count = min(len(pending), max(workers * 4, -(-len(pending) // MAX_BANKS_PER_DUMP)))
+    groups = [[] for _ in range(group_count)]
+    heap = [(0, i) for i in range(group_count)]
+    for bank in sorted(pending, key=os.path.getsize, reverse=True):
+        size, i = heapq.heappop(heap)
+        groups[i].append(bank)
+        heapq.heappush(heap, (size + os.path.getsize(bank), i))
+
+    failed = 0
+    # the threads only wait on the wwiser processes
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for done in executor.map(dumpBanks, groups):
+            for bank, dumped in done:
+                if dumped:
+                    recordBankDump(manifest, bank, version)
+                    countWork(1, manifest[getBankDumpKey(bank)]["size"])
+                else:
+                    failed += 1
+                    print(f"[Main] ERR: wwiser did not dump {bank}")
+            saveManifest(BANK_DUMP_MANIFEST, manifest)
+    print(f"[Main] dumped {len(pending) - failed} banks, {failed} failed.")
+
+
+# HIRC objects renameEventWems reads, besides the actions (every CAkAction*) events point to
+RENAME_HIRC_TYPES = {
+    "CAkEvent", "CAkSound", "CAkSwitchCntr", "CAkRanSeqCntr", "CAkLayerCntr",
+    "CAkMusicSwitchCntr", "CAkMusicRanSeqCntr", "CAkMusicSegment", "CAkMusicTrack",
+}
+
+
+BANK_STORE = "output/unpack/bank_shards"
+
+
+def loadBankXml(use_old=True, hirc_types=None, compression="zlib", max_bytes=DEFAULT_MAX_BYTES):
+    # reads the per-bank dumps of generateBankData, or a single `banks.xml` made by an older version
+    types = ",".join(sorted(hirc_types)) if hirc_types is not None else ""
+    if os.path.exists(BANK_DUMP_MANIFEST):
+        manifest = loadManifest(BANK_DUMP_MANIFEST, "Main")
+        # the dumps only depend on their banks, which the key covers, and on the dump version
+        key = getBankCacheKey(None, "output/unpack", types + ";" + ";".join(
+            f"{bank}:{entry['hash']}:{entry['version']}" for bank, entry in sorted(manifest.items())))
+
+        def iterBankDumps():
+            for bank in sorted(manifest):
+                yield from iterBankXml(getBankDumpPath(bank), hirc_types)
+        loadBankStore(key, iterBankDumps, "the bank dumps", use_old, compression, max_bytes)
+        return
+    key = None
+    if os.path.exists("output/unpack/banks.xml"):
+        key = getBankCacheKey("output/unpack/banks.xml", "output/unpack", types)
+    loadBankStore(key, lambda: iterBankXml("output/unpack/banks.xml", hirc_types), "`banks.xml`",
+                  use_old, compression, max_bytes)
+
+
+def loadBankData(use_old=True, hirc_types=None, compression="zlib", max_bytes=DEFAULT_MAX_BYTES):
+    # same as generateBankData + loadBankXml, without the `banks.xml` round trip
+    filenames = glob.glob(BANK_GLOB)
+    name_files = ["output/unpack/wwnames.txt", "wwnames.txt", "wwnames.db3"] + sorted(glob.glob("output/unpack/*/wwnames.txt"))
+    key = getBankCacheKey(None, "output/unpack",
+                          "native:" + (",".join(sorted(hirc_types)) if hirc_types is not None else ""), name_files)
+    loadBankStore(key, lambda: iterBankNodes(filenames, hirc_types), "the banks", use_old, compression, max_bytes)
+
+
+def loadBankStore(key, banks, source, use_old=True, compression="zlib", max_bytes=DEFAULT_MAX_BYTES):
+    # bank_dict becomes a BankStore: one shard file per bank, loaded on demand
+    # and kept in memory by an LRU of `max_bytes`; banks() yields the bank dicts when it is rebuilt
     global bank_dict
-    if use_old and os.path.exists("output/unpack/banks_temp.json"):
-        with open("output/unpack/banks_temp.json", 'r') as f:
-            bank_dict_old = json.load(f)
-            # if bank_dict_old["hash"] == fnv_hash_64(xml_string):
-            print("[Main] Bank data loaded from cache. If you want to reload, delete the `banks_temp.json` file.")
-            bank_dict = bank_dict_old
+    if use_old:
+        start = time.perf_counter()
+        store = BankStore.open(BANK_STORE, key, max_bytes)
+        if store is not None:
+            if key is None:
+                print(f"[Main] {source} is missing, using the bank data cache without validating it.")
+            print(f"[Main] Bank index loaded from cache in {time.perf_counter() - start:.2f}s.")
+            bank_dict = store
             return
-    with open("output/unpack/banks.xml", 'r', encoding='utf-8') as f:
-        xml_string = f.read()
-    data_dict = xmltodict.parse("<base>" + xml_string + "</base>")
+        if os.path.exists(BANK_STORE):
+            print(f"[Main] Bank data cache is outdated, reloading {source}.")
     hash_map = {}
     for i in ["SFX", "Chinese", "English", "Japanese", "Korean"]:
         hash_map[str(fnv_hash_32(i))] = i
-    for bank in data_dict["base"]["root"]:
-        bank_cont = parseXmlNode(bank)
+    writer = BankStoreWriter(BANK_STORE, key, compression)
+    for bank_cont in banks():
         lang = bank_cont["BankHeader"]["AkBankHeader"]["dwLanguageID"]["@value"]
-        if hash_map[lang] not in bank_dict:
-            bank_dict[hash_map[lang]] = {}
-        bank_dict[hash_map[lang]][bank["@filename"]] = bank_cont
+        writer.add(hash_map[lang], bank_cont["@filename"], bank_cont)
+        countWork(1)
+    bank_dict = writer.close()
+    bank_dict.max_bytes = max_bytes
+
+
+def iterBankXml(path, hirc_types=None):
+    # Streams the wwiser dump one <root> (bank) at a time and builds the same dict the old
+    # xmltodict + parseXmlNode pass did: attributes as "@name", fields and objects keyed by their
+    # name (repeated names become lists), lists as [fields..., objects..., nested lists...].
+    # With `hirc_types`, other HIRC objects are skipped without being built.
+    parser = ET.XMLPullParser(events=("start", "end"))
+    parser.feed("<base>")
+    stack = []
+    skip_depth = 0
+    base = None
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.feed("</base>")
+            for event, elem in parser.read_events():
+                if event == "start":
+                    if base is None:
+                        base = elem
+                    elif skip_depth:
+                        skip_depth += 1
+                    elif (hirc_types is not None and elem.tag == "object" and stack
+                          and stack[-1]["node"].get("@name") == "listLoadedItem"
+                          and not isKeptHircItem(elem.get("name", ""), hirc_types)):
+                        skip_depth = 1
+                    else:
+                        stack.append({"node": {"@" + k: v for k, v in elem.attrib.items()},
+                                      "fields": [], "objects": [], "lists": [], "others": []})
+                    continue
+
+                if skip_depth:
+                    skip_depth -= 1
+                    elem.clear()
+                    continue
+                if elem is base:
+                    break
+                frame = stack.pop()
+                node = buildXmlNode(frame)
+                elem.clear()
+                if not stack:
+                    base.clear()
+                    yield node
+                    continue
+                parent = stack[-1]
+                if elem.tag == "list":
+                    parent["lists"].append((node, frame["fields"] + frame["objects"] + frame["lists_as_nodes"]))
+                elif elem.tag == "field":
+                    parent["fields"].append(node)
+                elif elem.tag == "object":
+                    parent["objects"].append(node)
+                else:
+                    parent["others"].append((elem.tag, node))
+            if not chunk:
+                break
+    parser.close()
 
-    with open("output/unpack/banks_temp.json", 'w') as f:
-        # bank_dict["hash"] = fnv_hash_64(xml_string)
-        json.dump(bank_dict, f, indent=4)
 
+def isKeptHircItem(name, hirc_types):
+    return name in hirc_types or name.startswith("CAkAction")
 
-def parseXmlNode(node):
-    result = node
-    parseXmlObj("field", node, result)
-    parseXmlObj("object", node, result)
-    parseXmlLst(node, result)
+
+def buildXmlNode(frame):
+    result = frame["node"]
+    for tag, node in frame["others"]:
+        if tag not in result:
+            result[tag] = node
+        else:
+            if not isinstance(result[tag], list):
+                result[tag] = [result[tag]]
+            result[tag].append(node)
+    for item in frame["fields"] + frame["objects"]:
+        if item["@name"] not in result:
+            result[item["@name"]] = item
+        else:
+            if not isinstance(result[item["@name"]], list):
+                foo = result[item["@name"]]
+                result[item["@name"]] = []
+                result[item["@name"]].append(foo)
+            result[item["@name"]].append(item)
+    # a list is a plain list in a node, but a node itself when it sits in another list
+    frame["lists_as_nodes"] = []
+    for node, items in frame["lists"]:
+        result[node["@name"]] = items
+        frame["lists_as_nodes"].append(node)
     return result
 
 
-def parseXmlObj(obj_name, obj, result):
-    if obj_name in obj:
-        if isinstance(obj[obj_name], list):
-            for item in obj[obj_name]:
-                if item["@name"] not in result:
-                    result[item["@name"]] = parseXmlNode(item)
-                else:
-                    if not isinstance(result[item["@name"]], list):
-                        foo = result[item["@name"]]
-                        result[item["@name"]] = []
-                        result[item["@name"]].append(foo)
-                    result[item["@name"]].append(parseXmlNode(item))
-        elif isinstance(obj[obj_name], dict):
-            result[obj[obj_name]["@name"]] = parseXmlNode(obj[obj_name])
-        del result[obj_name]
-
-
-def parseXmlLst(lst, result):
-    if "list" in lst:
-        lst = lst["list"]
-        if isinstance(lst, list):
-            for item in lst:
-                result[item["@name"]] = []
-                appendXmlLstElement("field", item, result[item["@name"]])
-                appendXmlLstElement("object", item, result[item["@name"]])
-                appendXmlLstElement("list", item, result[item["@name"]])
+def importWwiser(pyz=WWISER_PYZ):
+    # wwiser's parser and name lists, in-process straight from the zipapp
+    if pyz not in sys.path:
+        sys.path.insert(0, pyz)
+    from wwiser.parser import wparser
+    from wwiser.names import wnames
+    return wparser, wnames
+
+
+def getHircDispatchClass(func):
+    # CAkBankMgr__ReadSourceParent_CAkSound_ -> CAkSound, CAkBankMgr__ReadEvent -> CAkEvent
+    name = func.__name__.replace("CAkBankMgr__", "")
+    match = re.search(r"CAk[A-Za-z]+", name)
+    if match:
+        return match.group(0)
+    return "CAk" + name.replace("Read", "")
+
+
+def iterBankNodes(filenames, hirc_types=None, pyz=WWISER_PYZ):
+    # Parses the banks with wwiser in-process and builds the same dicts iterBankXml reads back from
+    # its dump, straight from the node tree. Like the -m dumps, each bank is parsed and named on its
+    # own and unloaded once yielded. With `hirc_types`, wwiser does not even decode the other HIRC
+    # objects: their sections are skipped by size.
+    wparser, wnames = importWwiser(pyz)
+    get_hirc_dispatch = wparser.get_hirc_dispatch
+
+    def getKeptDispatch(obj):
+        return {hirc_type: func for hirc_type, func in get_hirc_dispatch(obj).items()
+                if isKeptHircItem(getHircDispatchClass(func), hirc_types)}
+
+    parser = wparser.Parser()
+    for filename in filenames:
+        if hirc_types is not None:
+            wparser.get_hirc_dispatch = getKeptDispatch
+        try:
+            parser.parse_bank(filename)
+        finally:
+            wparser.get_hirc_dispatch = get_hirc_dispatch
+        names = wnames.Names()
+        try:
+            banks = parser.get_banks()
+            names.parse_files(banks, parser.get_filenames())
+            parser.set_names(names)
+            for bank in banks:
+                yield buildBankNode(bank, hirc_types)[0]
+        finally:
+            names.close()
+            if filename in parser.get_filenames():
+                parser.unload_bank(filename)
+
+
+def buildBankNode(node, hirc_types=None):
+    # (dict, frame) of a wwiser node, built like iterBankXml does from its dumped element
+    frame = {"node": {"@" + k: str(v) for k, v in node.get_attrs().items()},
+             "fields": [], "objects": [], "lists": [], "others": []}
+    skip_items = hirc_types is not None and frame["node"].get("@name") == "listLoadedItem"
+    for child in node.get_children() or ():
+        tag = child.get_nodename()
+        if skip_items and tag == "object" and not isKeptHircItem(str(child.get_attr("name")), hirc_types):
+            continue
+        child_node, child_frame = buildBankNode(child, hirc_types)
+        if tag == "list":
+            frame["lists"].append((child_node, child_frame["fields"] + child_frame["objects"] + child_frame["lists_as_nodes"]))
+        elif tag == "field":
+            frame["fields"].append(child_node)
+        elif tag == "object":
+            frame["objects"].append(child_node)
         else:
-            result[lst["@name"]] = []
-            appendXmlLstElement("field", lst, result[lst["@name"]])
-            appendXmlLstElement("object", lst, result[lst["@name"]])
-            appendXmlLstElement("list", lst, result[lst["@name"]])
-        del result["list"]
+            frame["others"].append((tag, child_node))
+    return buildXmlNode(frame), frame
 
 
-def appendXmlLstElement(obj_name, obj, lst):
-    if obj_name in obj:
-        if isinstance(obj[obj_name], list):
-            for item in obj[obj_name]:
-                lst.append(parseXmlNode(item))
-        elif isinstance(obj[obj_name], dict):
-            lst.append(parseXmlNode(obj[obj_name]))
-        del obj[obj_name]
+skip_num = 0
+completed_files = CompletionRegistry()
+COMPLETION_JOURNAL = "output/unpack/finished.journal"
+materializer = Materializer()
+# what each rename stage placed (or would place, in a dry run), one "old<TAB>new" line per file
+EXTERNAL_MAPPING = "output/rename_mapping_external.tsv"
+EVENT_MAPPING = "output/rename_mapping_event.tsv"
 
 
-skip_num = 0
-completed_files = []
+def setRenameStrategy(strategy="copy", dry_run=False, sources=None):
+    # hardlink / reflink / move / copy; dry_run only writes the rename mappings and leaves every file alone,
+    # `sources` are unpack paths to treat as present without being on disk
+    global materializer
+    materializer = Materializer(strategy, dry_run, sources)
+
+
+def resumeCompletedFiles():
+    # picks up the journal of an interrupted rename run, if any
+    global completed_files
+    completed_files.close()
+    completed_files = CompletionRegistry(None if materializer.dry_run else COMPLETION_JOURNAL)
+    if len(completed_files) > 0:
+        print(f"[Main] resuming rename, {len(completed_files)} files already done.")
+
+
+def forgetCompletedFiles():
+    # renames journaled before a new unpack may point at files that changed since, all are placed again
+    completed_files.clear()
+    if os.path.exists(COMPLETION_JOURNAL):
+        os.remove(COMPLETION_JOURNAL)
 
 
 def elegantRename(hash_path, voice_path, ext="wem", log_area="External", gentle=False):
     old_file_name = f"output/unpack/{hash_path}.{ext}"
     new_file_name = f"output/rename/{voice_path}.{ext}"
-    if os.path.exists(new_file_name):
-        os.remove(new_file_name)
-    global completed_files
-    if os.path.exists(old_file_name):
-        shutil.copy2(old_file_name, new_file_name)
-        if old_file_name not in completed_files:
-            completed_files.append(old_file_name)
-    else:
+    if not placeRenamed(old_file_name, new_file_name):
         if not gentle:
             print(f"[{log_area}] {old_file_name} -> {new_file_name} not found!")
         global skip_num
         skip_num += 1
 
 
+def placeRenamed(old_file_name, new_file_name):
+    # False when there is no such unpacked file
+    if completed_files.isRenamed(old_file_name, new_file_name) and os.path.exists(new_file_name):
+        materializer.record(old_file_name, new_file_name)
+        return True
+    if not materializer.exists(old_file_name):
+        return False
+    materializer.place(old_file_name, new_file_name)
+    completed_files.add(old_file_name, new_file_name)
+    return True
+
+
 def deleteCompletedFiles():
-    global completed_files
+    if materializer.dry_run:
+        materializer.report()
+        print(f"[Main] dry run, mappings are in {EXTERNAL_MAPPING} and {EVENT_MAPPING}, nothing deleted.")
+        return
     with open("output/unpack/finished.txt", "w", encoding="utf-8") as f:
         for file in completed_files:
             f.write(file + "\n")
     for file in completed_files:
-        os.remove(file)
-    completed_files = []
+        # already gone when a previous run stopped halfway through deleting
+        if os.path.exists(file):
+            os.remove(file)
+    completed_files.clear()
 
     for i in ["Chinese", "English", "Japanese", "Korean", "SFX"]:
         if not os.path.exists(f"output/rename/unclassified/{i}"):
@@ -234,294 +714,780 @@ def deleteCompletedFiles():
             for root, dirs, files in os.walk(f"output/unpack/{i}"):
                 for file in files:
                     if file.endswith('.wem'):
-                        shutil.copy2(os.path.join(root, file), f"output/rename/unclassified/{i}/{file}")
+                        materializer.place(os.path.join(root, file), f"output/rename/unclassified/{i}/{file}")
+    materializer.report()
+
+
+def getExternalIndex():
+    # external hash -> unpacked path of every external wem of the SFX folder (whatever its case), or
+    # of the packages when the materializer is told which sources exist
+    externals = {}
+    if os.path.exists("output/unpack"):
+        for folder in os.listdir("output/unpack"):
+            directory = f"output/unpack/{folder}/externals"
+            if folder.lower() == "sfx" and os.path.isdir(directory):
+                for file in os.listdir(directory):
+                    if file.endswith(".wem"):
+                        externals.setdefault(file[:-len(".wem")], f"{directory}/{file}")
+    for source in materializer.sources:
+        if source.startswith("output/unpack/sfx/externals/") and source.endswith(".wem"):
+            externals.setdefault(os.path.basename(source)[:-len(".wem")], source)
+    return externals
 
 
 def renameExtrenalWems():
     if not os.path.exists(f"output/rename"):
         os.makedirs(f"output/rename")
 
+    # one read of the table and one listing of the externals, joined on the hash of every language's path
+    mapping_start = len(materializer.mapping)
+    externals = getExternalIndex()
+    with open("data/TableCfg/AudioDialog.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+    paths = [data[key]["path"] for key in data]
+    renames = []
+    global skip_num
     for i in ["Chinese", "English", "Japanese", "Korean"]:
-        with open("data/TableCfg/AudioDialog.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-            for key in data:
-                entry = data[key]
-                if not os.path.exists(f"output/rename/Voice/{i}/{os.path.dirname(entry["path"])}"):
-                    os.makedirs(f"output/rename/Voice/{i}/{os.path.dirname(entry["path"])}")
-                hash = fnv_hash_64(f"Voice/{i}/{entry["path"]}")
-                elegantRename(f"sfx/externals/{hash}", f"Voice/{i}/{entry["path"].replace(".wem", "")}")
+        for path, hash in zip(paths, hashNames([f"Voice/{i}/{path}" for path in paths], 64)):
+            new_file_name = f"output/rename/Voice/{i}/{path.replace(".wem", "")}.wem"
+            if str(hash) not in externals:
+                print(f"[External] output/unpack/sfx/externals/{hash}.wem -> {new_file_name} not found!")
+                skip_num += 1
+                continue
+            renames.append((externals[str(hash)], new_file_name))
+    if not materializer.dry_run:
+        for directory in {os.path.dirname(new_file_name) for _, new_file_name in renames}:
+            os.makedirs(directory, exist_ok=True)
+    for old_file_name, new_file_name in renames:
+        if not placeRenamed(old_file_name, new_file_name):
+            print(f"[External] {old_file_name} -> {new_file_name} not found!")
+            skip_num += 1
     if not os.path.exists(f"output/rename/SFX"):
         os.makedirs(f"output/rename/SFX")
 
-    global skip_num
+    materializer.writeMapping(EXTERNAL_MAPPING, mapping_start)
     print(f"[External] skipped {skip_num} files because of unfound hash.")
     skip_num = 0
 
 
-def renameEventWems(use_index=True):
-    def getLoadedItems(bank):
-        hirc = bank.get("HircChunk", {})
-        loaded_items = hirc.get("listLoadedItem", [])
-        loaded_items_map = {}
-        for item in loaded_items:
-            loaded_items_map[item.get("ulID", item.get("ulStateID", ""))["@value"]] = item
-        return loaded_items_map
-
-    def findAudioNode(nodes, audioNodeIdToName, path = ""):
-        for node in nodes:
-            if "audioNodeId" in node:
-                audioNodeIdToName[node["audioNodeId"]["@value"]] = path + node["key"].get("@hashname", node["key"]["@value"])
-            elif "pNodes" in node:
-                findAudioNode(node["pNodes"], audioNodeIdToName, path + node["key"].get("@hashname", node["key"]["@value"]) + "/")
-
-    def findSwitchNode(nodes, switchNodeIdToName):
-        for node in nodes:
-            if int(node["ulNumItems"]["@value"]) > 0:
-                if int(node["ulNumItems"]["@value"]) == 1:
-                    switchNodeIdToName[node["NodeList"]["NodeID"]["@value"]] = node["ulSwitchID"].get("@hashname",
-                                                                                                    node["ulSwitchID"][
-                                                                                                        "@value"])
-                else:
-                    for item in node["NodeList"]["NodeID"]:
-                        switchNodeIdToName[item["@value"]] = node["ulSwitchID"].get("@hashname",
-                                                                                   node["ulSwitchID"]["@value"])
-
-    def getChilds(node, result):
-        if "ulNumChilds" in node:
-            if int(node["ulNumChilds"]["@value"]) > 0:
-                if int(node["ulNumChilds"]["@value"]) == 1:
-                    result.append(node["ulChildID"]["@value"])
-                else:
-                    for child in node["ulChildID"]:
-                        result.append(child["@value"])
-        return result
-
-    def findMusicSound(sound_id, musicSegments, musicTracks, musicRanSeqCntrs, musicSwitchCntrs, path, result):
-        if sound_id in musicSwitchCntrs:
-            for child in musicSwitchCntrs[sound_id]:
-                subpath = path
-                subpath += f"/{musicSwitchCntrs[sound_id][child]}"
-                findMusicSound(child, musicSegments, musicTracks, musicRanSeqCntrs, musicSwitchCntrs, subpath, result)
-        if sound_id in musicRanSeqCntrs:
-            childs = []
-            getChilds(musicRanSeqCntrs[sound_id], childs)
-            for child in childs:
-                findMusicSound(child, musicSegments, musicTracks, musicRanSeqCntrs, musicSwitchCntrs, path, result)
-        if sound_id in musicSegments:
-            childs = []
-            getChilds(musicSegments[sound_id], childs)
-            for child in childs:
-                findMusicSound(child, musicSegments, musicTracks, musicRanSeqCntrs, musicSwitchCntrs, path, result)
-        if sound_id in musicTracks:
-            for source in musicTracks[sound_id]:
-                subpath = path
-                subpath += f"/{source["AkMediaInformation"]["sourceID"]["@value"]}"
-                result[source["AkMediaInformation"]["sourceID"]["@value"]] = subpath
-
-    def findSound(sound_id, loaded_items, normal_sound_path, lang, path, results):
-        def renameSource(source, index, source_index):
-            source_sound_path = normal_sound_path
-            if source["AkMediaInformation"]["uSourceBits"]["bIsLanguageSpecific"]["@value"] == "0":
-                source_sound_path = normal_sound_path.replace(f"{lang}", "sfx")
-            name = source["AkMediaInformation"]["sourceID"]["@value"]
-            file2rename = f"{source_sound_path[14:]}/{name}"
-            if use_index:
-                index_string = f"{index}{'~' if source_index else ''}{source_index}~"
+def findAudioNode(nodes, audioNodeIdToName, path = ""):
+    for node in nodes:
+        if "audioNodeId" in node:
+            audioNodeIdToName[node["audioNodeId"]["@value"]] = path + node["key"].get("@hashname", node["key"]["@value"])
+        elif "pNodes" in node:
+            findAudioNode(node["pNodes"], audioNodeIdToName, path + node["key"].get("@hashname", node["key"]["@value"]) + "/")
+
+
+def findSwitchNode(nodes, switchNodeIdToName):
+    for node in nodes:
+        if int(node["ulNumItems"]["@value"]) > 0:
+            if int(node["ulNumItems"]["@value"]) == 1:
+                switchNodeIdToName[node["NodeList"]["NodeID"]["@value"]] = node["ulSwitchID"].get("@hashname",
+                                                                                                node["ulSwitchID"][
+                                                                                                    "@value"])
+            else:
+                for item in node["NodeList"]["NodeID"]:
+                    switchNodeIdToName[item["@value"]] = node["ulSwitchID"].get("@hashname",
+                                                                               node["ulSwitchID"]["@value"])
+
+
+def getChilds(node, result):
+    if "ulNumChilds" in node:
+        if int(node["ulNumChilds"]["@value"]) > 0:
+            if int(node["ulNumChilds"]["@value"]) == 1:
+                result.append(node["ulChildID"]["@value"])
+            else:
+                for child in node["ulChildID"]:
+                    result.append(child["@value"])
+    return result
+
+
+def getSoundChildren(item):
+    # (child id, path suffix) of a container, in the order they end up in the rename output
+    name = item["@name"]
+    if name in ["CAkSwitchCntr", "CAkMusicSwitchCntr"]:
+        node_id2name = {}
+        if name == "CAkSwitchCntr":
+            values = item["SwitchCntrInitialValues"]
+            childs = getChilds(values["Children"], [])
+            findSwitchNode(values["SwitchList"], node_id2name)
+        else:
+            values = item["MusicSwitchCntrInitialValues"]
+            childs = getChilds(values["MusicTransNodeParams"]["MusicNodeParams"]["Children"], [])
+            findAudioNode(values["AkDecisionTree"]["pNodes"], node_id2name)
+        children = []
+        for child in node_id2name:
+            children.append((child, f"/{node_id2name[child]}"))
+            if child in childs:
+                childs.remove(child)
+        return children + [(child, f"/unswitched-{child}") for child in childs]
+    if name == "CAkRanSeqCntr":
+        childs = getChilds(item["RanSeqCntrInitialValues"]["Children"], [])
+    elif name == "CAkLayerCntr":
+        childs = getChilds(item["LayerCntrInitialValues"]["Children"], [])
+    elif name == "CAkMusicRanSeqCntr":
+        childs = getChilds(item["MusicRanSeqCntrInitialValues"]["MusicTransNodeParams"]["MusicNodeParams"]["Children"], [])
+    elif name == "CAkMusicSegment":
+        childs = getChilds(item["MusicSegmentInitialValues"]["MusicNodeParams"]["Children"], [])
+    else:
+        childs = []
+    return [(child, "") for child in childs]
+
+
+def getSoundSources(item):
+    # (source, index, source index) of the wems a node plays itself
+    if item["@name"] == "CAkSound":
+        return [(item["SoundInitialValues"]["AkBankSourceData"], item["@index"], "")]
+    if item["@name"] == "CAkMusicTrack":
+        return [(source, item["@index"], source["@index"]) for source in item["MusicTrackInitialValues"]["pSource"]]
+    return []
+
+
+def resolveSoundLeaves(sound_id, loaded_items, leaves):
+    # every (source, index, source index, relative path) below sound_id; `leaves` memoizes this per node id
+    # so subtrees shared by many events are walked once, and the walk keeps its own stack instead of recursing
+    if sound_id in leaves:
+        return leaves[sound_id]
+    stack = [[sound_id, None, 0]]
+    visiting = set()
+    while stack:
+        entry = stack[-1]
+        node_id, children, position = entry
+        if children is None:
+            item = loaded_items.get(node_id)
+            children = getSoundChildren(item) if item is not None else []
+            entry[1] = children
+            visiting.add(node_id)
+        while position < len(children) and children[position][0] in leaves:
+            position += 1
+        entry[2] = position
+        if position < len(children):
+            child = children[position][0]
+            if child in visiting:
+                print(f"[Event] cycle through {child} below {sound_id}, skipping it")
+                entry[2] += 1
             else:
-                index_string = ""
-            file_destination = f"{normal_sound_path[14:]}/{path}/{index_string}{name}"
-            if not os.path.exists(f"output/rename/{normal_sound_path[14:]}/{path}"):
-                os.makedirs(f"output/rename/{normal_sound_path[14:]}/{path}")
-            results.append((file2rename, file_destination))
-
-        if sound_id in loaded_items:
-            name = loaded_items[sound_id]["@name"]
-
-            if name == "CAkSwitchCntr":
-                node_id2name = {}
-                childs = []
-                getChilds(loaded_items[sound_id]["SwitchCntrInitialValues"]["Children"], childs)
-                findSwitchNode(loaded_items[sound_id]["SwitchCntrInitialValues"]["SwitchList"], node_id2name)
-                for child in node_id2name:
-                    subpath = path
-                    subpath += f"/{node_id2name[child]}"
-                    findSound(child, loaded_items, normal_sound_path, lang, subpath, results)
-                    if child in childs:
-                        childs.remove(child)
-                for child in childs:
-                    findSound(child, loaded_items, normal_sound_path, lang, path + f"/unswitched-{child}", results)
-
-            if name == "CAkRanSeqCntr":
-                childs = []
-                getChilds(loaded_items[sound_id]["RanSeqCntrInitialValues"]["Children"], childs)
-                for child in childs:
-                    findSound(child, loaded_items, normal_sound_path, lang, path, results)
-
-            if name == "CAkLayerCntr":
-                childs = []
-                getChilds(loaded_items[sound_id]["LayerCntrInitialValues"]["Children"], childs)
-                for child in childs:
-                    findSound(child, loaded_items, normal_sound_path, lang, path, results)
-
-            if name == "CAkSound":
-                source = loaded_items[sound_id]["SoundInitialValues"]["AkBankSourceData"]
-                renameSource(source, loaded_items[sound_id]["@index"], "")
-
-            if name == "CAkMusicSwitchCntr":
-                node_id2name = {}
-                childs = []
-                getChilds(
-                    loaded_items[sound_id]["MusicSwitchCntrInitialValues"]["MusicTransNodeParams"]["MusicNodeParams"][
-                        "Children"], childs)
-                findAudioNode(loaded_items[sound_id]["MusicSwitchCntrInitialValues"]["AkDecisionTree"]["pNodes"],
-                              node_id2name)
-                for child in node_id2name:
-                    subpath = path
-                    subpath += f"/{node_id2name[child]}"
-                    findSound(child, loaded_items, normal_sound_path, lang, subpath, results)
-                    if child in childs:
-                        childs.remove(child)
-                for child in childs:
-                    findSound(child, loaded_items, normal_sound_path, lang, path + f"/unswitched-{child}", results)
-
-            if name == "CAkMusicRanSeqCntr":
-                childs = []
-                getChilds(
-                    loaded_items[sound_id]["MusicRanSeqCntrInitialValues"]["MusicTransNodeParams"]["MusicNodeParams"][
-                        "Children"], childs)
-                for child in childs:
-                    findSound(child, loaded_items, normal_sound_path, lang, path, results)
-
-            if name == "CAkMusicSegment":
-                childs = []
-                getChilds(loaded_items[sound_id]["MusicSegmentInitialValues"]["MusicNodeParams"]["Children"], childs)
-                for child in childs:
-                    findSound(child, loaded_items, normal_sound_path, lang, path, results)
-
-            if name == "CAkMusicTrack":
-                for source in loaded_items[sound_id]["MusicTrackInitialValues"]["pSource"]:
-                    renameSource(source, loaded_items[sound_id]["@index"], source["@index"])
+                stack.append([child, None, 0])
+            continue
+
+        item = loaded_items.get(node_id)
+        result = [(source, index, source_index, "") for source, index, source_index in getSoundSources(item)] if item is not None else []
+        for child, suffix in children:
+            for source, index, source_index, path in leaves.get(child, []):
+                result.append((source, index, source_index, suffix + path))
+        leaves[node_id] = result
+        visiting.discard(node_id)
+        stack.pop()
+    return leaves[sound_id]
+
+
+def getSourceRename(source, index, source_index, normal_sound_path, lang, path, use_index=True):
+    source_sound_path = normal_sound_path
+    if source["AkMediaInformation"]["uSourceBits"]["bIsLanguageSpecific"]["@value"] == "0":
+        source_sound_path = normal_sound_path.replace(f"{lang}", "sfx")
+    name = source["AkMediaInformation"]["sourceID"]["@value"]
+    file2rename = f"{source_sound_path[14:]}/{name}"
+    if use_index:
+        index_string = f"{index}{'~' if source_index else ''}{source_index}~"
+    else:
+        index_string = ""
+    file_destination = f"{normal_sound_path[14:]}/{path}/{index_string}{name}"
+    return file2rename, file_destination
+
+
+def collectEventRenames(lang, bank_name, use_index=True):
+    # (rename pairs, completed bank paths) for the Play actions of one bank's events
+    bank = bank_dict[lang][bank_name]
+    loaded_items_map = bank_dict.loadedItems(lang, bank_name)
+    renames = []
+    completed = []
+    processed = False
+
+    for item_id in loaded_items_map:
+        item = loaded_items_map[item_id]
+        if item["@name"] == "CAkEvent":
+            event_id = item["ulID"]["@value"]
+            event_name = item["ulID"].get("@hashname", event_id)
+            for action in item["EventInitialValues"]["actions"]:
+                action_item = loaded_items_map[action["ulActionID"]["@value"]]
+                if action_item["@name"] == "CAkActionPlay":
+                    params = action_item["ActionInitialValues"]["PlayActionParams"]
+                    id_ext = action_item["ActionInitialValues"]["idExt"]["@value"]
+                    for sound_lang in (["SFX", lang] if lang != "SFX" else ["SFX", "Chinese", "English", "Japanese", "Korean"]):
+                        sound_bank_name = bank_dict.findBank(sound_lang, params["bankID"])
+                        if sound_bank_name is None:
+                            # print(f"[Event] ERR: {sound_lang}: {params['bankID']['@value']}.bnk cannot be found!")
+                            continue
+                        sound_bank = bank_dict[sound_lang][sound_bank_name]
+                        sound_bank_loaded_items_map = bank_dict.loadedItems(sound_lang, sound_bank_name)
+
+                        normal_sound_path = sound_bank["@path"].replace("\\", "/").replace("./", "")
+
+                        if id_ext in sound_bank_loaded_items_map:
+                            leaves = bank_dict.getDerived(sound_lang, sound_bank_name).setdefault("sound_leaves", {})
+                            for source, index, source_index, path in resolveSoundLeaves(id_ext, sound_bank_loaded_items_map, leaves):
+                                renames.append(getSourceRename(source, index, source_index, normal_sound_path, lang, event_name + path, use_index))
+                            completed.append(f"{normal_sound_path}/{sound_bank["@filename"]}")
+
+            processed = True
+
+    if processed:
+        normal_path = bank["@path"].replace("\\", "/").replace("./", "")
+        completed.append(f"{normal_path}/{bank["@filename"]}")
+    return renames, list(dict.fromkeys(completed))
 
+
+def renameEventWems(use_index=True):
     if not os.path.exists(f"output/rename"):
         os.makedirs(f"output/rename")
 
+    mapping_start = len(materializer.mapping)
+    made_dirs = set()
     for lang in bank_dict:
         if lang == "hash":
             continue
         for bank_name in bank_dict[lang]:
             print(f"[Event] {lang}: {bank_name}")
-            bank = bank_dict[lang][bank_name]
-
-            loaded_items_map = getLoadedItems(bank)
-
-            processed = False
-            global completed_files
-
-            for item_id in loaded_items_map:
-                item = loaded_items_map[item_id]
-                if item["@name"] == "CAkEvent":
-                    # print(f"[Event] processing event {item['ulID'].get('@hashname', item['ulID']['@value'])}...")
-                    event_id = item["ulID"]["@value"]
-                    event_name = item["ulID"].get("@hashname", event_id)
-                    for action in item["EventInitialValues"]["actions"]:
-                        action_item = loaded_items_map[action["ulActionID"]["@value"]]
-                        if action_item["@name"] == "CAkActionPlay":
-                            params = action_item["ActionInitialValues"]["PlayActionParams"]
-                            id_ext = action_item["ActionInitialValues"]["idExt"]["@value"]
-                            for sound_lang in (["SFX", lang] if lang != "SFX" else ["SFX", "Chinese", "English", "Japanese", "Korean"]):
-                                if sound_lang in bank_dict and (params["bankID"]["@value"] + ".bnk" in bank_dict[sound_lang] or params["bankID"].get("@hashname", "") + ".bnk" in bank_dict[sound_lang] or params["bankID"].get("@guidname", "") + ".bnk" in bank_dict[sound_lang]):
-                                    sound_bank = bank_dict[sound_lang].get(params["bankID"]["@value"] + ".bnk", bank_dict[sound_lang].get(params["bankID"].get("@hashname", "") + ".bnk", bank_dict[sound_lang].get(params["bankID"].get("@guidname", "") + ".bnk", None)))
-                                    if sound_bank is None:
-                                        # print(f"[Event] ERR: {sound_lang}: {sound_bank} cannot be found!")
-                                        continue
-                                    sound_bank_loaded_items_map = getLoadedItems(sound_bank)
-
-                                    sound_processed = False
-
-                                    normal_sound_path = sound_bank["@path"].replace("\\", "/").replace("./", "")
-
-                                    if id_ext in sound_bank_loaded_items_map:
-                                        rename_list = []
-                                        findSound(id_ext, sound_bank_loaded_items_map, normal_sound_path, lang, event_name, rename_list)
-                                        for pair in rename_list:
-                                            elegantRename(pair[0], pair[1], "wem", "Event")
-                                        sound_processed = True
-
-                                    if sound_processed and f"{normal_sound_path}/{sound_bank["@filename"]}" not in completed_files:
-                                        completed_files.append(f"{normal_sound_path}/{sound_bank["@filename"]}")
-                                else:
-                                    # print(f"[Event] ERR: {sound_lang}: {params['bankID']['@value']}.bnk cannot be found!")
-                                    pass
-
-                    processed = True
-
-            normal_path = bank["@path"].replace("\\", "/").replace("./", "")
-            if processed and f"{normal_path}/{bank["@filename"]}" not in completed_files:
-                completed_files.append(f"{normal_path}/{bank["@filename"]}")
-
+            renames, completed = collectEventRenames(lang, bank_name, use_index)
+            for pair in renames:
+                directory = os.path.dirname(f"output/rename/{pair[1]}")
+                if directory not in made_dirs and not materializer.dry_run:
+                    os.makedirs(directory, exist_ok=True)
+                    made_dirs.add(directory)
+                elegantRename(pair[0], pair[1], "wem", "Event")
+            for file in completed:
+                completed_files.add(file)
+
+    materializer.writeMapping(EVENT_MAPPING, mapping_start)
     global skip_num
     print(f"[Event] skipped {skip_num} files because of unfound hash.")
     skip_num = 0
 
-def decodeWems():
-    for root, dirs, files in os.walk("output/rename"):
-        for file in files:
-            if file.endswith(".wem"):
-                path = root.replace("\\", "/") + "/" + file
-                short_path = path.replace("output/rename/", "").replace("wem", "wav")
-                if not os.path.exists(f"output/decode/{short_path}"):
-                    os.makedirs(os.path.dirname(f"output/decode/{short_path}"), exist_ok=True)
-                subprocess.run(
-                    ["./vgmstream/vgmstream-cli", path, "-o", f"output/decode/{short_path}"])
-
-from convert_ogg import WwiseOpusConverter
-
-def decodeWemsToOgg():
-    for root, dirs, files in os.walk("output/rename"):
-        for file in files:
-            if file.endswith(".wem"):
-                path = root.replace("\\", "/") + "/" + file
-                short_path = path.replace("output/rename/", "").replace("wem", "ogg")
-                if not os.path.exists(f"output/decode_unrevorbed/{short_path}"):
-                    os.makedirs(os.path.dirname(f"output/decode_unrevorbed/{short_path}"), exist_ok=True)
-                if not os.path.exists(f"output/decode/{short_path}"):
-                    os.makedirs(os.path.dirname(f"output/decode/{short_path}"), exist_ok=True)
-                converter = WwiseOpusConverter(path)
-                try:
-                    converter.convert(f"output/decode/{short_path}")
-                    print(f"Successfully converted {path} to {f"output/decode/{short_path}"}")
-                except Exception as e:
-                    print(f"Error converting: {e}, trying ww2ogg")
-                    subprocess.run(
-                        ["./ww2ogg", path, "-o", f"output/decode_unrevorbed/{short_path}", "--pcb", "packed_codebooks_aoTuV_603.bin"])
-                    subprocess.run(
-                        ["./revorb", f"output/decode_unrevorbed/{short_path}", f"output/decode/{short_path}"])
 
+def decodeWemToWav(path, short_path):
+    output_path = f"output/decode/{short_path}"
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        result = subprocess.run(["./vgmstream/vgmstream-cli", path, "-o", output_path], capture_output=True, text=True)
+        if result.returncode != 0:
+            return "failed", path, f"vgmstream: {result.stdout.strip()} {result.stderr.strip()}"
+        return "vgmstream", path, ""
+    except Exception as e:
+        return "failed", path, str(e)
+
+
+def decodeWems(workers=None, max_pending=None, force=False):
+    manifest = loadDecodeManifest()
+    jobs = DecodeJobs("wav", None if force else manifest)
+    failed = 0
+    unchanged = 0
+    for (path, short_path, _), (status, path, message, source) in runDecodeJobs(decodeWemToWav, jobs, workers,
+                                                                                max_pending):
+        if status == "unchanged":
+            unchanged += 1
+            manifest[short_path]["mtime"] = source[1]
+        elif status == "failed":
+            failed += 1
+            print(f"[Decode] ERR: failed to decode {path}: {message}")
+        else:
+            recordDecode(manifest, path, short_path, status, source)
+            countWork(1, manifest[short_path]["size"])
+    saveDecodeManifest(manifest)
+    print(f"[Decode] {jobs.skipped + unchanged} files up to date, {failed} failed.")
+
+from convert_ogg import convert_wem, CONVERTER_VERSION
+
+# pck sources mapped by this process, kept for the whole run
+pck_sources = {}
+
+
+def getPckSource(pck_path, offset, size):
+    # "<pck path>#<offset>+<size>" names a wem inside a package, for the streaming mode
+    return f"{pck_path}#{offset}+{size}"
+
+
+def parsePckSource(source):
+    pck_path, sep, span = source.rpartition("#")
+    offset, sep2, size = span.partition("+")
+    if not sep or not sep2 or not offset.isdigit() or not size.isdigit():
+        return None
+    return pck_path, int(offset), int(size)
+
+
+def readPckSource(pck_path, offset, size):
+    if pck_path not in pck_sources:
+        pck_sources[pck_path] = PckFile(pck_path)
+    return pck_sources[pck_path].data[offset:offset + size]
+
+
+def closePckSources():
+    for pck in pck_sources.values():
+        pck.close()
+    pck_sources.clear()
+
+
+def initDecodeWorker():
+    # a pool worker maps the packages it reads from on its own, they are closed when it exits
+    multiprocessing.util.Finalize(None, closePckSources, exitpriority=0)
+
+
+def transcodeWemToOgg(path, short_path):
+    # runs inside a pool worker, so every failure is turned into a result instead of raised,
+    # the status is the backend that produced the file: opus/vorbis in-process, ww2ogg as the fallback
+    output_path = f"output/decode/{short_path}"
+    reason = ""
+    wem_path = path
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        pck_source = parsePckSource(path)
+        try:
+            return convert_wem(readPckSource(*pck_source) if pck_source else path, output_path), path, ""
+        except Exception as e:
+            reason = str(e)
+
+        unrevorbed_path = f"output/decode_unrevorbed/{short_path}"
+        os.makedirs(os.path.dirname(unrevorbed_path), exist_ok=True)
+        if pck_source:
+            # the external tools want a file
+            wem_path = unrevorbed_path + ".wem"
+            with open(wem_path, 'wb') as f:
+                f.write(readPckSource(*pck_source))
+        result = subprocess.run(
+            ["./ww2ogg", wem_path, "-o", unrevorbed_path, "--pcb", "packed_codebooks_aoTuV_603.bin"],
+            capture_output=True, text=True)
+        if result.returncode != 0:
+            return "failed", path, f"{reason}; ww2ogg: {result.stdout.strip()} {result.stderr.strip()}"
+        result = subprocess.run(["./revorb", unrevorbed_path, output_path], capture_output=True, text=True)
+        if result.returncode != 0:
+            return "failed", path, f"{reason}; revorb: {result.stdout.strip()} {result.stderr.strip()}"
+        return "ww2ogg", path, reason
+    except Exception as e:
+        return "failed", path, f"{reason}; {e}" if reason else str(e)
+    finally:
+        if wem_path != path and os.path.exists(wem_path):
+            os.remove(wem_path)
+
+
+DECODE_MANIFEST = "output/decode/manifest.json"
+
+
+def fileDigest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    pck_source = parsePckSource(path)
+    if pck_source:
+        digest.update(readPckSource(*pck_source))
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sourceStat(path):
+    # (size, mtime_ns) of a wem file or of a wem inside a package
+    pck_source = parsePckSource(path)
+    if pck_source:
+        return pck_source[2], os.stat(pck_source[0]).st_mtime_ns
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def toolFingerprint(path):
+    for candidate in (path, path + ".exe"):
+        if os.path.exists(candidate):
+            stat = os.stat(candidate)
+            return f"{stat.st_size}-{int(stat.st_mtime)}"
+    return "missing"
+
+
+def getDecodeBackendVersion(backend):
+    if backend in ["opus", "vorbis"]:
+        return f"convert_ogg-{CONVERTER_VERSION}"
+    if backend == "ww2ogg":
+        return "/".join(toolFingerprint(i) for i in ["./ww2ogg", "./revorb", "packed_codebooks_aoTuV_603.bin"])
+    if backend == "vgmstream":
+        return toolFingerprint("./vgmstream/vgmstream-cli")
+    return ""
+
+
+def loadManifest(path, log_area):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            print(f"[{log_area}] {path} is corrupted, everything will be done again.")
+    return {}
+
+
+def saveManifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(path + ".tmp", path)
+
+
+def loadDecodeManifest():
+    return loadManifest(DECODE_MANIFEST, "Decode")
+
+
+def saveDecodeManifest(manifest):
+    saveManifest(DECODE_MANIFEST, manifest)
+
+
+def checkDecode(manifest, path, short_path):
+    # (up to date, digest): a source whose mtime changed but not its size (e.g. copied again by the
+    # rename stage) may still be the one decoded, its digest is what the worker compares it to, the
+    # parent only stats
+    entry = manifest.get(short_path)
+    if entry is None or entry["source"] != path or not os.path.exists(f"output/decode/{short_path}"):
+        return False, None
+    if entry["version"] != getDecodeBackendVersion(entry["backend"]):
+        return False, None
+    size, mtime = sourceStat(path)
+    if size != entry["size"]:
+        return False, None
+    if mtime == entry["mtime"]:
+        return True, None
+    return False, entry["hash"]
+
+
+def getSourceInfo(path):
+    # (size, mtime_ns, digest) of a decode source
+    size, mtime = sourceStat(path)
+    return size, mtime, fileDigest(path)
+
+
+def recordDecode(manifest, path, short_path, backend, source=None):
+    size, mtime, digest = source or getSourceInfo(path)
+    manifest[short_path] = {
+        "source": path,
+        "size": size,
+        "mtime": mtime,
+        "hash": digest,
+        "backend": backend,
+        "version": getDecodeBackendVersion(backend),
+    }
+
+
+class DecodeJobs:
+    # walks `output/rename`, skipping files the manifest says are already decoded
+    def __init__(self, ext, manifest=None):
+        self.ext = ext
+        self.manifest = manifest
+        self.skipped = 0
+
+    def __iter__(self):
+        for root, dirs, files in os.walk("output/rename"):
+            for file in files:
+                if file.endswith(".wem"):
+                    path = root.replace("\\", "/") + "/" + file
+                    short_path = path.replace("output/rename/", "").replace("wem", self.ext)
+                    up_to_date, digest = False, None
+                    if self.manifest is not None:
+                        up_to_date, digest = checkDecode(self.manifest, path, short_path)
+                    if up_to_date:
+                        self.skipped += 1
+                        continue
+                    yield path, short_path, digest
+
+
+def runDecodeJob(worker, path, short_path, digest=None):
+    # the source is hashed here, in the pool worker and before it is converted, so the parent only
+    # has to record it; the result gets getSourceInfo() appended, None when it failed. A source that
+    # still has checkDecode's `digest` is "unchanged" and not converted again
+    try:
+        source = getSourceInfo(path)
+    except Exception as e:
+        return "failed", path, str(e), None
+    if digest is not None and source[2] == digest:
+        return "unchanged", path, "", source
+    status, path, message = worker(path, short_path)
+    return status, path, message, source if status != "failed" else None
+
+
+def runDecodeJobs(worker, jobs, workers=None, max_pending=None):
+    # feeds `jobs` to a process pool while keeping at most `max_pending` of them queued and yields
+    # (job, result) as they finish, a crashed worker process only costs the files it was holding.
+    # Results are runDecodeJob's
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = workers * 4
+
+    if workers <= 1:
+        for job in jobs:
+            yield job, runDecodeJob(worker, *job)
+        return
+
+    jobs = iter(jobs)
+    retry = []
+    crashed = set()
+    while True:
+        pending = {}
+        broken = False
+        with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=initDecodeWorker) as pool:
+            while not broken:
+                while len(pending) < max_pending:
+                    job = retry.pop() if retry else next(jobs, None)
+                    if job is None:
+                        break
+                    pending[pool.submit(runDecodeJob, worker, *job)] = job
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        if job in crashed:
+                            yield job, ("failed", job[0], "worker process crashed", None)
+                        else:
+                            crashed.add(job)
+                            retry.append(job)
+                    else:
+                        yield job, result
+            if broken:
+                # every queued job died with the pool, give each one more chance in a fresh pool
+                for job in pending.values():
+                    if job in crashed:
+                        yield job, ("failed", job[0], "worker process crashed", None)
+                    else:
+                        crashed.add(job)
+                        retry.append(job)
+        if not broken:
+            return
 
 
+def transcodeJobsToOgg(jobs, manifest, workers=None, max_pending=None, skipped=lambda: 0):
+    summary = {"opus": [], "vorbis": [], "ww2ogg": [], "failed": []}
+    unchanged = 0
+    start = time.perf_counter()
+    for (path, short_path, _), (status, path, message, source) in runDecodeJobs(transcodeWemToOgg, jobs, workers,
+                                                                                 max_pending):
+        if status == "unchanged":
+            unchanged += 1
+            manifest[short_path]["mtime"] = source[1]
+            continue
+        summary[status].append(path)
+        if status == "failed":
+            manifest.pop(short_path, None)
+            print(f"[Decode] ERR: failed to convert {path}: {message}")
+            continue
+        recordDecode(manifest, path, short_path, status, source)
+        countWork(1, manifest[short_path]["size"])
+        if status == "ww2ogg":
+            print(f"[Decode] converted {path} with ww2ogg ({message})")
+        else:
+            print(f"[Decode] converted {path}")
+        if sum(len(summary[i]) for i in ["opus", "vorbis", "ww2ogg"]) % 1000 == 0:
+            # keep progress if the run gets interrupted
+            saveDecodeManifest(manifest)
+    saveDecodeManifest(manifest)
+
+    total = sum(len(paths) for paths in summary.values())
+    print(f"[Decode] {total} files in {time.perf_counter() - start:.1f}s: "
+          f"{len(summary['opus']) + len(summary['vorbis'])} converted "
+          f"(opus: {len(summary['opus'])}, vorbis: {len(summary['vorbis'])}), "
+          f"{len(summary['ww2ogg'])} fell back to ww2ogg, "
+          f"{len(summary['failed'])} failed, {skipped() + unchanged} up to date.")
+    for path in summary["failed"]:
+        print(f"[Decode] failed: {path}")
+    return summary
+
+
+def decodeWemsToOgg(workers=None, max_pending=None, force=False):
+    manifest = loadDecodeManifest()
+    jobs = DecodeJobs("ogg", None if force else manifest)
+    return transcodeJobsToOgg(jobs, manifest, workers, max_pending, lambda: jobs.skipped)
+
+
+def getPckSources(path="input"):
+    # lower-cased unpack path -> pck source of every wem in the packages, the ones embedded in banks
+    # included, in on-disk order
+    sources = {}
+    embedded = {}
+    with PckArchive() as package:
+        addAllPckFiles(package, path)
+        lang_folders = getUnpackLanguages(package)
+        entries = list(package.entries())
+        order = {id(pck): i for i, pck in enumerate(package.pcks)}
+        entries.sort(key=lambda entry: (order[id(entry.pck)], entry.offset))
+        for entry in entries:
+            target = getUnpackTarget(entry, lang_folders)
+            if target is None:
+                continue
+            if entry.kind != KIND_BANK:
+                sources[target.lower()] = getPckSource(entry.pck.path, entry.offset, entry.size)
+                continue
+            try:
+                bank = BnkReader(entry.pck.read(entry), target)
+                for wem_id, offset, size in bank.entries():
+                    embedded.setdefault(f"{os.path.dirname(target)}/{wem_id}.wem".lower(),
+                                        getPckSource(entry.pck.path, entry.offset + offset, size))
+                bank.release()
+            except ValueError as e:
+                print(f"[Bnk] ERR: {e}")
+    # loose wems win over embedded copies, like unpacking them first and extracting with -k did
+    for target, source in embedded.items():
+        sources.setdefault(target, source)
+    return sources
+
+
+def streamWemsToOgg(path="input", use_index=False, workers=None, max_pending=None, force=False):
+    # extract -> rename -> convert straight from the packages: wems never land in output/unpack or
+    # output/rename, only the oggs are written. Needs the banks unpacked and loaded first
+    # (unpackWwiseBanks(kinds=[KIND_BANK]), generateBankData, loadBankXml)
+    sources = getPckSources(path)
+    setRenameStrategy("copy", dry_run=True, sources=sources)
+    resumeCompletedFiles()
+    renameExtrenalWems()
+    renameEventWems(use_index)
+
+    mapped = set()
+    jobs = []
+    for old_file_name, new_file_name in materializer.mapping:
+        mapped.add(old_file_name.lower())
+        short_path = new_file_name.replace("output/rename/", "")[:-len(".wem")] + ".ogg"
+        jobs.append((sources.get(old_file_name.lower(), old_file_name), short_path, None))
+    for i in UNPACK_LANGUAGES:
+        for old_file_name, source in sources.items():
+            if old_file_name.startswith(f"output/unpack/{i.lower()}/") and old_file_name not in mapped:
+                jobs.append((source, f"unclassified/{i}/{os.path.basename(old_file_name)[:-len('.wem')]}.ogg", None))
+        for root, dirs, files in os.walk(f"output/unpack/{i}"):
+            for file in files:
+                old_file_name = root.replace("\\", "/") + "/" + file
+                if file.endswith(".wem") and old_file_name.lower() not in mapped and old_file_name.lower() not in sources:
+                    jobs.append((old_file_name, f"unclassified/{i}/{file[:-len('.wem')]}.ogg", None))
+    # packages are read front to back
+    def getJobOrder(job):
+        pck_source = parsePckSource(job[0])
+        return (0, pck_source[0], pck_source[1]) if pck_source else (1, job[0], 0)
+    jobs.sort(key=getJobOrder)
+
+    manifest = loadDecodeManifest()
+    skipped = 0
+    if not force:
+        pending = []
+        for source, short_path, _ in jobs:
+            up_to_date, digest = checkDecode(manifest, source, short_path)
+            if up_to_date:
+                skipped += 1
+            else:
+                pending.append((source, short_path, digest))
+        jobs = pending
+    try:
+        return transcodeJobsToOgg(jobs, manifest, workers, max_pending, lambda: skipped)
+    finally:
+        closePckSources()
+
+
+UNPACK_FOLDERS = [f"output/unpack/{i}" for i in UNPACK_LANGUAGES]
+
+
+def buildPipeline(input_path="input", stream=False, guess=False, wwiser_dumps=False, strategy="hardlink", dry_run=False):
+    # every stage of a run with what it reads and writes; stages that don't depend on each other run
+    # side by side, e.g. wwnames and bnk-extract, which only need the unpacked banks, except for the
+    # ones with a process pool (cpu_pool), which take turns.
+    # `--to unpack` only unpacks, `--to rename-event` keeps the renamed files in output/unpack.
+    # `strategy` and `dry_run` are what setRenameStrategy is given, a dry run is not a done rename
+    pipeline = Pipeline(PIPELINE_STATE)
+    pipeline.add("unpack", lambda: unpackWwiseBanks(input_path, kinds=[KIND_BANK] if stream else None),
+                 inputs=[f"{input_path}/**/*.pck"], outputs=UNPACK_FOLDERS, params=f"stream={stream}")
+    if os.path.exists("data"):
+        pipeline.add("harvest", harvestJsonNames, inputs=["data/**/*.json"], outputs=["asset_names.txt"],
+                     cpu_pool=True)
+    # writes into output/unpack, which unpacking makes
+    pipeline.add("wwnames", lambda: outputWwnames(False, guess), inputs=["asset_names.txt", "manual_names.txt"],
+                 outputs=["output/unpack/wwnames.txt"], after=["unpack"], params=f"guess={guess}")
+    if not stream:
+        pipeline.add("bnk-extract", lambda: extractBankWem(input_path), inputs=UNPACK_FOLDERS)
+
+    if wwiser_dumps:
+        pipeline.add("dump", generateBankData, inputs=UNPACK_FOLDERS + ["output/unpack/wwnames.txt", WWISER_PYZ, "wwnames.db3"],
+                     outputs=[BANK_DUMP_MANIFEST], cpu_pool=True)
+        load = lambda: loadBankXml(hirc_types=RENAME_HIRC_TYPES)
+        load_inputs = [BANK_DUMP_MANIFEST]
+    else:
+        load = lambda: loadBankData(hirc_types=RENAME_HIRC_TYPES)
+        load_inputs = UNPACK_FOLDERS + ["output/unpack/wwnames.txt", WWISER_PYZ, "wwnames.db3"]
+    # bank_dict only lives in this process, the stages reading it need "load"
+    pipeline.add("load", load, inputs=load_inputs, outputs=[BANK_STORE], params=f"dumps={wwiser_dumps}", resident=True)
+    renames_after = []
+    if guess:
+        def guessStage():
+            if guessWwnames():
+                outputWwnames(False, guess)
+                if wwiser_dumps:
+                    # the dumps are keyed on the name lists, this dumps every bank again with the guesses
+                    generateBankData()
+                load()
+        pipeline.add("guess", guessStage, inputs=["manual_names.txt"], needs=["load"], cpu_pool=True)
+        renames_after = ["guess"]
+
+    if stream:
+        pipeline.add("stream", lambda: streamWemsToOgg(input_path), inputs=[f"{input_path}/**/*.pck"],
+                     outputs=[DECODE_MANIFEST], after=renames_after, needs=["load"], cpu_pool=True)
+        return pipeline
+    rename_params = f"strategy={strategy} dry_run={dry_run}"
+    # what is moved or deleted out of output/unpack is only back once it is unpacked again
+    moves = [] if dry_run or strategy != "move" else ["unpack"]
+    pipeline.add("rename-external", renameExtrenalWems, inputs=UNPACK_FOLDERS + ["data/TableCfg/AudioDialog.json"],
+                 outputs=["output/rename", EXTERNAL_MAPPING], params=rename_params, consumes=moves)
+    # both renames share the completion journal and the skip count
+    pipeline.add("rename-event", lambda: renameEventWems(False), after=renames_after + ["bnk-extract", "rename-external"],
+                 outputs=[EVENT_MAPPING], needs=["load"], params=rename_params, consumes=moves)
+    # deletes what was renamed from output/unpack, the leftover wems go to output/rename/unclassified
+    # and are decoded as well
+    pipeline.add("cleanup", deleteCompletedFiles, after=["rename-event"], outputs=["output/rename/unclassified"],
+                 params=rename_params, consumes=[] if dry_run else ["unpack"])
+    # decodeWems for wavs
+    pipeline.add("decode", decodeWemsToOgg, inputs=["output/rename"], outputs=[DECODE_MANIFEST], after=["cleanup"],
+                 cpu_pool=True)
+    return pipeline
+
 
 if __name__ == '__main__':
+    input_path = r"E:\BeyondTools\BeyondTools.VFS\bin\Release\net9.0\output\Data\Audio"
+    # True to only get the decoded library: wems are converted straight out of the packages
+    # and never written to `output/unpack` or `output/rename`
+    stream = False
+    # True to guess names for the ids no name list resolves, from combinations of manual_names.txt
+    guess = False
+    # True to load the bank data from wwiser XML dumps (one per bank) instead of parsing the banks in-process
+    wwiser_dumps = False
+
+    parser = argparse.ArgumentParser(description="Unpack, rename and decode the Wwise audio. Stages whose "
+                                                 f"outputs are up to date are skipped, see {PIPELINE_STATE}.")
+    parser.add_argument("--from", dest="start", metavar="STAGE",
+                        help="run this stage and the ones depending on it, even if up to date")
+    parser.add_argument("--to", dest="stop", metavar="STAGE",
+                        help="stop after this stage, only running what it depends on")
+    parser.add_argument("--force", action="store_true", help="run every selected stage, up to date or not")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="hardlink",
+                        help="how renamed files are placed, falling back to a copy (default: hardlink)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only write the rename mappings, every file is left where it is")
+    # every stage's time, memory and files go to output/reports/<run>.json either way
+    parser.add_argument("--profile", action="store_true",
+                        help="also write a cProfile dump of every stage to output/reports/<run>/")
+    parser.add_argument("--trace", action="store_true",
+                        help="also trace the python allocations of every stage (much slower)")
+    args = parser.parse_args()
+    configureStages(profile=args.profile, trace_memory=args.trace)
+    pipeline = buildPipeline(input_path, stream, guess, wwiser_dumps, args.strategy, args.dry_run)
+    for name in [args.start, args.stop]:
+        if name is not None and name not in pipeline.stages:
+            parser.error(f"unknown stage {name}, expected one of {', '.join(pipeline.stages)}")
+
     print("[Main] Start!")
-    print("[Main] Start unpacking Wwise banks...")
-    unpackWwiseBanks(r"E:\BeyondTools\BeyondTools.VFS\bin\Release\net9.0\output\Data\Audio")
-    print("[Main] Start extracting bank wems...")
-    extractBankWem()
-    # if you just want to unpack but not rename, comment all lines below
-    print("[Main] Start outputting wwnames...")
-    outputWwnames(False, False)
-    print("[Main] Start generating bank data...")
-    generateBankData()
-    print("[Main] Start loading bank xml...")
-    loadBankXml()
-    print("[Main] Start renaming external wems...")
-    renameExtrenalWems()
-    print("[Main] Start renaming event wems...")
-    renameEventWems(False)
-    print("[Main] Start deleting completed files...")
-    # this program will delete the files in the `output/unpack` folder which are successfully renamed.
-    # if you want to keep them, comment the line below.
-    deleteCompletedFiles()
-    print("[Main] Start decoding wems...")
-    # decodeWems()
-    decodeWemsToOgg()
-    print("[Main] Done!")
\ No newline at end of file
+    if not stream:
+        setRenameStrategy(args.strategy, args.dry_run)
+        resumeCompletedFiles()
+    try:
+        pipeline.run(args.start, args.stop, args.force)
+    finally:
+        print(f"[Main] stage report written to {saveStageReport()}")
+    print("[Main] Done!")
@@ -0,0 +1,107 @@
+import errno
+import os
+import shutil
+
+from instrument import countWork
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux ioctl cloning a whole file (btrfs, xfs, bcachefs, ...)
+FICLONE = 0x40049409
+
+STRATEGIES = ["hardlink", "reflink", "move", "copy"]
+
+# the filesystem cannot do it here, fall back to a copy
+FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.EINVAL, errno.ENOTTY, errno.EMLINK,
+                   getattr(errno, "EOPNOTSUPP", errno.EINVAL), getattr(errno, "ENOTSUP", errno.EINVAL)}
+
+
+def reflink(source, destination):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform", source)
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+    shutil.copystat(source, destination)
+
+
+class Materializer:
+    # puts an unpacked file at its renamed path: hardlink, reflink, move or copy, falling back to a copy
+    # when the filesystem refuses. Every placement is recorded in `mapping`; dry_run only records it, and may
+    # be told which `sources` exist without them being on disk (lower-cased, the rename passes mix cases
+    # like Windows allows)
+    def __init__(self, strategy="copy", dry_run=False, sources=None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown materialize strategy {strategy}, expected one of {STRATEGIES}")
+        self.strategy = strategy
+        self.dry_run = dry_run
+        self.sources = sources if sources is not None else ()
+        self.mapping = []
+        # a moved source is gone, later destinations of the same file are made from where it went
+        self.moved = {}
+        self.moved_to = set()
+        self.stats = {}
+
+    def exists(self, source):
+        return source in self.moved or source.lower() in self.sources or os.path.exists(source)
+
+    def record(self, source, destination):
+        self.mapping.append((source, destination))
+
+    def place(self, source, destination):
+        self.record(source, destination)
+        if self.dry_run:
+            return self.strategy
+        source = self.moved.get(source, source)
+        if os.path.exists(destination):
+            os.remove(destination)
+        size = os.path.getsize(source)
+        used = "copy"
+        try:
+            if self.strategy == "hardlink":
+                os.link(source, destination)
+                used = "hardlink"
+            elif self.strategy == "reflink":
+                reflink(source, destination)
+                used = "reflink"
+            elif self.strategy == "move" and source not in self.moved_to:
+                os.replace(source, destination)
+                self.moved[source] = destination
+                self.moved_to.add(destination)
+                used = "move"
+        except OSError as e:
+            if e.errno not in FALLBACK_ERRNOS:
+                raise
+        if used == "copy":
+            shutil.copy2(source, destination)
+        count, total = self.stats.get(used, (0, 0))
+        self.stats[used] = (count + 1, total + size)
+        countWork(1, size)
+        return used
+
+    def writeMapping(self, path, start=0):
+        # the placements from the `start`th on, one "source<TAB>destination" line each
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for source, destination in self.mapping[start:]:
+                f.write(f"{source}\t{destination}\n")
+
+    def report(self, log_area="Rename"):
+        if self.dry_run:
+            print(f"[{log_area}] dry run, {len(self.mapping)} files would be placed by {self.strategy}.")
+            return
+        for used in STRATEGIES:
+            if used in self.stats:
+                count, total = self.stats[used]
+                print(f"[{log_area}] {used}: {count} files, {total / (1 << 20):.1f} MB")
+        copied = self.stats.get("copy", (0, 0))[1]
+        linked = sum(total for used, (count, total) in self.stats.items() if used != "copy")
+        print(f"[{log_area}] {copied / (1 << 20):.1f} MB copied, {linked / (1 << 20):.1f} MB linked or moved.")
+        self.stats = {}
@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fnv_index import FNV_PARAMS, HASHABLE, iterListNames, numpy
+
+SEPARATOR = "_"
+# parts of a name, e.g. the "01" of "amb_01"; only HASHABLE ones can start a candidate
+TOKEN = re.compile(r"^[a-z0-9_]+$")
+# hashes per step of the numpy search, bounds its memory
+CHUNK_HASHES = 1 << 20
+# fresh worker processes, the caller may be running other threads
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def loadTokens(paths):
+    # every name of the lists and its "_" parts, lower-cased, in order of appearance
+    tokens = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for _, name in iterListNames(path):
+            name = name.lower()
+            for token in [name] + name.split(SEPARATOR):
+                if token and TOKEN.match(token):
+                    tokens[token] = None
+    return list(tokens)
+
+
+class NameSearch:
+    # hashes "token_token_..." for every token sequence of up to `max_depth` tokens that starts with one
+    # of `first`, depth first, and keeps the names whose hash is one of `targets`
+    def __init__(self, tokens, targets, max_depth=2, bits=32):
+        self.tokens = tokens
+        self.encoded = [token.encode() for token in tokens]
+        self.targets = set(targets)
+        self.max_depth = max_depth
+        self.bits = bits
+        self.hashed = 0
+        self.matches = {}
+        if numpy is not None:
+            self.dtype = numpy.uint32 if bits == 32 else numpy.uint64
+            self.target_array = numpy.array(sorted(self.targets), dtype=self.dtype)
+            # tokens of the same length are hashed together, a byte column at a time
+            by_length = {}
+            for i, token in enumerate(self.encoded):
+                by_length.setdefault(len(token), []).append(i)
+            self.groups = [(numpy.array(indexes), numpy.frombuffer(b"".join(self.encoded[i] for i in indexes),
+                                                                   dtype=numpy.uint8).reshape(len(indexes), length))
+                           for length, indexes in by_length.items()]
+
+    def record(self, hash_num, path):
+        self.matches.setdefault(hash_num, SEPARATOR.join(self.tokens[i] for i in path))
+
+    def search(self, first, budget):
+        # stops after about `budget` hashes; returns (matches, hashes done)
+        if numpy is not None:
+            self.searchNumpy(first, budget)
+        else:
+            self.searchPython(first, budget)
+        return self.matches, self.hashed
+
+    def searchPython(self, first, budget):
+        hash_start, prime, mask = FNV_PARAMS[self.bits]
+        separator = ord(SEPARATOR)
+
+        def visit(state, path):
+            self.hashed += 1
+            if state in self.targets:
+                self.record(state, path)
+            if len(path) >= self.max_depth:
+                return
+            base = ((state * prime) & mask) ^ separator
+            for i, token in enumerate(self.encoded):
+                if self.hashed >= budget:
+                    return
+                hash_num = base
+                for c in token:
+                    hash_num = ((hash_num * prime) & mask) ^ c
+                visit(hash_num, path + (i,))
+
+        for i in first:
+            if self.hashed >= budget:
+                return
+            hash_num = hash_start
+            for c in self.encoded[i]:
+                hash_num = ((hash_num * prime) & mask) ^ c
+            visit(hash_num, (i,))
+
+    def extend(self, states, separator=True):
+        # (states, tokens) hashes of every state followed by [separator +] every token
+        prime = self.dtype(FNV_PARAMS[self.bits][1])
+        if separator:
+            states = (states * prime) ^ self.dtype(ord(SEPARATOR))
+        result = numpy.empty((len(states), len(self.tokens)), dtype=self.dtype)
+        for indexes, matrix in self.groups:
+            hashes = numpy.repeat(states[:, None], len(indexes), axis=1)
+            for column in range(matrix.shape[1]):
+                hashes *= prime
+                hashes ^= matrix[:, column]
+            result[:, indexes] = hashes
+        return result
+
+    def searchNumpy(self, first, budget):
+        first = numpy.array(first, dtype=numpy.int64)
+        start = numpy.full(1, FNV_PARAMS[self.bits][0], dtype=self.dtype)
+        self.visitNumpy(self.extend(start, separator=False)[0][first], first[:, None], budget)
+
+    def visitNumpy(self, states, paths, budget):
+        # states are the hashes of the names in `paths` (rows of token indexes)
+        self.hashed += len(states)
+        for row in numpy.nonzero(numpy.isin(states, self.target_array))[0]:
+            self.record(int(states[row]), paths[row])
+        if paths.shape[1] >= self.max_depth:
+            return
+        count = len(self.tokens)
+        step = max(1, CHUNK_HASHES // count)
+        for start in range(0, len(states), step):
+            if self.hashed >= budget:
+                return
+            hashes = self.extend(states[start:start + step])
+            rows = hashes.shape[0]
+            sub_paths = numpy.hstack([numpy.repeat(paths[start:start + step], count, axis=0),
+                                      numpy.tile(numpy.arange(count), rows)[:, None]])
+            self.visitNumpy(hashes.ravel(), sub_paths, budget)
+
+
+search = None
+
+
+def initSearch(tokens, targets, max_depth, bits):
+    global search
+    search = NameSearch(tokens, targets, max_depth, bits)
+
+
+def searchFirstTokens(first, budget):
+    search.hashed = 0
+    search.matches = {}
+    return search.search(first, budget)
+
+
+def getChanceMatches(hashed, targets, bits=32):
+    # matches `hashed` random names would get against `targets` ids
+    return hashed * targets / 2 ** bits
+
+
+def guessNames(targets, tokens, max_depth=2, budget=10 ** 9, workers=None, bits=32):
+    # (hash -> name, matches expected by chance) for the targets some token sequence hashes to; the first
+    # tokens are dealt round-robin to the worker processes, each slice with its share of the budget
+    first = [i for i, token in enumerate(tokens) if HASHABLE.match(token)]
+    if not targets or not first:
+        return {}, 0.0
+    workers = workers or os.cpu_count() or 1
+    slices = [first[i::workers * 4] for i in range(min(len(first), workers * 4))]
+    matches = {}
+    hashed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT, initializer=initSearch,
+                             initargs=(tokens, targets, max_depth, bits)) as executor:
+        futures = [executor.submit(searchFirstTokens, part, budget // len(slices)) for part in slices]
+        for future in futures:
+            found, done = future.result()
+            hashed += done
+            for hash_num, name in found.items():
+                matches.setdefault(hash_num, name)
+    elapsed = time.perf_counter() - start
+    print(f"[Guess] {hashed} names hashed in {elapsed:.2f}s, {hashed / max(elapsed, 1e-9) / 1e6:.2f} M hashes/s")
+    # FNV-32 collides: some of these are bound to be chance hits
+    chance_matches = getChanceMatches(hashed, len(targets), bits)
+    print(f"[Guess] {len(matches)} of {len(targets)} ids matched, about {chance_matches:.3g} matches expected by chance")
+    return matches, chance_matches
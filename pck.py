@@ -0,0 +1,222 @@
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+AKPK_MAGIC = b"AKPK"
+
+# entry kinds, in the order their lookup tables follow the language map
+KIND_BANK = 0
+KIND_SOUND = 1
+KIND_EXTERNAL = 2
+
+# bytes read but not written yet, across all writer threads
+DEFAULT_INFLIGHT_BYTES = 256 << 20
+
+PckEntry = namedtuple("PckEntry", ["file_id", "kind", "lang_id", "offset", "size", "pck"])
+
+
+class PckFile:
+    # one Wwise file package (AKPK): language map plus the bank, sound and external lookup tables
+    def __init__(self, path):
+        self.path = path
+        self.mmap = None
+        self.data = memoryview(b'')
+        self.languages = {}
+        self.entries = []
+        # mapped read-only and handed out as memoryview slices; the descriptor is closed right away
+        # (and not duplicated where mmap allows it), so hundreds of packages do not pin hundreds of fds
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                try:
+                    self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ, trackfd=False)
+                except TypeError:
+                    self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data = memoryview(self.mmap)
+        try:
+            self.parse()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # an entry slice is still alive, the mapping goes with it
+                pass
+            self.mmap = None
+
+    def parse(self):
+        header = bytes(self.data[:8])
+        if header[:4] != AKPK_MAGIC:
+            raise ValueError(f"{self.path} is not a Wwise file package")
+        self.endian = "<"
+        header_size = struct.unpack_from("<I", header, 4)[0]
+        if header_size > 0xFFFFFF:
+            self.endian = ">"
+            header_size = struct.unpack_from(">I", header, 4)[0]
+        data = bytes(self.data[8:8 + header_size])
+        if len(data) != header_size:
+            raise ValueError(f"{self.path} is truncated")
+        version, lang_size, banks_size, sounds_size = struct.unpack_from(self.endian + "4I", data, 0)
+        pos = 0x10
+        externals_size = 0
+        # the externals table was added later, its size field only exists when the header has room for it
+        if header_size >= 0x14 + lang_size + banks_size + sounds_size:
+            externals_size = struct.unpack_from(self.endian + "I", data, pos)[0]
+            pos += 4
+
+        self.languages = self.parseLanguages(data[pos:pos + lang_size])
+        pos += lang_size
+        for kind, size in [(KIND_BANK, banks_size), (KIND_SOUND, sounds_size), (KIND_EXTERNAL, externals_size)]:
+            self.parseTable(data[pos:pos + size], kind)
+            pos += size
+
+    def parseLanguages(self, data):
+        languages = {}
+        if len(data) < 4:
+            return languages
+        count = struct.unpack_from(self.endian + "I", data, 0)[0]
+        for i in range(count):
+            offset, lang_id = struct.unpack_from(self.endian + "2I", data, 4 + i * 8)
+            # utf-16 in most versions, plain bytes in some
+            if offset + 1 < len(data) and data[offset + 1] == 0:
+                end = offset
+                while end + 1 < len(data) and data[end:end + 2] != b"\0\0":
+                    end += 2
+                name = data[offset:end].decode("utf-16-le")
+            else:
+                end = data.find(b"\0", offset)
+                name = data[offset:end if end >= 0 else len(data)].decode("utf-8")
+            languages[lang_id] = name
+        return languages
+
+    def parseTable(self, data, kind):
+        if len(data) < 4:
+            return
+        count = struct.unpack_from(self.endian + "I", data, 0)[0]
+        if count == 0:
+            return
+        entry_size = (len(data) - 4) // count
+        # 32-bit ids for banks and sounds, 64-bit for externals (and sounds in some versions)
+        entry_format = self.endian + ("Q" if entry_size >= 24 else "I") + "4I"
+        for i in range(count):
+            file_id, block_size, size, start_block, lang_id = struct.unpack_from(entry_format, data, 4 + i * entry_size)
+            offset = start_block * block_size if block_size else start_block
+            self.entries.append(PckEntry(file_id, kind, lang_id, offset, size, self))
+
+    def read(self, entry):
+        # zero-copy view of the entry, valid until the package is closed
+        if entry.offset + entry.size > len(self.data):
+            raise ValueError(f"{entry.file_id} runs past the end of {self.path}")
+        return self.data[entry.offset:entry.offset + entry.size]
+
+
+class PckArchive:
+    # every .pck of a game, entries are kept in the order the packages were added
+    def __init__(self):
+        self.pcks = []
+        self.languages = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def addFile(self, path):
+        pck = PckFile(path)
+        self.pcks.append(pck)
+        for lang_id, name in pck.languages.items():
+            self.languages.setdefault(name.upper(), lang_id)
+        return pck
+
+    def close(self):
+        for pck in self.pcks:
+            pck.close()
+        self.pcks = []
+
+    def entries(self):
+        # first entry wins when the same file id shows up twice for a language, matched by name since
+        # every package numbers its languages on its own
+        seen = {}
+        for pck in self.pcks:
+            for entry in pck.entries:
+                key = (entry.kind, pck.languages.get(entry.lang_id, str(entry.lang_id)).upper(), entry.file_id)
+                if key in seen:
+                    print(f"[Pck] {entry.file_id} in {pck.path} collides! Keep the first one.")
+                    continue
+                seen[key] = entry
+        return seen.values()
+
+
+class InflightBudget:
+    # blocks the reader while more than `max_bytes` of read data waits for a writer
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        with self.condition:
+            # a single entry larger than the budget still goes through, alone
+            while self.inflight > 0 and self.inflight + size > self.max_bytes:
+                self.condition.wait()
+            self.inflight += size
+
+    def release(self, size):
+        with self.condition:
+            self.inflight -= size
+            self.condition.notify_all()
+
+
+def writeEntry(path, data):
+    # a new file replaces the old one instead of truncating it: the old one may be hardlinked into
+    # output/rename, which must keep what it was renamed from
+    with open(path + ".tmp", 'wb') as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def extractPckEntries(archive, getTarget, workers=None, max_inflight_bytes=DEFAULT_INFLIGHT_BYTES):
+    # reads every wanted entry in on-disk order per package and leaves the writes to a thread pool;
+    # getTarget(entry) gives the output path or None to skip it. Returns (files, bytes) written
+    jobs = []
+    for entry in archive.entries():
+        target = getTarget(entry)
+        if target is not None:
+            jobs.append((entry, target))
+    for directory in {os.path.dirname(target) for _, target in jobs}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    order = {id(pck): i for i, pck in enumerate(archive.pcks)}
+    jobs.sort(key=lambda job: (order[id(job[0].pck)], job[0].offset))
+
+    budget = InflightBudget(max_inflight_bytes)
+    written = 0
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) * 2)) as executor:
+        for entry, target in jobs:
+            budget.acquire(entry.size)
+            data = entry.pck.read(entry)
+            future = executor.submit(writeEntry, target, data)
+            future.add_done_callback(lambda _, size=entry.size: budget.release(size))
+            futures.append(future)
+            written += len(data)
+        for future in futures:
+            # re-raises the first failed write
+            future.result()
+    return len(jobs), written
@@ -0,0 +1,250 @@
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from instrument import stage as measureStage
+
+PIPELINE_STATE = "output/pipeline.json"
+
+
+class Stage:
+    # one step of a run: run() reads `inputs` and writes `outputs` (paths or globs). An input another
+    # stage outputs makes it depend on that stage, the others are files from outside (packages, name
+    # lists, tools); `after` adds dependencies with no file between them. `params` are whatever it
+    # runs with besides its inputs, changing them reruns it like a changed input does.
+    # A `resident` stage leaves its result in this process (bank_dict): when up to date it is only
+    # run again, without that counting as a change, before the first stage that `needs` it runs.
+    # A `cpu_pool` stage runs a process pool the size of the machine, those run one at a time.
+    # A stage that deletes or moves away outputs of others `consumes` them: they count as done only
+    # until a stage after them has to run again, then they run again first
+    def __init__(self, name, run, inputs=(), outputs=(), after=(), params="", resident=False, needs=(),
+                 cpu_pool=False, consumes=()):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.params = params
+        self.resident = resident
+        self.needs = list(needs)
+        self.cpu_pool = cpu_pool
+        self.consumes = list(consumes)
+
+
+class Pipeline:
+    # stages in the order they are added; a stage runs once all it depends on is done, next to
+    # every other stage that is ready, and is skipped when its outputs exist and its inputs,
+    # params and dependencies are the same as the last time it completed (kept in `state_path`)
+    def __init__(self, state_path=PIPELINE_STATE):
+        self.state_path = state_path
+        self.stages = {}
+        self.state = {}
+        self.loaded = set()
+        self.lock = threading.Lock()
+        self.resident_lock = threading.Lock()
+        self.cpu_pool_lock = threading.Lock()
+
+    def add(self, name, run, **kwargs):
+        if name in self.stages:
+            raise ValueError(f"stage {name} is already in the pipeline")
+        self.stages[name] = Stage(name, run, **kwargs)
+        return self.stages[name]
+
+    def getProducers(self):
+        producers = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                producers[output] = stage.name
+        return producers
+
+    def getDependencies(self, name):
+        stage = self.stages[name]
+        producers = self.getProducers()
+        dependencies = [producers[i] for i in stage.inputs if producers.get(i, name) != name]
+        for i in stage.after + stage.needs:
+            if i not in self.stages:
+                raise ValueError(f"stage {name} runs after {i}, which is not in the pipeline")
+            dependencies.append(i)
+        return list(dict.fromkeys(dependencies))
+
+    def getOrder(self):
+        # dependencies first, otherwise as added
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"stage {name} depends on itself")
+            visiting.add(name)
+            for i in self.getDependencies(name):
+                visit(i)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def getDescendants(self, name):
+        found = set()
+        for i in self.getOrder():
+            if any(j == name or j in found for j in self.getDependencies(i)):
+                found.add(i)
+        return found
+
+    def getAncestors(self, name):
+        found = set()
+        pending = [name]
+        while pending:
+            for i in self.getDependencies(pending.pop()):
+                if i not in found:
+                    found.add(i)
+                    pending.append(i)
+        return found
+
+    def getDigest(self, name):
+        stage = self.stages[name]
+        producers = self.getProducers()
+        files = []
+        for pattern in stage.inputs:
+            if pattern in producers:
+                continue
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                stat = os.stat(path)
+                files.append([path, stat.st_size, stat.st_mtime_ns])
+        # an upstream stage that ran again is a change, a skipped one is not
+        runs = [[i, self.state.get(i, {}).get("run")] for i in self.getDependencies(name)]
+        data = json.dumps([stage.params, files, runs])
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def isUpToDate(self, name, digest):
+        entry = self.state.get(name)
+        if entry is None or entry["digest"] != digest:
+            return False
+        return all(glob.glob(output, recursive=True) for output in self.stages[name].outputs)
+
+    def load(self):
+        self.state = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError):
+                print(f"[Pipeline] {self.state_path} is unreadable, running every stage.")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def getSelection(self, start=None, stop=None):
+        # `start` and what depends on it, up to `stop` and what it depends on
+        for name in [start, stop]:
+            if name is not None and name not in self.stages:
+                raise ValueError(f"unknown stage {name}, expected one of {list(self.stages)}")
+        selected = set(self.stages)
+        if start is not None:
+            selected &= {start} | self.getDescendants(start)
+        if stop is not None:
+            selected &= {stop} | self.getAncestors(stop)
+        return selected
+
+    def getRestored(self, selected, start=None, force=False):
+        # consumed stages a selected stage that is about to run comes after, they have to be run again
+        restored = {}
+        for name, entry in self.state.items():
+            if name not in self.stages or not entry.get("consumed"):
+                continue
+            descendants = self.getDescendants(name)
+            for i in self.getOrder():
+                if i in selected and i in descendants and (
+                        force or i == start or not self.isUpToDate(i, self.getDigest(i))):
+                    restored[name] = (entry["consumed"], i)
+                    break
+        return restored
+
+    def loadResident(self, name):
+        # the resident stages `name` needs, each run once per process
+        with self.resident_lock:
+            for i in self.stages[name].needs:
+                if not self.stages[i].resident:
+                    raise ValueError(f"stage {name} needs {i}, which is not resident")
+                if i in self.loaded:
+                    continue
+                print(f"[Pipeline] loading {i} for {name}...")
+                with measureStage(i):
+                    self.stages[i].run()
+                self.loaded.add(i)
+
+    def runStage(self, name, selected, forced):
+        stage = self.stages[name]
+        if name not in selected:
+            print(f"[Pipeline] {name} is not selected, skipped.")
+            return "unselected"
+        digest = self.getDigest(name)
+        if not forced and self.isUpToDate(name, digest):
+            print(f"[Pipeline] {name} is up to date, skipped.")
+            return "skipped"
+        self.loadResident(name)
+        with self.cpu_pool_lock if stage.cpu_pool else contextlib.nullcontext():
+            print(f"[Pipeline] running {name}...")
+            with measureStage(name):
+                stage.run()
+        if stage.resident:
+            self.loaded.add(name)
+        with self.lock:
+            self.state[name] = {"digest": digest, "run": time.time_ns()}
+            for i in stage.consumes:
+                if i in self.state:
+                    self.state[i]["consumed"] = name
+            self.save()
+        return "ran"
+
+    def run(self, start=None, stop=None, force=False, workers=None):
+        # `force` runs every selected stage, `start` is always run; a failed stage stops the run
+        # once the stages running next to it are done, what completed stays recorded
+        selected = self.getSelection(start, stop)
+        order = self.getOrder()
+        dependencies = {name: self.getDependencies(name) for name in order}
+        self.load()
+        restored = self.getRestored(selected, start, force)
+        for name, (consumer, reason) in restored.items():
+            print(f"[Pipeline] {consumer} consumed the outputs of {name}, running it again for {reason}.")
+            selected |= self.getSelection(name, stop)
+        results = {}
+        failed = []
+        pending = list(order)
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers or len(order) or 1) as executor:
+            while pending or running:
+                if not failed:
+                    for name in list(pending):
+                        if all(i in results for i in dependencies[name]):
+                            pending.remove(name)
+                            future = executor.submit(self.runStage, name, selected,
+                                                     force or name == start or name in restored)
+                            running[future] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        print(f"[Pipeline] ERR: {name} failed: {type(e).__name__}: {e}")
+                        failed.append((name, e))
+        ran = [name for name in order if results.get(name) == "ran"]
+        print(f"[Pipeline] {len(ran)} stages run, {len(results) - len(ran)} skipped, {len(failed)} failed, "
+              f"{len(pending)} not reached.")
+        if failed:
+            raise failed[0][1]
+        return results
@@ -0,0 +1,68 @@
+import os
+
+
+class CompletionRegistry:
+    # ordered set of unpacked files that made it into output/rename; with a journal every entry is also
+    # appended to disk as it is added, so an interrupted rename run resumes where it stopped
+    def __init__(self, journal_path=None):
+        self.journal_path = journal_path
+        self.journal = None
+        self.files = {}
+        self.renamed = set()
+        if journal_path is not None:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            data = f.read()
+        # drop a line torn by a crash so appending does not glue onto it
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(end)
+        for line in data[:end].decode("utf-8").splitlines():
+            file, _, destination = line.partition("\t")
+            self.files[file] = None
+            if destination:
+                self.renamed.add((file, destination))
+
+    def add(self, file, destination=None):
+        if destination is not None:
+            if (file, destination) in self.renamed:
+                return
+            self.renamed.add((file, destination))
+        elif file in self.files:
+            return
+        self.files[file] = None
+        if self.journal_path is not None:
+            if self.journal is None:
+                os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+                self.journal = open(self.journal_path, 'a', encoding="utf-8", buffering=1)
+            self.journal.write(f"{file}\t{destination}\n" if destination is not None else f"{file}\n")
+
+    def isRenamed(self, file, destination):
+        return (file, destination) in self.renamed
+
+    def __contains__(self, file):
+        return file in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def clear(self):
+        # the run finished, forget it
+        self.close()
+        if self.journal_path is not None and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.files = {}
+        self.renamed = set()
@@ -0,0 +1,72 @@
+import os
+import struct
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("wfp")
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYZ = os.path.join(ROOT, main.WWISER_PYZ)
+
+
+def fnv(name):
+    # wwiser's 32-bit FNV-1 of the lower-cased name
+    h = 2166136261
+    for c in name.lower().encode():
+        h = (h * 16777619) & 0xFFFFFFFF
+        h ^= c
+    return h
+
+
+def makeChunk(tag, body):
+    return tag + struct.pack("<I", len(body)) + body
+
+
+def makeItem(hirc_type, body):
+    return struct.pack("<BI", hirc_type, len(body)) + body
+
+
+def makeBank(path, name, count):
+    # a v134 bank with events, their play actions, sounds and actor-mixers, plus a name list next to it
+    bkhd = struct.pack("<5I", 134, fnv(name), fnv("SFX"), 0, 1234) + b"\0" * 8
+    items = []
+    for i in range(count):
+        items.append(makeItem(4, struct.pack("<IBI", fnv(f"Play_{name}_{i}"), 1, 500 + i)))
+        items.append(makeItem(3, struct.pack("<IHIB", 500 + i, 0x0403, 900 + i, 0) + b"\0" * 40))
+        items.append(makeItem(1, struct.pack("<I", 700 + i) + b"\0" * 16))
+        items.append(makeItem(7, struct.pack("<I", 800 + i) + b"\xff" * 30))
+    hirc = struct.pack("<I", len(items)) + b"".join(items)
+    with open(path, "wb") as f:
+        f.write(makeChunk(b"BKHD", bkhd) + makeChunk(b"HIRC", hirc))
+    with open(os.path.join(os.path.dirname(path), "wwnames.txt"), "w") as f:
+        f.write(name + "\n" + "".join(f"Play_{name}_{i}\n" for i in range(count)))
+
+
+@pytest.fixture(scope="module")
+def banks(tmp_path_factory):
+    if not os.path.exists(PYZ):
+        pytest.skip(f"{main.WWISER_PYZ} is not in the repository")
+    paths = []
+    for name in ["Events", "Voice"]:
+        folder = tmp_path_factory.mktemp(name)
+        paths.append(str(folder / (name + ".bnk")))
+        makeBank(paths[-1], name, 5)
+    subprocess.run([sys.executable, PYZ, "-m", "-d", "xml"] + paths, capture_output=True, check=True)
+    return paths
+
+
+@pytest.mark.parametrize("hirc_types", [None, main.RENAME_HIRC_TYPES])
+def test_bank_nodes_match_the_wwiser_dump(banks, hirc_types):
+    dumped = [node for path in banks for node in main.iterBankXml(path + ".xml", hirc_types)]
+    parsed = list(main.iterBankNodes(banks, hirc_types, pyz=PYZ))
+    assert len(parsed) == len(banks)
+    assert parsed == dumped
+
+
+def test_bank_nodes_resolve_names(banks):
+    parsed = list(main.iterBankNodes(banks, main.RENAME_HIRC_TYPES, pyz=PYZ))
+    assert "Play_Voice_4" in repr(parsed[1])
+    assert "Play_Events_0" in repr(parsed[0]) and "Play_Voice_0" not in repr(parsed[0])
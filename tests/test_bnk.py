@@ -0,0 +1,77 @@
+import os
+import struct
+
+import pytest
+
+from bnk import BnkReader, extractBank, extractBanks
+
+
+def makeBnk(wems, big_endian=False, align=16):
+    # BKHD, DIDX (id, offset, size per wem), DATA with every wem aligned, HIRC
+    e = ">" if big_endian else "<"
+    bkhd = struct.pack(e + "II", 0x8C, 1234) + bytes(8)
+    didx = b""
+    data = b""
+    for wem_id, wem in wems:
+        data += b"\0" * (-len(data) % align)
+        didx += struct.pack(e + "3I", wem_id, len(data), len(wem))
+        data += wem
+    chunks = [(b"BKHD", bkhd), (b"DIDX", didx), (b"DATA", data), (b"HIRC", bytes(4))]
+    return b"".join(tag + struct.pack(e + "I", len(body)) + body for tag, body in chunks)
+
+
+WEMS = [(10, b"RIFF ten"), (0xFFFFFFF0, b"RIFF big id" * 5), (12, b"")]
+
+
+def readFile(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("big_endian", [False, True])
+def test_reader_slices_the_data_chunk(big_endian):
+    reader = BnkReader(makeBnk(WEMS, big_endian))
+    assert [(wem_id, bytes(wem)) for wem_id, wem in reader.wems()] == WEMS
+    data_offset = reader.chunks[b"DATA"][0]
+    assert [offset - data_offset for _, offset, _ in reader.entries()] == [0, 16, 80]
+
+
+def test_reader_rejects_broken_banks():
+    with pytest.raises(ValueError):
+        BnkReader(b"RIFF" + bytes(20))
+    bank = makeBnk(WEMS)
+    with pytest.raises(ValueError):
+        BnkReader(bank[:-20])
+    # a DIDX entry past the end of DATA
+    bank = bytearray(bank)
+    didx = bank.index(b"DIDX") + 8
+    struct.pack_into("<I", bank, didx + 8, 1 << 20)
+    with pytest.raises(ValueError):
+        BnkReader(bytes(bank)).entries()
+
+
+def test_extract_replaces_what_an_older_bank_left(tmp_path):
+    with open(tmp_path / "10.wem", "wb") as f:
+        f.write(b"stale")
+    os.link(tmp_path / "10.wem", tmp_path / "renamed.wem")
+    with open(tmp_path / "a.bnk", "wb") as f:
+        f.write(makeBnk(WEMS))
+    assert extractBank(str(tmp_path / "a.bnk"), str(tmp_path)) == (3, sum(len(wem) for _, wem in WEMS))
+    for wem_id, wem in WEMS:
+        assert readFile(tmp_path / f"{wem_id}.wem") == wem
+    assert readFile(tmp_path / "renamed.wem") == b"stale"
+    assert not [file for file in os.listdir(tmp_path) if file.endswith(".tmp")]
+
+
+def test_first_bank_wins_and_loose_wems_are_kept(tmp_path):
+    loose = str(tmp_path / "12.wem")
+    with open(loose, "wb") as f:
+        f.write(b"RIFF loose")
+    banks = [(makeBnk(WEMS), str(tmp_path), "a.bnk"),
+             (makeBnk([(10, b"RIFF other ten"), (13, b"RIFF thirteen")]), str(tmp_path), "b.bnk"),
+             (b"BKHD broken", str(tmp_path), "c.bnk")]
+    count, size = extractBanks(banks, workers=1, keep=[loose])
+    assert (count, size) == (3, len(b"RIFF ten") + len(b"RIFF big id" * 5) + len(b"RIFF thirteen"))
+    assert readFile(tmp_path / "10.wem") == b"RIFF ten"
+    assert readFile(tmp_path / "12.wem") == b"RIFF loose"
+    assert readFile(tmp_path / "13.wem") == b"RIFF thirteen"
@@ -0,0 +1,377 @@
+import random
+import struct
+
+import pytest
+
+from convert_ogg import (OGG_FLAG_BOS, OGG_FLAG_CONTINUED, OGG_FLAG_EOS, OGG_NO_GRANULE, BitReader, BitWriter,
+                         WwiseOpusConverter, WwiseVorbisConverter, book_maptype1_quantvals, convert_wem,
+                         get_oggs_checksum, ilog)
+
+# CELT 20 ms, one frame: 960 samples per packet
+OPUS_TOC = 0xFC
+
+
+def makeWem(path, sizes, pre_skip=312, total_samples=None, big_endian=False):
+    # Wwise Opus (0x3041) wem with a packet size table; returns the packets
+    rng = random.Random(len(sizes))
+    packets = [bytes([OPUS_TOC]) + bytes(rng.randrange(256) for _ in range(size - 1)) for size in sizes]
+    if total_samples is None:
+        total_samples = len(packets) * 960 - pre_skip
+    e = ">" if big_endian else "<"
+    extra = struct.pack(e + "IHiIHBB", 3, 0, total_samples, len(packets), pre_skip, 1, 0)
+    fmt = struct.pack(e + "HHIIHHH", 0x3041, 2, 48000, 0, 0, 0, len(extra)) + extra
+    seek = b"".join(struct.pack(e + "H", len(packet)) for packet in packets)
+    body = b"WAVE"
+    for chunk_id, chunk in [(b"fmt ", fmt), (b"seek", seek), (b"data", b"".join(packets))]:
+        body += chunk_id + struct.pack(e + "I", len(chunk)) + chunk
+    with open(path, "wb") as f:
+        f.write((b"RIFX" if big_endian else b"RIFF") + struct.pack(e + "I", len(body)) + body)
+    return packets
+
+
+def readOgg(path):
+    # (pages, packets): pages as (flags, granule, sequence, packets ending on it), CRCs checked
+    with open(path, "rb") as f:
+        data = f.read()
+    pages = []
+    packets = []
+    partial = b""
+    pos = 0
+    while pos < len(data):
+        assert data[pos:pos + 4] == b"OggS"
+        flags, granule, _, sequence, crc, count = struct.unpack_from("<BQIIIB", data, pos + 5)
+        segments = data[pos + 27:pos + 27 + count]
+        size = 27 + count + sum(segments)
+        page = bytearray(data[pos:pos + size])
+        page[22:26] = b"\0\0\0\0"
+        assert get_oggs_checksum(page) == crc
+        assert bool(flags & OGG_FLAG_CONTINUED) == bool(partial)
+        payload = data[pos + 27 + count:pos + size]
+        ended = 0
+        offset = 0
+        for lacing in segments:
+            partial += payload[offset:offset + lacing]
+            offset += lacing
+            if lacing < 255:
+                packets.append(partial)
+                partial = b""
+                ended += 1
+        pages.append((flags, granule, sequence, ended))
+        pos += size
+    assert partial == b""
+    return pages, packets
+
+
+def convert(wem, output, **kwargs):
+    with WwiseOpusConverter(str(wem)) as converter:
+        converter.convert(str(output), **kwargs)
+    return readOgg(output)
+
+
+def getFinalGranule(pages):
+    return [granule for _, granule, _, ended in pages if ended][-1]
+
+
+@pytest.mark.parametrize("big_endian", [False, True])
+def test_packed_pages_match_one_packet_per_page(tmp_path, big_endian):
+    # the old output was one packet per page, max_page_bytes=0 still writes it that way
+    sizes = [random.Random(i).choice([80, 120, 300, 600]) for i in range(500)]
+    packets = makeWem(tmp_path / "a.wem", sizes, big_endian=big_endian)
+    old_pages, old_packets = convert(tmp_path / "a.wem", tmp_path / "old.ogg", max_page_bytes=0)
+    new_pages, new_packets = convert(tmp_path / "a.wem", tmp_path / "new.ogg")
+
+    assert new_packets == old_packets
+    assert new_packets[2:] == packets
+    assert getFinalGranule(new_pages) == getFinalGranule(old_pages) == len(packets) * 960
+    assert len(old_pages) == len(packets) + 2
+    assert len(new_pages) < len(old_pages) // 4
+
+
+def test_pages_are_flagged_and_granules_only_grow(tmp_path):
+    makeWem(tmp_path / "a.wem", [300] * 400)
+    pages, packets = convert(tmp_path / "a.wem", tmp_path / "a.ogg")
+    flags = [page[0] for page in pages]
+    assert flags[0] & OGG_FLAG_BOS and not any(i & OGG_FLAG_BOS for i in flags[1:])
+    assert flags[-1] & OGG_FLAG_EOS and not any(i & OGG_FLAG_EOS for i in flags[:-1])
+    assert [page[2] for page in pages] == list(range(len(pages)))
+    # OpusHead and OpusTags on their own pages
+    assert [page[3] for page in pages[:2]] == [1, 1]
+    granules = [granule for _, granule, _, ended in pages[2:] if ended]
+    assert granules == sorted(granules)
+
+
+def test_pre_skip_and_trimmed_end(tmp_path):
+    makeWem(tmp_path / "a.wem", [120] * 50, pre_skip=312, total_samples=50 * 960 - 312 - 100)
+    pages, packets = convert(tmp_path / "a.wem", tmp_path / "a.ogg")
+    assert packets[0][:8] == b"OpusHead"
+    assert struct.unpack_from("<H", packets[0], 10)[0] == 312
+    assert getFinalGranule(pages) == 312 + 50 * 960 - 312 - 100
+
+
+def test_long_packet_continues_on_the_next_page(tmp_path):
+    # the largest size the table can hold needs 257 lacing values, a page has 255
+    packets = makeWem(tmp_path / "a.wem", [100, 65535, 100])
+    pages, converted = convert(tmp_path / "a.wem", tmp_path / "a.ogg")
+    assert converted[2:] == packets
+    assert any(flags & OGG_FLAG_CONTINUED for flags, _, _, _ in pages)
+    assert all(granule == OGG_NO_GRANULE for _, granule, _, ended in pages if not ended)
+
+
+# ids in packed_codebooks_aoTuV_603.bin, the setup below only refers to them by position
+VORBIS_BOOKS = [5, 100, 200, 7]
+# short and long blocks, 256 and 2048 samples
+VORBIS_BLOCKSIZES = (8, 11)
+
+
+def makeVorbisSetup(rng, mode_blockflags):
+    # Wwise's stripped setup packet: codebook ids, then floor/residue/mapping/mode without the fields
+    # that are always the same
+    w = BitWriter()
+    w.write(len(VORBIS_BOOKS) - 1, 8)
+    for book in VORBIS_BOOKS:
+        w.write(book, 10)
+    # one floor: two partitions of classes 0 and 1, both 2-dimensional with one subclass bit
+    w.write(0, 6)
+    w.write(2, 5)
+    w.write(0, 4)
+    w.write(1, 4)
+    for _ in range(2):
+        w.write(1, 3)
+        w.write(1, 2)
+        w.write(2, 8)
+        w.write(0, 8)
+        w.write(3, 8)
+    w.write(1, 2)
+    w.write(7, 4)
+    for _ in range(4):
+        w.write(rng.randrange(128), 7)
+    # one type 2 residue with cascades 0b1011 and 0b100
+    w.write(0, 6)
+    w.write(2, 2)
+    for value in [0, 256, 31]:
+        w.write(value, 24)
+    w.write(1, 6)
+    w.write(1, 8)
+    w.write(3, 3)
+    w.write(1, 1)
+    w.write(1, 5)
+    w.write(4, 3)
+    w.write(0, 1)
+    for _ in range(3):
+        w.write(3, 8)
+    w.write(0, 8)
+    # one mapping coupling channel 0 and 1
+    w.write(0, 6)
+    w.write(0, 1)
+    w.write(1, 1)
+    w.write(0, 8)
+    w.write(0, 1)
+    w.write(1, 1)
+    w.write(0, 2)
+    for _ in range(3):
+        w.write(0, 8)
+    w.write(len(mode_blockflags) - 1, 6)
+    for blockflag in mode_blockflags:
+        w.write(blockflag, 1)
+        w.write(0, 8)
+    return w.getvalue()
+
+
+def makeVorbisWem(path, count, mode_blockflags=(0, 1), granules=False, big_endian=False):
+    # Wwise Vorbis (0xFFFF) wem; returns (audio packets as stored, the mode of each).
+    # granules=False: modern layout, vorb at the end of fmt, 2-byte packet headers and "modified"
+    # packets (no packet type bit, no window flags); True: 0x34 vorb chunk, 6-byte headers, plain packets
+    rng = random.Random(count)
+    e = ">" if big_endian else "<"
+    setup = makeVorbisSetup(rng, mode_blockflags)
+    mode_bits = ilog(len(mode_blockflags) - 1)
+    modes = [rng.randrange(len(mode_blockflags)) for _ in range(count)]
+    packets = []
+    for mode in modes:
+        payload = bytearray(rng.randrange(256) for _ in range(rng.randrange(1, 400)))
+        if granules:
+            payload[0] = (payload[0] & ~(((1 << mode_bits) - 1) << 1) & 0xFE) | (mode << 1)
+        else:
+            payload[0] = (payload[0] & ~((1 << mode_bits) - 1)) | mode
+        packets.append(bytes(payload))
+
+    def getHeader(packet):
+        return struct.pack(e + "H", len(packet)) + (struct.pack(e + "I", 0) if granules else b"")
+    data = getHeader(setup) + setup
+    first_audio = len(data)
+    data += b"".join(getHeader(packet) + packet for packet in packets)
+    sample_count = count * 1024
+    if granules:
+        vorb = struct.pack(e + "I", sample_count) + bytes(0x14)
+        vorb += struct.pack(e + "II", 0, first_audio) + bytes(0xC)
+        vorb += struct.pack(e + "I", 0x1234) + bytes(VORBIS_BLOCKSIZES) + bytes(2)
+        fmt = struct.pack(e + "HHIIHHH", 0xFFFF, 2, 44100, 16000, 0, 0, 6) + bytes(6)
+        chunks = [(b"fmt ", fmt), (b"vorb", vorb), (b"data", data)]
+    else:
+        vorb = struct.pack(e + "II", sample_count, 0x100) + bytes(8)
+        vorb += struct.pack(e + "II", 0, first_audio) + bytes(0xC)
+        vorb += struct.pack(e + "I", 0x1234) + bytes(VORBIS_BLOCKSIZES)
+        vorb += bytes(0x2A - len(vorb))
+        fmt = struct.pack(e + "HHIIHHH", 0xFFFF, 2, 44100, 16000, 0, 0, 0x30) + bytes(6) + vorb
+        chunks = [(b"fmt ", fmt), (b"data", data)]
+    body = b"WAVE"
+    for chunk_id, chunk in chunks:
+        body += chunk_id + struct.pack(e + "I", len(chunk)) + chunk
+    with open(path, "wb") as f:
+        f.write((b"RIFX" if big_endian else b"RIFF") + struct.pack(e + "I", len(body)) + body)
+    return packets, modes
+
+
+def readVorbisSetup(packet):
+    # walks a rebuilt setup header the way the Vorbis I spec reads it; returns the modes' block flags
+    r = BitReader(packet)
+    assert r.read(8) == 5 and bytes(r.read(8) for _ in range(6)) == b"vorbis"
+    for _ in range(r.read(8) + 1):
+        assert r.read(24) == 0x564342
+        dimensions = r.read(16)
+        entries = r.read(24)
+        if r.read(1):
+            r.read(5)
+            current = 0
+            while current < entries:
+                current += r.read(ilog(entries - current))
+            assert current == entries
+        else:
+            sparse = r.read(1)
+            for _ in range(entries):
+                if not sparse or r.read(1):
+                    r.read(5)
+        lookup_type = r.read(4)
+        assert lookup_type in (0, 1, 2)
+        if lookup_type:
+            r.read(32)
+            r.read(32)
+            value_bits = r.read(4) + 1
+            r.read(1)
+            values = book_maptype1_quantvals(entries, dimensions) if lookup_type == 1 else entries * dimensions
+            for _ in range(values):
+                r.read(value_bits)
+    for _ in range(r.read(6) + 1):
+        assert r.read(16) == 0
+    for _ in range(r.read(6) + 1):
+        assert r.read(16) == 1
+        partitions = [r.read(4) for _ in range(r.read(5))]
+        dimensions = []
+        for _ in range(max(partitions) + 1):
+            dimensions.append(r.read(3) + 1)
+            subclasses = r.read(2)
+            if subclasses:
+                r.read(8)
+            for _ in range(1 << subclasses):
+                r.read(8)
+        r.read(2)
+        range_bits = r.read(4)
+        for i in partitions:
+            for _ in range(dimensions[i]):
+                r.read(range_bits)
+    for _ in range(r.read(6) + 1):
+        assert r.read(16) <= 2
+        for _ in range(3):
+            r.read(24)
+        classifications = r.read(6) + 1
+        r.read(8)
+        cascades = []
+        for _ in range(classifications):
+            low_bits = r.read(3)
+            cascades.append(low_bits + (r.read(5) * 8 if r.read(1) else 0))
+        for cascade in cascades:
+            for k in range(8):
+                if cascade & (1 << k):
+                    r.read(8)
+    for _ in range(r.read(6) + 1):
+        assert r.read(16) == 0
+        submaps = r.read(4) + 1 if r.read(1) else 1
+        if r.read(1):
+            for _ in range(r.read(8) + 1):
+                r.read(1)
+                r.read(1)
+        assert r.read(2) == 0
+        for _ in range(submaps):
+            for _ in range(3):
+                r.read(8)
+    blockflags = []
+    for _ in range(r.read(6) + 1):
+        blockflags.append(r.read(1))
+        assert r.read(16) == 0 and r.read(16) == 0
+        r.read(8)
+    assert r.read(1) == 1
+    assert (r.pos + 7) // 8 == len(packet)
+    return blockflags
+
+
+def getRevorbGranules(modes, mode_blockflags):
+    # revorb: a packet ends (previous block + current block) / 4 samples after the one before it
+    granules = []
+    granule = 0
+    last_blocksize = 0
+    for mode in modes:
+        blocksize = 1 << VORBIS_BLOCKSIZES[mode_blockflags[mode]]
+        if last_blocksize:
+            granule += (last_blocksize + blocksize) // 4
+        last_blocksize = blocksize
+        granules.append(granule)
+    return granules
+
+
+def getPacketGranules(pages):
+    # granule of every packet that ends on a page which gives one, by packet index
+    granules = {}
+    count = 0
+    for _, granule, _, ended in pages:
+        count += ended
+        if ended:
+            granules[count - 1] = granule
+    return granules
+
+
+@pytest.mark.parametrize("mode_blockflags", [(0, 1), (1, 0, 0, 1)])
+def test_vorbis_rebuilds_headers_and_modified_packets(tmp_path, mode_blockflags):
+    packets, modes = makeVorbisWem(tmp_path / "a.wem", 300, mode_blockflags)
+    assert convert_wem(str(tmp_path / "a.wem"), str(tmp_path / "a.ogg")) == "vorbis"
+    pages, converted = readOgg(tmp_path / "a.ogg")
+
+    # ww2ogg's identification header: nominal bitrate from the average bytes per second
+    assert converted[0] == b"\x01vorbis" + struct.pack("<IBIiiiBB", 0, 2, 44100, 0, 16000 * 8, 0,
+                                                         VORBIS_BLOCKSIZES[0] | VORBIS_BLOCKSIZES[1] << 4, 1)
+    assert converted[1][:7] == b"\x03vorbis" and converted[1][-1] == 1
+    assert readVorbisSetup(converted[2]) == list(mode_blockflags)
+    assert [page[3] for page in pages[:2]] == [1, 2]
+
+    # packet type bit, mode, window flags of the neighbours for long blocks, then the stored bits
+    mode_bits = ilog(len(mode_blockflags) - 1)
+    assert len(converted) == 3 + len(packets)
+    for i, (packet, mode, rebuilt) in enumerate(zip(packets, modes, converted[3:])):
+        r = BitReader(rebuilt)
+        assert r.read(1) == 0
+        assert r.read(mode_bits) == mode
+        if mode_blockflags[mode]:
+            assert r.read(1) == (mode_blockflags[modes[i - 1]] if i > 0 else 0)
+            assert r.read(1) == (mode_blockflags[modes[i + 1]] if i + 1 < len(modes) else 0)
+        assert r.read(8 - mode_bits) == packet[0] >> mode_bits
+        assert bytes(r.read(8) for _ in range(len(packet) - 1)) == packet[1:]
+        assert r.size - r.pos < 8
+
+    granules = getRevorbGranules(modes, mode_blockflags)
+    for i, granule in getPacketGranules(pages).items():
+        if i >= 3:
+            assert granule == granules[i - 3]
+    assert pages[-1][0] & OGG_FLAG_EOS and pages[-1][1] == granules[-1]
+
+
+@pytest.mark.parametrize("big_endian", [False, True])
+def test_vorbis_packets_with_granule_headers_are_copied(tmp_path, big_endian):
+    packets, modes = makeVorbisWem(tmp_path / "a.wem", 200, granules=True, big_endian=big_endian)
+    with WwiseVorbisConverter(str(tmp_path / "a.wem")) as converter:
+        converter.convert(str(tmp_path / "a.ogg"))
+    pages, converted = readOgg(tmp_path / "a.ogg")
+    assert readVorbisSetup(converted[2]) == [0, 1]
+    assert converted[3:] == packets
+    granules = getRevorbGranules(modes, (0, 1))
+    assert pages[-1][1] == granules[-1]
+    assert all(granule == granules[i - 3] for i, granule in getPacketGranules(pages).items() if i >= 3)
+
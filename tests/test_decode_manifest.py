@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+pytest.importorskip("wfp")
+import main
+
+
+@pytest.fixture
+def decode(tmp_path, monkeypatch):
+    # decodeWemsToOgg in tmp_path with the converter replaced; returns the paths it converted
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output/rename/SFX")
+    converted = []
+
+    def convert(path, short_path):
+        converted.append(path)
+        os.makedirs(os.path.dirname(f"output/decode/{short_path}"), exist_ok=True)
+        with open(f"output/decode/{short_path}", "wb") as f:
+            f.write(b"OggS")
+        return "vorbis", path, ""
+    monkeypatch.setattr(main, "transcodeWemToOgg", convert)
+
+    def run():
+        converted.clear()
+        main.decodeWemsToOgg(workers=1)
+        return sorted(converted)
+    return run
+
+
+def writeWem(name, data, mtime):
+    path = f"output/rename/SFX/{name}"
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_touched_sources_are_hashed_by_the_worker(decode, monkeypatch):
+    same = writeWem("same.wem", b"RIFF same", 10 ** 18)
+    edited = writeWem("edited.wem", b"RIFF edit", 10 ** 18)
+    assert decode() == [edited, same]
+    assert decode() == []
+
+    writeWem("same.wem", b"RIFF same", 2 * 10 ** 18)
+    writeWem("edited.wem", b"RIFF EDIT", 2 * 10 ** 18)
+    digests = []
+    real_digest = main.fileDigest
+    monkeypatch.setattr(main, "fileDigest", lambda path: digests.append(path) or real_digest(path))
+    assert decode() == [edited]
+    # once per job, in runDecodeJob: nothing is hashed while the jobs are listed
+    assert sorted(digests) == [edited, same]
+    # the new mtime was recorded, the next run only stats
+    digests.clear()
+    assert decode() == []
+    assert digests == []
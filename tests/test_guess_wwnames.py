@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+pytest.importorskip("wfp")
+import main
+
+
+@pytest.fixture
+def guess(tmp_path, monkeypatch):
+    # guessWwnames in tmp_path with the search replaced: `found` is what guessNames returns
+    monkeypatch.chdir(tmp_path)
+    with open("manual_names.txt", "w", encoding="utf-8") as f:
+        f.write("amb\nforest\n")
+    found = {}
+    monkeypatch.setattr(main, "loadNameIndex", lambda: {})
+    monkeypatch.setattr(main, "getUnresolvedIds", lambda: set(range(3000)))
+    monkeypatch.setattr(main, "guessNames", lambda *args: (found["matches"], found["chance"]))
+
+    def run(matches, chance):
+        found["matches"] = matches
+        found["chance"] = chance
+        return main.guessWwnames()
+    return run
+
+
+def readLines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_guesses_are_applied_when_few_are_chance(guess):
+    # two tokens per name over ~2k tokens against ~3k ids expect about 3 chance matches
+    matches = {i: f"name_{i}" for i in range(100)}
+    assert guess(matches, 2.8) == 100
+    assert sorted(readLines(main.GUESSED_NAMES)) == sorted(matches.values())
+    assert not os.path.exists(main.GUESS_REVIEW)
+
+
+def test_guesses_are_reviewed_when_many_may_be_chance(guess):
+    matches = {i: f"name_{i}" for i in range(20)}
+    assert guess(matches, 2.8) == 0
+    assert not os.path.exists(main.GUESSED_NAMES)
+    assert len(readLines(main.GUESS_REVIEW)) == 1 + len(matches)
+
+
+def test_guessed_names_are_kept_once(guess):
+    matches = {i: f"name_{i}" for i in range(100)}
+    assert guess(matches, 2.8) == 100
+    assert guess(matches, 2.8) == 0
+    more = {i: f"name_{i}" for i in range(200)}
+    assert guess(more, 2.8) == 100
+    assert sorted(readLines(main.GUESSED_NAMES)) == sorted(more.values())
@@ -0,0 +1,54 @@
+import pytest
+
+import name_guess
+from fnv_index import fnv
+from name_guess import NameSearch, getChanceMatches, guessNames
+
+TOKENS = ["amb", "forest", "01", "wind", "night", "vo", "_x", "loop"]
+NAMES = ["amb_forest", "amb_forest_01", "vo_night_loop", "wind"]
+
+
+def getTargets(bits=32):
+    return {fnv(name, bits): name for name in NAMES}
+
+
+def runSearch(backend, bits=32, budget=10 ** 6):
+    search = NameSearch(TOKENS, getTargets(bits), max_depth=3, bits=bits)
+    first = list(range(len(TOKENS)))
+    if backend == "python":
+        search.searchPython(first, budget)
+    else:
+        search.searchNumpy(first, budget)
+    return search
+
+
+@pytest.mark.parametrize("bits", [32, 64])
+def test_python_search_finds_every_planted_name(bits):
+    search = runSearch("python", bits)
+    assert search.matches == getTargets(bits)
+    # every sequence of 1 to 3 tokens
+    assert search.hashed == len(TOKENS) + len(TOKENS) ** 2 + len(TOKENS) ** 3
+
+
+@pytest.mark.parametrize("bits", [32, 64])
+def test_numpy_search_matches_python(bits):
+    if name_guess.numpy is None:
+        pytest.skip("numpy is not installed")
+    python = runSearch("python", bits)
+    vectorized = runSearch("numpy", bits)
+    assert vectorized.matches == python.matches
+    assert vectorized.hashed == python.hashed
+
+
+def test_search_stops_at_budget():
+    search = runSearch("python", budget=20)
+    assert search.hashed <= 20
+
+
+def test_guess_names_reports_chance_matches():
+    targets = getTargets()
+    matches, chance_matches = guessNames(set(targets), TOKENS, max_depth=3, workers=2)
+    # "_x" can't start a name, the planted ones all start with a hashable token
+    assert matches == targets
+    assert chance_matches == pytest.approx(getChanceMatches(7 * (1 + 8 + 64), len(targets)))
+    assert guessNames(set(), TOKENS) == ({}, 0.0)
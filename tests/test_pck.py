@@ -0,0 +1,134 @@
+import os
+import struct
+
+import pytest
+
+from pck import KIND_BANK, KIND_EXTERNAL, KIND_SOUND, PckArchive, PckFile, extractPckEntries, writeEntry
+
+BLOCK_SIZE = 16
+
+
+def makeLanguages(languages, e, utf16):
+    # count, (offset, id) per language, then the names; offsets are from the start of the map
+    names = b""
+    entries = b""
+    start = 4 + 8 * len(languages)
+    for lang_id, name in languages:
+        entries += struct.pack(e + "2I", start + len(names), lang_id)
+        names += name.encode("utf-16-le") + b"\0\0" if utf16 else name.encode() + b"\0"
+    names += b"\0" * (-len(names) % 4)
+    return struct.pack(e + "I", len(languages)) + entries + names
+
+
+def makePck(path, languages, files, externals=True, sound_ids64=False, big_endian=False, utf16=True):
+    # an AKPK package; files are (kind, id, lang id, data) and are stored in reverse order, block
+    # aligned. Externals always have 64-bit ids, sounds with sound_ids64; externals=False is the older
+    # header, without the externals table. Returns (kind, id, lang id, offset, data) of every file
+    e = ">" if big_endian else "<"
+    kinds = [KIND_BANK, KIND_SOUND] + ([KIND_EXTERNAL] if externals else [])
+    wide = {KIND_EXTERNAL} | ({KIND_SOUND} if sound_ids64 else set())
+    lang = makeLanguages(languages, e, utf16)
+    table_sizes = [4 + sum(1 for i in files if i[0] == kind) * (24 if kind in wide else 20) for kind in kinds]
+    header_size = 0x10 + 4 * (len(kinds) - 2) + len(lang) + sum(table_sizes)
+    data_start = -(-(8 + header_size) // BLOCK_SIZE) * BLOCK_SIZE
+    body = b""
+    placed = {}
+    for i, file in reversed(list(enumerate(files))):
+        placed[i] = data_start + len(body)
+        body += file[3] + b"\0" * (-len(file[3]) % BLOCK_SIZE)
+    tables = b""
+    for kind in kinds:
+        entries = [i for i, file in enumerate(files) if file[0] == kind]
+        tables += struct.pack(e + "I", len(entries))
+        for i in entries:
+            _, file_id, lang_id, data = files[i]
+            id_format = "Q" if kind in wide else "I"
+            tables += struct.pack(e + id_format + "4I", file_id, BLOCK_SIZE, len(data), placed[i] // BLOCK_SIZE, lang_id)
+    header = struct.pack(e + "4I", 1, len(lang), table_sizes[0], table_sizes[1])
+    if externals:
+        header += struct.pack(e + "I", table_sizes[2])
+    out = b"AKPK" + struct.pack(e + "I", header_size) + header + lang + tables
+    with open(path, "wb") as f:
+        f.write(out + b"\0" * (data_start - len(out)) + body)
+    return [(kind, file_id, lang_id, placed[i], data) for i, (kind, file_id, lang_id, data) in enumerate(files)]
+
+
+FILES = [
+    (KIND_BANK, 0x1234, 0, b"BKHD bank"),
+    (KIND_BANK, 0x5678, 1, b"BKHD english bank"),
+    (KIND_SOUND, 0xDEADBEEF, 0, b"RIFF sound" * 7),
+    (KIND_SOUND, 77, 1, b"RIFF english"),
+    (KIND_EXTERNAL, 0xFEDCBA9876543210, 1, b"RIFF external voice"),
+    (KIND_EXTERNAL, 12, 0, b""),
+]
+
+
+def getEntries(pck):
+    return sorted((entry.kind, entry.file_id, entry.lang_id, entry.offset, bytes(pck.read(entry))) for entry in pck.entries)
+
+
+@pytest.mark.parametrize("sound_ids64", [False, True])
+@pytest.mark.parametrize("big_endian", [False, True])
+def test_tables_with_externals(tmp_path, sound_ids64, big_endian):
+    expected = makePck(tmp_path / "a.pck", [(0, "sfx"), (1, "english(us)")], FILES,
+                       sound_ids64=sound_ids64, big_endian=big_endian)
+    with PckFile(str(tmp_path / "a.pck")) as pck:
+        assert pck.languages == {0: "sfx", 1: "english(us)"}
+        assert getEntries(pck) == sorted(expected)
+
+
+@pytest.mark.parametrize("utf16", [False, True])
+def test_older_header_without_externals(tmp_path, utf16):
+    files = [file for file in FILES if file[0] != KIND_EXTERNAL]
+    expected = makePck(tmp_path / "a.pck", [(0, "sfx"), (1, "english(us)")], files, externals=False, utf16=utf16)
+    with PckFile(str(tmp_path / "a.pck")) as pck:
+        assert pck.languages == {0: "sfx", 1: "english(us)"}
+        assert getEntries(pck) == sorted(expected)
+
+
+def test_not_a_package(tmp_path):
+    with open(tmp_path / "a.pck", "wb") as f:
+        f.write(b"RIFF" + bytes(60))
+    with pytest.raises(ValueError):
+        PckFile(str(tmp_path / "a.pck"))
+
+
+def test_archive_matches_languages_by_name(tmp_path):
+    makePck(tmp_path / "a.pck", [(0, "SFX"), (1, "English(US)")],
+            [(KIND_SOUND, 10, 0, b"sfx"), (KIND_SOUND, 11, 1, b"en")])
+    # the same languages numbered the other way round, 10 is a duplicate and 11 is not
+    makePck(tmp_path / "b.pck", [(0, "English(US)"), (3, "sfx")],
+            [(KIND_SOUND, 10, 3, b"dup"), (KIND_SOUND, 11, 3, b"sfx 11")])
+    with PckArchive() as archive:
+        archive.addFile(str(tmp_path / "a.pck"))
+        archive.addFile(str(tmp_path / "b.pck"))
+        assert archive.languages == {"SFX": 0, "ENGLISH(US)": 1}
+        found = {(entry.pck.languages[entry.lang_id].upper(), entry.file_id): bytes(entry.pck.read(entry))
+                 for entry in archive.entries()}
+    assert found == {("SFX", 10): b"sfx", ("ENGLISH(US)", 11): b"en", ("SFX", 11): b"sfx 11"}
+
+
+def test_extract_entries(tmp_path):
+    expected = makePck(tmp_path / "a.pck", [(0, "sfx"), (1, "english(us)")], FILES)
+    with PckArchive() as archive:
+        archive.addFile(str(tmp_path / "a.pck"))
+        count, size = extractPckEntries(
+            archive, lambda entry: str(tmp_path / "out" / str(entry.kind) / f"{entry.file_id}.wem"), workers=2,
+            max_inflight_bytes=32)
+    assert (count, size) == (len(FILES), sum(len(file[4]) for file in expected))
+    for kind, file_id, _, _, data in expected:
+        with open(tmp_path / "out" / str(kind) / f"{file_id}.wem", "rb") as f:
+            assert f.read() == data
+
+
+def test_write_entry_replaces_the_file(tmp_path):
+    # a renamed hardlink of the old file keeps the old content
+    path = str(tmp_path / "a.wem")
+    writeEntry(path, b"old")
+    os.link(path, tmp_path / "renamed.wem")
+    writeEntry(path, b"new")
+    with open(path, "rb") as f:
+        assert f.read() == b"new"
+    with open(tmp_path / "renamed.wem", "rb") as f:
+        assert f.read() == b"old"
+    assert sorted(os.listdir(tmp_path)) == ["a.wem", "renamed.wem"]
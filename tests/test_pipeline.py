@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def writeFile(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def readFile(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class Run:
+    # unpack -> rename (reads a table) -> cleanup (deletes what was renamed from the unpack folder),
+    # the shape of the main pipeline; `ran` lists the stages run, `missing` what rename did not find.
+    # A dry run deletes nothing
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.ran = []
+        self.missing = []
+        self.pipeline = Pipeline("state.json")
+        self.pipeline.add("unpack", self.unpack, inputs=["input/*.txt"], outputs=["unpack"])
+        self.pipeline.add("rename", self.rename, inputs=["unpack", "table.txt"], outputs=["rename"],
+                          params=f"dry_run={dry_run}")
+        self.pipeline.add("cleanup", self.cleanup, after=["rename"], outputs=["rename"],
+                          params=f"dry_run={dry_run}", consumes=[] if dry_run else ["unpack"])
+
+    def unpack(self):
+        self.ran.append("unpack")
+        for file in os.listdir("input"):
+            writeFile(f"unpack/{file}", readFile(f"input/{file}"))
+
+    def rename(self):
+        self.ran.append("rename")
+        os.makedirs("rename", exist_ok=True)
+        for line in readFile("table.txt").split():
+            source, name = line.split("=")
+            if not os.path.exists(f"unpack/{source}"):
+                self.missing.append(source)
+                continue
+            writeFile(f"rename/{name}", readFile(f"unpack/{source}"))
+            writeFile("renamed.txt", (readFile("renamed.txt") if os.path.exists("renamed.txt") else "") + source + "\n")
+
+    def cleanup(self):
+        self.ran.append("cleanup")
+        if not self.dry_run and os.path.exists("renamed.txt"):
+            for source in set(readFile("renamed.txt").split()):
+                if os.path.exists(f"unpack/{source}"):
+                    os.remove(f"unpack/{source}")
+            os.remove("renamed.txt")
+
+    def run(self, **kwargs):
+        self.ran = []
+        self.missing = []
+        self.pipeline.run(**kwargs)
+        return self.ran
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writeFile("input/a.txt", "a")
+    writeFile("input/b.txt", "b")
+    writeFile("table.txt", "a.txt=one.txt")
+    return tmp_path
+
+
+def test_unchanged_run_is_skipped(tree):
+    assert Run().run() == ["unpack", "rename", "cleanup"]
+    assert Run().run() == []
+    assert not os.path.exists("unpack/a.txt")
+
+
+def test_changed_table_after_a_full_run_unpacks_again(tree):
+    Run().run()
+    writeFile("table.txt", "a.txt=one.txt b.txt=two.txt")
+    run = Run()
+    assert run.run() == ["unpack", "rename", "cleanup"]
+    assert run.missing == []
+    assert readFile("rename/one.txt") == "a" and readFile("rename/two.txt") == "b"
+    # consumed again by that cleanup, but nothing changed since
+    assert Run().run() == []
+
+
+def test_starting_after_a_consumed_stage_unpacks_again(tree):
+    Run().run()
+    run = Run()
+    assert run.run(start="rename") == ["unpack", "rename", "cleanup"]
+    assert run.missing == []
+    run = Run()
+    assert run.run(start="rename", stop="rename") == ["unpack", "rename"]
+    assert run.missing == []
+
+
+def test_dry_run_consumes_nothing(tree):
+    Run(dry_run=True).run()
+    writeFile("table.txt", "a.txt=one.txt b.txt=two.txt")
+    run = Run(dry_run=True)
+    assert run.run() == ["rename", "cleanup"]
+    assert run.missing == []
+    # the real run is not the dry one, and leaves unpack consumed
+    assert Run().run() == ["rename", "cleanup"]
+    assert Run().run(start="rename") == ["unpack", "rename", "cleanup"]